@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+STATEMENTS = [
+    "import openai",
+    "import rapida",
+    "import rapida.lock",
+    "import rapida.runs",
+    "import rapida.openai_async",
+    "import rapida.openai_proxy",
+    "from rapida.openai_async import openai",
+    "from rapida.openai_proxy import openai",
+]
+
+# What `import rapida` would cost if it loaded every feature up front, as a
+# baseline for the lazy imports.
+EAGER = ("import importlib, rapida; "
+         "[importlib.import_module(name) for name in "
+         "sorted({'rapida.' + module for module in rapida._SUBMODULES} | set(rapida._INJECTORS.values()))]")
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+import json
+create = getattr(sys.modules.get("openai.api_resources.chat_completion"), "ChatCompletion", None)
+print(json.dumps({{
+    "seconds": elapsed,
+    "modules": len(sys.modules),
+    "openai_imported": "openai" in sys.modules,
+    "patched": create is not None and not isinstance(create.__dict__["create"], classmethod),
+}}))
+"""
+
+
+def measure(statement: str, runs: int) -> dict:
+    samples = []
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, "-c", PROBE.format(statement=statement)],
+                check=True, capture_output=True, text=True, env=env,
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            samples.append(json.loads(out.stdout))
+        touched_home = os.listdir(home)
+
+    seconds = sorted(sample["seconds"] for sample in samples)
+    return {
+        "statement": statement,
+        "runs": runs,
+        "median_ms": statistics.median(seconds) * 1000,
+        "min_ms": seconds[0] * 1000,
+        "modules": samples[-1]["modules"],
+        "openai_imported": samples[-1]["openai_imported"],
+        "patched": samples[-1]["patched"],
+        "home_files_created": touched_home,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure cold import time and side effects of rapida modules.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    results = [measure(statement, args.runs) for statement in STATEMENTS]
+    lazy = next(result for result in results if result["statement"] == "import rapida")
+    eager = measure(EAGER, args.runs)
+    results = {
+        "python": sys.version.split()[0],
+        "results": results,
+        "eager": eager,
+        "comparison": {
+            "lazy_median_ms": lazy["median_ms"],
+            "eager_median_ms": eager["median_ms"],
+            "saved_ms": eager["median_ms"] - lazy["median_ms"],
+            "speedup": eager["median_ms"] / lazy["median_ms"],
+            "modules_not_loaded": eager["modules"] - lazy["modules"],
+        },
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+RAPIDA_HEADERS = {
+    "Rapida-Id": "00000000-0000-0000-0000-000000000000",
+    "Rapida-Status": "success",
+    "Rapida-Cache": "MISS",
+}
+
+
+def chat_completion(body: dict) -> dict:
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "Hello from the mock server."},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 9, "completion_tokens": 6, "total_tokens": 15},
+    }
+
+
+def chat_chunks(body: dict, tokens: int):
+    base = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-3.5-turbo"),
+    }
+    yield dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+    for i in range(tokens):
+        yield dict(base, choices=[{"index": 0, "delta": {"content": f" tok{i}"}, "finish_reason": None}])
+    yield dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+
+
+def completion(body: dict) -> dict:
+    return {
+        "id": "cmpl-mock",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": body.get("model", "text-davinci-003"),
+        "choices": [{"index": 0, "text": "Hello from the mock server.",
+                     "logprobs": None, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 5, "completion_tokens": 6, "total_tokens": 11},
+    }
+
+
+def embedding(body: dict, dims: int) -> dict:
+    inputs = body.get("input", "")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    return {
+        "object": "list",
+        "model": body.get("model", "text-embedding-ada-002"),
+        "data": [{"object": "embedding", "index": i,
+                  "embedding": [((i + j) % 97) / 97.0 for j in range(dims)]}
+                 for i in range(len(inputs))],
+        "usage": {"prompt_tokens": 8 * len(inputs), "total_tokens": 8 * len(inputs)},
+    }
+
+
+def moderation(body: dict) -> dict:
+    return {
+        "id": "modr-mock",
+        "model": "text-moderation-latest",
+        "results": [{"flagged": False, "categories": {}, "category_scores": {}}],
+    }
+
+
+# /v1/* answers like OpenAI, or like the Rapida proxy in front of it since the
+# Rapida-* headers are always set. Every other path answers like the Rapida
+# logging API (/oai/v1/log, /job, /node, ...) with an empty JSON object.
+class MockServer:
+    def __init__(self, latency: float = 0.0, stream_tokens: int = 32,
+                 embedding_dims: int = 1536):
+        self.latency = latency
+        self.stream_tokens = stream_tokens
+        self.embedding_dims = embedding_dims
+        self.counts: Dict[str, int] = {}
+        self.bytes_received: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _read(self) -> bytes:
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                path = self.path.split("?")[0]
+                with server._lock:
+                    server.counts[path] = server.counts.get(path, 0) + 1
+                    server.bytes_received[path] = server.bytes_received.get(
+                        path, 0) + len(body)
+                return body
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: dict):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                raw = self._read()
+                if not self.path.startswith("/v1/"):
+                    self._send(200, b"{}", "application/json", {})
+                    return
+
+                if server.latency:
+                    time.sleep(server.latency)
+                body = json.loads(raw or b"{}")
+                path = self.path.split("?")[0]
+                if path.endswith("/chat/completions") and body.get("stream"):
+                    events = b"".join(
+                        b"data: " + json.dumps(chunk).encode() + b"\n\n"
+                        for chunk in chat_chunks(body, server.stream_tokens))
+                    self._send(200, events + b"data: [DONE]\n\n",
+                               "text/event-stream", RAPIDA_HEADERS)
+                    return
+
+                if path.endswith("/chat/completions"):
+                    payload = chat_completion(body)
+                elif path.endswith("/completions"):
+                    payload = completion(body)
+                elif path.endswith("/embeddings"):
+                    payload = embedding(body, server.embedding_dims)
+                elif path.endswith("/moderations"):
+                    payload = moderation(body)
+                else:
+                    self._send(404, b'{"error": {"message": "not found"}}',
+                               "application/json", {})
+                    return
+                self._send(200, json.dumps(payload).encode(),
+                           "application/json", RAPIDA_HEADERS)
+
+            do_POST = _handle
+            do_PATCH = _handle
+            do_GET = _handle
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+            self.bytes_received.clear()
+
+    def __enter__(self) -> "MockServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai  # noqa: E402
+
+import rapida  # noqa: E402
+from rapida.async_logger.async_logger import RapidaAsyncLogger  # noqa: E402
+from rapida.async_logger.shipper import ShipperConfig  # noqa: E402
+from rapida.globals import rapida_global  # noqa: E402
+
+from mock_server import MockServer  # noqa: E402
+
+MODES = ["raw", "openai_async", "openai_async_shipper", "openai_proxy"]
+CALLS = ["chat", "chat_stream", "completion", "embedding"]
+VARIANTS = ["sync", "async"]
+
+MESSAGES = [{"role": "user", "content": "Say hello to the benchmark."}]
+
+
+def call_sync(call: str):
+    if call == "chat":
+        return openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=MESSAGES)
+    if call == "chat_stream":
+        return list(openai.ChatCompletion.create(model="gpt-3.5-turbo",
+                                                 messages=MESSAGES, stream=True))
+    if call == "completion":
+        return openai.Completion.create(model="text-davinci-003", prompt="Say hello")
+    if call == "embedding":
+        return openai.Embedding.create(model="text-embedding-ada-002", input="Say hello")
+    raise ValueError(call)
+
+
+async def call_async(call: str):
+    if call == "chat":
+        return await openai.ChatCompletion.acreate(model="gpt-3.5-turbo", messages=MESSAGES)
+    if call == "chat_stream":
+        stream = await openai.ChatCompletion.acreate(model="gpt-3.5-turbo",
+                                                     messages=MESSAGES, stream=True)
+        return [chunk async for chunk in stream]
+    if call == "completion":
+        return await openai.Completion.acreate(model="text-davinci-003", prompt="Say hello")
+    if call == "embedding":
+        return await openai.Embedding.acreate(model="text-embedding-ada-002", input="Say hello")
+    raise ValueError(call)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(samples: List[float], wall: float) -> dict:
+    return {
+        "iterations": len(samples),
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "throughput_per_s": len(samples) / wall if wall else 0.0,
+    }
+
+
+def run_sync(call: str, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        call_sync(call)
+    samples = []
+    wall_start = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call_sync(call)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, time.perf_counter() - wall_start)
+
+
+def run_async(call: str, iterations: int, warmup: int) -> dict:
+    async def main():
+        for _ in range(warmup):
+            await call_async(call)
+        samples = []
+        wall_start = time.perf_counter()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            await call_async(call)
+            samples.append(time.perf_counter() - start)
+        wall = time.perf_counter() - wall_start
+        await RapidaAsyncLogger.aflush_all()
+        from rapida.requester.async_requests import async_session_pool
+        await async_session_pool.close()
+        return summarize(samples, wall)
+
+    return asyncio.run(main())
+
+
+def measure_allocations(run: Callable[[], None], calls: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        run()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    return {
+        "alloc_bytes_per_call": allocated / calls,
+        "alloc_blocks_per_call": blocks / calls,
+        "peak_traced_bytes": peak,
+    }
+
+
+def configure(mode: str, server: MockServer):
+    rapida.uninstrument()
+    rapida_global.base_url = server.url
+    rapida_global.api_key = "sk-rapida-benchmark"
+    rapida_global.proxy_url = server.url + "/v1"
+    rapida_global.log_shipper = None
+    openai.api_key = "sk-benchmark"
+    openai.api_base = server.url + "/v1"
+
+    if mode == "openai_async":
+        rapida.instrument("async")
+    elif mode == "openai_async_shipper":
+        rapida_global.log_shipper = ShipperConfig(
+            flush_interval=0.05, bulk_suffix=None)
+        rapida.instrument("async")
+    elif mode == "openai_proxy":
+        # The proxy points openai at the mock proxy, so api_base becomes an
+        # upstream that is only forwarded as a header.
+        openai.api_base = "https://api.openai.com/v1"
+        rapida.instrument("proxy")
+
+
+def run_benchmarks(modes: List[str], calls: List[str], variants: List[str],
+                   iterations: int, warmup: int, alloc_iterations: int,
+                   latency: float) -> dict:
+    results = []
+    with MockServer(latency=latency) as server:
+        for mode in modes:
+            configure(mode, server)
+            for call in calls:
+                for variant in variants:
+                    server.reset_counts()
+                    if variant == "sync":
+                        timing = run_sync(call, iterations, warmup)
+                        allocations = measure_allocations(
+                            lambda: [call_sync(call) for _ in range(alloc_iterations)],
+                            alloc_iterations)
+                    else:
+                        timing = run_async(call, iterations, warmup)
+                        allocations = measure_allocations(
+                            lambda: run_async(call, alloc_iterations, 0),
+                            alloc_iterations)
+                    RapidaAsyncLogger.flush_all(timeout=10)
+                    results.append({
+                        "mode": mode,
+                        "call": call,
+                        "variant": variant,
+                        **timing,
+                        **allocations,
+                        "server_requests": dict(server.counts),
+                        "server_bytes_received": dict(server.bytes_received),
+                    })
+        rapida.uninstrument()
+
+    add_overhead(results)
+    return {
+        "python": sys.version.split()[0],
+        "openai": openai.version.VERSION,
+        "iterations": iterations,
+        "upstream_latency_ms": latency * 1000,
+        "results": results,
+    }
+
+
+def add_overhead(results: List[dict]):
+    raw: Dict[tuple, dict] = {(r["call"], r["variant"]): r
+                              for r in results if r["mode"] == "raw"}
+    for result in results:
+        baseline = raw.get((result["call"], result["variant"]))
+        if baseline is None:
+            continue
+        result["added_p50_ms"] = result["p50_ms"] - baseline["p50_ms"]
+        result["added_p99_ms"] = result["p99_ms"] - baseline["p99_ms"]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Measure the overhead of the rapida wrappers against a local mock OpenAI/Rapida server.")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--calls", nargs="+", default=CALLS, choices=CALLS)
+    parser.add_argument("--variants", nargs="+",
+                        default=VARIANTS, choices=VARIANTS)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--alloc-iterations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Simulated upstream latency in seconds")
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if "raw" not in args.modes:
+        args.modes = ["raw"] + args.modes
+
+    report = run_benchmarks(args.modes, args.calls, args.variants,
+                            args.iterations, args.warmup,
+                            args.alloc_iterations, args.latency)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import importlib
+import threading
+from typing import Optional
+
+_SUBMODULES = {
+    "async_logger",
+    "cache",
+    "embeddings",
+    "globals",
+    "lock",
+    "metrics",
+    "openai_async",
+    "openai_proxy",
+    "ratelimit",
+    "requester",
+    "retry",
+    "runs",
+    "sampling",
+    "singleflight",
+    "timing",
+    "tracing",
+    "usage",
+}
+
+_INJECTORS = {
+    "async": "rapida.openai_async.openai_injector",
+    "proxy": "rapida.openai_proxy.openai_injector",
+}
+
+_instrumented_mode: Optional[str] = None
+_instrument_lock = threading.Lock()
+
+
+def instrument(mode: str = "async"):
+    global _instrumented_mode
+    if mode not in _INJECTORS:
+        raise ValueError(
+            f"Unknown mode {mode!r}, expected one of {sorted(_INJECTORS)}")
+
+    with _instrument_lock:
+        if _instrumented_mode == mode:
+            return
+        # Both modes wrap the same OpenAI methods, so only one is active.
+        _uninstrument()
+        importlib.import_module(_INJECTORS[mode]).injector.apply_rapida_auth()
+        _instrumented_mode = mode
+
+
+def uninstrument():
+    with _instrument_lock:
+        _uninstrument()
+
+
+def _uninstrument():
+    global _instrumented_mode
+    if _instrumented_mode is not None:
+        importlib.import_module(
+            _INJECTORS[_instrumented_mode]).injector.remove_rapida_auth()
+        _instrumented_mode = None
+
+
+def instrumented_mode() -> Optional[str]:
+    return _instrumented_mode
+
+
+def init(mode: str = "async",
+         api_key: Optional[str] = None,
+         base_url: Optional[str] = None,
+         proxy_url: Optional[str] = None,
+         fail_on_error: Optional[bool] = None):
+    from rapida.globals import rapida_global
+
+    if api_key is not None:
+        rapida_global.api_key = api_key
+    if base_url is not None:
+        rapida_global.base_url = base_url
+    if proxy_url is not None:
+        rapida_global.proxy_url = proxy_url
+    if fail_on_error is not None:
+        rapida_global.fail_on_error = fail_on_error
+
+    instrument(mode)
+
+    import openai
+    return openai
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f"rapida.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
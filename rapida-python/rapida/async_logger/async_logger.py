@@ -1,17 +1,42 @@
-import dataclasses
+import asyncio
 import datetime
+import logging
 import os
+import threading
 import time
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, Optional, Set
+from rapida import metrics, tracing
 from rapida.requester import Requests
+from rapida.async_logger import encoder
+from rapida.async_logger.shipper import LogShipper, ShipperConfig
+from rapida.async_logger.spool import (LogSpool, SpoolConfig, is_retryable,
+                                       post_status)
 
 from rapida.globals.rapida import rapida_global
 
+if TYPE_CHECKING:
+    from rapida.async_logger.rollup import Rollup, RollupConfig
+
+logger = logging.getLogger(__name__)
+
+LOG_RECORDS = metrics.registry.counter(
+    "rapida_log_records", "Log records handed to the shipper, spool or uploader", ("path",))
+LOG_RECORD_BYTES = metrics.registry.histogram(
+    "rapida_log_record_bytes", "Size of encoded log records", buckets=metrics.BYTE_BUCKETS)
+LOG_ENCODE_SECONDS = metrics.registry.histogram(
+    "rapida_log_encode_seconds", "Time spent encoding log records")
+LOG_QUEUE_DEPTH = metrics.registry.gauge(
+    "rapida_log_queue_depth", "Records waiting in the background shipper queue")
+LOG_UPLOADS_IN_FLIGHT = metrics.registry.gauge(
+    "rapida_log_uploads_in_flight", "Asyncio log uploads not finished yet")
+
 
 @dataclass
 class ProviderRequest:
+    __slots__ = ("url", "json", "meta")
+
     url: str
     json: dict
     meta: dict
@@ -19,6 +44,8 @@ class ProviderRequest:
 
 @dataclass
 class ProviderResponse:
+    __slots__ = ("json", "status", "headers")
+
     json: dict
     status: int
     headers: dict
@@ -26,31 +53,57 @@ class ProviderResponse:
 
 @dataclass
 class UnixTimeStamp:
+    __slots__ = ("seconds", "milliseconds")
+
     seconds: int
     milliseconds: int
 
     @staticmethod
     def from_datetime(dt: datetime) -> 'UnixTimeStamp':
-        timestamp = dt.timestamp()
+        return UnixTimeStamp.from_timestamp(dt.timestamp())
+
+    @staticmethod
+    def from_timestamp(timestamp: float) -> 'UnixTimeStamp':
         seconds = int(timestamp)
         milliseconds = int((timestamp - seconds) * 1000)
         return UnixTimeStamp(seconds, milliseconds)
 
 
+@dataclass
+class ChunkIntervals:
+    __slots__ = ("count", "meanMs", "p95Ms", "maxMs")
+
+    count: int
+    meanMs: float
+    p95Ms: float
+    maxMs: float
+
+
 @dataclass
 class Timing:
+    __slots__ = ("startTime", "endTime", "timeToHeadersMs", "timeToFirstChunkMs",
+                 "timeToLastChunkMs", "chunkIntervals")
+
     startTime: UnixTimeStamp
     endTime: UnixTimeStamp
+    # Measured with a monotonic clock from the start of the request, None
+    # when unknown. The chunk fields are only set for streams.
+    timeToHeadersMs: Optional[float]
+    timeToFirstChunkMs: Optional[float]
+    timeToLastChunkMs: Optional[float]
+    chunkIntervals: Optional[ChunkIntervals]
 
     @staticmethod
     def from_datetimes(start: datetime, end: datetime) -> 'Timing':
         start_timestamp = UnixTimeStamp.from_datetime(start)
         end_timestamp = UnixTimeStamp.from_datetime(end)
-        return Timing(start_timestamp, end_timestamp)
+        return Timing(start_timestamp, end_timestamp, None, None, None, None)
 
 
 @dataclass
 class RapidaAyncLogRequest:
+    __slots__ = ("providerRequest", "providerResponse", "timing")
+
     providerRequest: ProviderRequest
     providerResponse: ProviderResponse
     timing: Timing
@@ -68,37 +121,218 @@ class Provider(Enum):
     ANTHROPIC = "anthropic"
 
 
+ROLLUP_PATH = "/oai/v1/log/rollup"
+
+
 class RapidaAsyncLogger:
     requests: Requests
+    shipper: Optional[LogShipper]
+    spool: Optional[LogSpool]
+    rollup: Optional["Rollup"]
+    max_concurrent_uploads: int
+
+    _global_loggers: Dict[tuple, 'RapidaAsyncLogger'] = {}
+    _global_lock = threading.Lock()
 
     def __init__(self,
                  base_url: Optional[str] = None,
                  api_key:  Optional[str] = None,
+                 shipper_config: Optional[ShipperConfig] = None,
+                 max_concurrent_uploads: int = 64,
+                 spool_config: Optional[SpoolConfig] = None,
+                 rollup_config: Optional["RollupConfig"] = None,
                  ) -> None:
-        self.requests = Requests(base_url, api_key)
+        if (base_url is None and api_key is None):
+            self.requests = Requests.from_rapida_global()
+        else:
+            self.requests = Requests(base_url, api_key)
+        self.spool = None
+        if (spool_config is not None):
+            self.spool = LogSpool(self.requests, spool_config)
+        self.shipper = None
+        if (shipper_config is not None):
+            self.shipper = LogShipper(
+                self.requests, shipper_config, spool=self.spool)
+        self.rollup = None
+        if (rollup_config is not None):
+            from rapida.async_logger.rollup import Rollup
+            self.rollup = Rollup(rollup_config, self._ship_rollup)
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self._async_requests = None
+        self._upload_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+        self._tasks: Set[asyncio.Task] = set()
 
     @staticmethod
     def from_rapida_global() -> 'RapidaAsyncLogger':
-        return RapidaAsyncLogger()
+        shipper_config = rapida_global.log_shipper
+        spool_config = rapida_global.log_spool
+        rollup_config = rapida_global.log_rollup
+        # Loggers are shared by every wrapped call using the same global
+        # settings so that the shipper thread and pending async uploads
+        # outlive a single call.
+        key = (rapida_global.base_url, rapida_global.api_key,
+               rapida_global.fail_on_error, rapida_global.pool_config,
+               rapida_global.compression, shipper_config, spool_config, rollup_config)
+        with RapidaAsyncLogger._global_lock:
+            logger = RapidaAsyncLogger._global_loggers.get(key)
+            if (logger is None):
+                logger = RapidaAsyncLogger(shipper_config=shipper_config,
+                                           spool_config=spool_config,
+                                           rollup_config=rollup_config)
+                RapidaAsyncLogger._global_loggers[key] = logger
+            return logger
+
+    @staticmethod
+    def path_for_provider(provider: Provider) -> str:
+        if provider == Provider.OPENAI or provider == Provider.AZURE_OPENAI:
+            return "/oai/v1/log"
+        elif provider == Provider.ANTHROPIC:
+            return "/anthropic/v1/log"
+        else:
+            raise ValueError(f"Unknown provider {provider}")
 
     def log(self, request: RapidaAyncLogRequest,
             provider: Provider,
             meta: Optional[RapidaMeta] = None
             ):
-        if provider == Provider.OPENAI:
-            self.requests.post(
-                json=dataclasses.asdict(request),
-                path="/oai/v1/log"
-            )
-        elif provider == Provider.AZURE_OPENAI:
+        path = RapidaAsyncLogger.path_for_provider(provider)
+        self._ship(path, self._encode(request))
+
+    @staticmethod
+    def _encode(request: RapidaAyncLogRequest) -> bytes:
+        started = time.perf_counter()
+        with tracing.span("rapida.serialize"):
+            body = encoder.dumps(request)
+        LOG_ENCODE_SECONDS.observe(time.perf_counter() - started)
+        return body
+
+    @staticmethod
+    def _count(path: str, body: bytes):
+        LOG_RECORDS.labels(path).inc()
+        LOG_RECORD_BYTES.observe(len(body))
+
+    def _ship(self, path: str, body: bytes):
+        self._count(path, body)
+        with tracing.span("rapida.ship", attributes={"rapida.log.path": path}):
+            self._ship_record(path, body)
+
+    def _ship_record(self, path: str, body: bytes):
+        if (self.shipper is not None):
+            self.shipper.submit(path, body)
+            LOG_QUEUE_DEPTH.set(self.shipper.queue_depth())
+        elif (self.spool is not None):
+            if (is_retryable(post_status(self.requests, path, body))):
+                self.spool.append(path, body)
+        else:
             self.requests.post(
-                path="/oai/v1/log",
-                json=dataclasses.asdict(request),
+                path=path,
+                data=body,
             )
-        elif provider == Provider.ANTHROPIC:
-            self.requests.post(
-                path="/anthropic/v1/log",
-                json=dataclasses.asdict(request),
+
+    def _ship_rollup(self, body: bytes):
+        # Called from the rollup thread once per window.
+        self._ship(ROLLUP_PATH, body)
+
+    def backlog(self) -> float:
+        # The fraction of the shipping queue, or of the upload slots, in use.
+        if (self.shipper is not None):
+            return self.shipper.queue_depth() / self.shipper.config.max_queue_size
+        return min(1.0, len(self._tasks) / self.max_concurrent_uploads)
+
+    @property
+    def async_requests(self):
+        if (self._async_requests is None):
+            from rapida.requester.async_requests import AsyncRequests
+            self._async_requests = AsyncRequests(
+                base_url=self.requests.base_url,
+                api_key=self.requests.api_key,
+                fail_on_error=self.requests.fail_on_error,
+                pool_config=self.requests.pool_config,
+                compression=self.requests.compression,
             )
-        else:
-            raise ValueError(f"Unknown provider {provider}")
+        return self._async_requests
+
+    async def alog(self, request: RapidaAyncLogRequest,
+                   provider: Provider,
+                   meta: Optional[RapidaMeta] = None
+                   ) -> None:
+        path = RapidaAsyncLogger.path_for_provider(provider)
+        body = self._encode(request)
+        self._count(path, body)
+        if (self.shipper is not None):
+            with tracing.span("rapida.ship", attributes={"rapida.log.path": path}):
+                self.shipper.submit(path, body)
+            LOG_QUEUE_DEPTH.set(self.shipper.queue_depth())
+            return
+
+        # The upload runs as its own task so the caller never waits on Rapida.
+        with tracing.span("rapida.ship", attributes={"rapida.log.path": path}):
+            task = asyncio.get_running_loop().create_task(
+                self._upload(path, body))
+        self._tasks.add(task)
+        task.add_done_callback(self._upload_done)
+        LOG_UPLOADS_IN_FLIGHT.set(len(self._tasks))
+
+    def _upload_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        LOG_UPLOADS_IN_FLIGHT.set(len(self._tasks))
+
+    async def _upload(self, path: str, body: bytes):
+        loop = asyncio.get_running_loop()
+        slots = self._upload_slots.get(loop)
+        if (slots is None):
+            slots = asyncio.Semaphore(self.max_concurrent_uploads)
+            self._upload_slots = {loop: slots}
+        status = None
+        try:
+            async with slots:
+                status = (await self.async_requests.post(path, data=body)).status_code
+        except Exception as e:
+            # aiohttp.ClientResponseError carries the status when
+            # fail_on_error raised on a non-200 response.
+            status = getattr(e, "status", None)
+            if (status is None):
+                logger.error(f"Failed to log to {path}: {e}")
+        if (self.spool is not None and is_retryable(status)):
+            self.spool.append(path, body)
+
+    async def aflush(self) -> None:
+        loop = asyncio.get_running_loop()
+        tasks = [t for t in self._tasks if t.get_loop() is loop]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def aclose(self) -> None:
+        await self.aflush()
+        from rapida.requester.async_requests import async_session_pool
+        await async_session_pool.close()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        if (self.shipper is None):
+            return True
+        return self.shipper.flush(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        closed = True
+        # The last partial window goes out before the shipper stops.
+        if (self.rollup is not None):
+            self.rollup.close()
+        if (self.shipper is not None):
+            closed = self.shipper.close(timeout)
+        # Whatever is still spooled is replayed by the next process.
+        if (self.spool is not None):
+            self.spool.close(timeout)
+        return closed
+
+    @staticmethod
+    def flush_all(timeout: Optional[float] = None) -> bool:
+        with RapidaAsyncLogger._global_lock:
+            loggers = list(RapidaAsyncLogger._global_loggers.values())
+        return all([logger.flush(timeout) for logger in loggers])
+
+    @staticmethod
+    async def aflush_all() -> None:
+        with RapidaAsyncLogger._global_lock:
+            loggers = list(RapidaAsyncLogger._global_loggers.values())
+        for logger in loggers:
+            await logger.aflush()
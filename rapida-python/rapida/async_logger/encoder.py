@@ -0,0 +1,61 @@
+import dataclasses
+import datetime
+import json
+from enum import Enum
+from typing import Any, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj: Any) -> Any:
+    # Records are flattened one level at a time as the encoder reaches them,
+    # so the request and response payloads are never copied.
+    slots = getattr(type(obj), "__slots__", None)
+    if slots is not None and dataclasses.is_dataclass(obj):
+        return {name: getattr(obj, name) for name in slots}
+    if dataclasses.is_dataclass(obj):
+        return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", "replace")
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    return str(obj)
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+    backend = "orjson"
+elif msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=_default)
+
+    def dumps(obj: Any) -> bytes:
+        return _msgspec_encoder.encode(obj)
+
+    backend = "msgspec"
+else:
+    _json_encoder = json.JSONEncoder(
+        default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    def dumps(obj: Any) -> bytes:
+        return _json_encoder.encode(obj).encode("utf-8")
+
+    backend = "json"
+
+
+def join_array(items: List[bytes]) -> bytes:
+    return b"[" + b",".join(items) + b"]"
@@ -0,0 +1,145 @@
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from rapida.async_logger import encoder
+from rapida.timing.sketch import QuantileSketch
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_KEY = ("__overflow__", None, None, ())
+
+
+@dataclass(frozen=True)
+class RollupConfig:
+    # Calls to these resources are aggregated instead of logged one by one.
+    resources: Tuple[str, ...] = ("Moderation", "Embedding")
+    # Seconds per window, windows are aligned to the wall clock.
+    window: float = 60.0
+    # Distinct (resource, model, user, properties) groups per window, later
+    # groups are folded into one overflow group.
+    max_groups: int = 1000
+    relative_accuracy: float = 0.01
+
+
+class _Group:
+    __slots__ = ("count", "errors", "prompt_tokens", "total_tokens", "latency")
+
+    def __init__(self, relative_accuracy: float):
+        self.count = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.total_tokens = 0
+        self.latency = QuantileSketch(relative_accuracy)
+
+
+GroupKey = Tuple[str, Optional[str], Optional[str], Tuple[Tuple[str, str], ...]]
+
+
+class Rollup:
+    def __init__(self, config: RollupConfig, ship: Callable[[bytes], None]):
+        self.config = config
+        self.ship = ship
+        self.windows_shipped = 0
+        self._groups: Dict[GroupKey, _Group] = {}
+        self._window_start = self._window_of(time.time())
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="rapida-log-rollup", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def covers(self, resource: str) -> bool:
+        return resource in self.config.resources
+
+    def _window_of(self, now: float) -> float:
+        return now - now % self.config.window
+
+    def add(self, resource: str, model: Optional[str], user_id: Optional[str],
+            properties: Optional[dict], error: bool, latency_ms: float,
+            prompt_tokens: int = 0, total_tokens: int = 0):
+        key = (resource, model, user_id,
+               tuple(sorted((str(k), str(v)) for k, v in (properties or {}).items())))
+        with self._lock:
+            group = self._groups.get(key)
+            if (group is None):
+                if (len(self._groups) >= self.config.max_groups):
+                    key = OVERFLOW_KEY
+                    group = self._groups.get(key)
+                if (group is None):
+                    group = self._groups[key] = _Group(self.config.relative_accuracy)
+            group.count += 1
+            group.errors += error
+            group.prompt_tokens += prompt_tokens
+            group.total_tokens += total_tokens
+            group.latency.add(latency_ms)
+
+    def summary(self, reset: bool = True) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            groups, start = self._groups, self._window_start
+            if (reset):
+                self._groups = {}
+                self._window_start = self._window_of(now)
+        if (not groups):
+            return None
+        return {
+            "windowStart": start,
+            "windowEnd": now,
+            "groups": [self._group_summary(key, group) for key, group in groups.items()],
+        }
+
+    @staticmethod
+    def _group_summary(key: GroupKey, group: _Group) -> dict:
+        resource, model, user_id, properties = key
+        latency = group.latency
+        return {
+            "resource": resource,
+            "model": model,
+            "userId": user_id,
+            "properties": dict(properties),
+            "overflow": key == OVERFLOW_KEY,
+            "count": group.count,
+            "errors": group.errors,
+            "promptTokens": group.prompt_tokens,
+            "totalTokens": group.total_tokens,
+            "latencyMs": {
+                "min": latency.min,
+                "max": latency.max,
+                "mean": latency.mean,
+                "p50": latency.quantile(0.5),
+                "p95": latency.quantile(0.95),
+                "p99": latency.quantile(0.99),
+                # Mergeable across processes and windows.
+                "sketch": latency.to_dict(),
+            },
+        }
+
+    def flush(self):
+        summary = self.summary()
+        if (summary is None):
+            return
+        try:
+            self.ship(encoder.dumps(summary))
+            self.windows_shipped += 1
+        except Exception as e:
+            logger.error(f"Failed to ship rollup: {e}")
+
+    def _run(self):
+        while (True):
+            now = time.time()
+            if (self._closed.wait(self._window_of(now) + self.config.window - now)):
+                return
+            self.flush()
+
+    def close(self):
+        if (self._closed.is_set()):
+            return
+        self._closed.set()
+        self._worker.join()
+        atexit.unregister(self.close)
+        self.flush()
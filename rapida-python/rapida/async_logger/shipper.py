@@ -0,0 +1,175 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from rapida import metrics
+from rapida.async_logger import encoder
+from rapida.async_logger.spool import LogSpool, is_retryable, post_status
+from rapida.requester import Requests
+
+logger = logging.getLogger(__name__)
+
+LOG_RECORDS_DROPPED = metrics.registry.counter(
+    "rapida_log_records_dropped", "Records dropped because the shipper queue was full")
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+
+
+@dataclass(frozen=True)
+class ShipperConfig:
+    flush_interval: float = 1.0
+    max_batch_size: int = 100
+    max_queue_size: int = 10000
+    overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK
+    # Only used with OverflowPolicy.BLOCK, None waits forever.
+    block_timeout: Optional[float] = None
+    # Appended to the per-record log path, e.g. /oai/v1/log -> /oai/v1/log/bulk.
+    # Set to None to send records one by one from the worker thread.
+    bulk_suffix: Optional[str] = "/bulk"
+    close_timeout: float = 5.0
+
+
+class LogShipper:
+    def __init__(self, requests: Requests, config: Optional[ShipperConfig] = None,
+                 spool: Optional[LogSpool] = None):
+        self.requests = requests
+        self.config = config or ShipperConfig()
+        # Records that overflow the queue or fail to send go to the spool
+        # instead of being dropped.
+        self.spool = spool
+        self.dropped = 0
+        self._queue: Deque[Tuple[str, bytes]] = deque()
+        self._pending = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(
+            target=self._run, name="rapida-log-shipper", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def submit(self, path: str, record: Union[bytes, dict]) -> bool:
+        if (not isinstance(record, bytes)):
+            record = encoder.dumps(record)
+        with self._cond:
+            if self._closed:
+                return False
+
+            if len(self._queue) >= self.config.max_queue_size:
+                policy = self.config.overflow_policy
+                if policy == OverflowPolicy.DROP_NEWEST:
+                    return self._overflow(path, record)
+                elif policy == OverflowPolicy.DROP_OLDEST:
+                    self._overflow(*self._queue.popleft())
+                    self._pending -= 1
+                else:
+                    has_room = self._cond.wait_for(
+                        lambda: self._closed or len(
+                            self._queue) < self.config.max_queue_size,
+                        timeout=self.config.block_timeout)
+                    if not has_room or self._closed:
+                        return self._overflow(path, record)
+
+            self._queue.append((path, record))
+            self._pending += 1
+            if len(self._queue) >= self.config.max_batch_size:
+                self._cond.notify_all()
+            return True
+
+    def _overflow(self, path: str, record: bytes) -> bool:
+        if self.spool is not None and self.spool.append(path, record):
+            return True
+        self.dropped += 1
+        LOG_RECORDS_DROPPED.inc()
+        return False
+
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            if not self._worker.is_alive():
+                return self._pending == 0
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        if timeout is None:
+            timeout = self.config.close_timeout
+        with self._cond:
+            if self._closed:
+                return self._pending == 0
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        atexit.unregister(self.close)
+        return self._pending == 0
+
+    def _next_batch(self) -> List[Tuple[str, bytes]]:
+        with self._cond:
+            deadline = time.monotonic() + self.config.flush_interval
+            while not (self._closed or self._flush_requested
+                       or len(self._queue) >= self.config.max_batch_size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.config.max_batch_size:
+                batch.append(self._queue.popleft())
+            if not self._queue:
+                self._flush_requested = False
+            # Wake up producers blocked on a full queue.
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                try:
+                    self._send(batch)
+                finally:
+                    with self._cond:
+                        self._pending -= len(batch)
+                        self._cond.notify_all()
+            elif self._closed:
+                return
+
+    def _send(self, batch: List[Tuple[str, bytes]]):
+        by_path: Dict[str, List[bytes]] = {}
+        for path, record in batch:
+            by_path.setdefault(path, []).append(record)
+
+        for path, records in by_path.items():
+            try:
+                if self.config.bulk_suffix is None:
+                    for record in records:
+                        self._spool_failed(path, [record], post_status(
+                            self.requests, path, record))
+                else:
+                    # Records are already encoded, the bulk body is spliced
+                    # together instead of being encoded again.
+                    status = post_status(self.requests, path + self.config.bulk_suffix,
+                                         b'{"logs":' + encoder.join_array(records) + b"}")
+                    self._spool_failed(path, records, status)
+            except Exception as e:
+                logger.error(
+                    f"Failed to ship {len(records)} log(s) to {path}: {e}")
+
+    def _spool_failed(self, path: str, records: List[bytes], status: Optional[int]):
+        if self.spool is None or not is_retryable(status):
+            return
+        for record in records:
+            self.spool.append(path, record)
@@ -0,0 +1,464 @@
+import atexit
+import logging
+import os
+import random
+import shutil
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from rapida.requester import Requests
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Every record is framed as payload length + crc32, then the payload, which
+# is the path length, the path and the encoded log body.
+_HEADER = struct.Struct("<II")
+_PATH_LENGTH = struct.Struct("<H")
+_SEGMENT_SUFFIX = ".seg"
+
+
+@dataclass(frozen=True)
+class SpoolConfig:
+    directory: str = "~/.rapida/spool"
+    segment_bytes: int = 4 * 1024 * 1024
+    # Oldest segments are evicted once the spool grows past this size.
+    max_bytes: int = 256 * 1024 * 1024
+    # Seconds between fsyncs of appended records, 0 syncs every record.
+    fsync_interval: float = 1.0
+    replay_batch_size: int = 100
+    initial_backoff: float = 1.0
+    max_backoff: float = 60.0
+    # A partially replayed segment is rewritten without its replayed prefix
+    # once that prefix is at least this large.
+    compact_bytes: int = 1024 * 1024
+    close_timeout: float = 5.0
+
+
+def is_retryable(status: Optional[int]) -> bool:
+    # None means the request never got a response.
+    return status is None or status in (408, 429) or status >= 500
+
+
+def post_status(requests: Requests, path: str, body: bytes) -> Optional[int]:
+    try:
+        return requests.post(path, data=body).status_code
+    except Exception as e:
+        response = getattr(e, "response", None)
+        if (response is not None):
+            return response.status_code
+        logger.error(f"Failed to log to {path}: {e}")
+        return None
+
+
+def _frame(path: str, body: bytes) -> bytes:
+    path_bytes = path.encode("utf-8")
+    payload = _PATH_LENGTH.pack(len(path_bytes)) + path_bytes + body
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_frame(f: BinaryIO) -> Optional[Tuple[str, bytes, int]]:
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    length, crc = _HEADER.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length or zlib.crc32(payload) != crc:
+        return None
+    (path_length,) = _PATH_LENGTH.unpack_from(payload)
+    path = payload[_PATH_LENGTH.size:_PATH_LENGTH.size + path_length]
+    body = payload[_PATH_LENGTH.size + path_length:]
+    return path.decode("utf-8"), body, _HEADER.size + length
+
+
+class SegmentLog:
+    # Not thread safe, LogSpool serializes access.
+    def __init__(self, directory: str, config: SpoolConfig):
+        self.directory = directory
+        self.config = config
+        self.evicted_records = 0
+        self.evicted_bytes = 0
+        self._sizes: Dict[int, int] = {}
+        self._counts: Dict[int, int] = {}
+        self._active: Optional[BinaryIO] = None
+        self._active_seq: Optional[int] = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        # (segment, byte offset, record index) of the next record to replay.
+        self._cursor: Tuple[int, int, int] = (0, 0, 0)
+        self._open()
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:012d}{_SEGMENT_SUFFIX}")
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(_SEGMENT_SUFFIX):
+                self._recover(int(name[:-len(_SEGMENT_SUFFIX)]))
+
+        self._cursor = self._read_cursor()
+        segments = self.segments
+        if segments:
+            seq, offset, index = self._cursor
+            if seq not in self._sizes or offset > self._sizes[seq]:
+                self._cursor = (segments[0], 0, 0)
+            # The newest segment keeps being appended to if it has room.
+            if self._sizes[segments[-1]] < self.config.segment_bytes:
+                self._activate(segments[-1])
+
+    def _recover(self, seq: int):
+        # A crash can leave a torn record at the end of a segment, it is cut
+        # off so appends continue from the last complete record.
+        path = self._segment_path(seq)
+        count = 0
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                frame = _read_frame(f)
+                if frame is None:
+                    break
+                count += 1
+                offset += frame[2]
+        if offset != os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self._sizes[seq] = offset
+        self._counts[seq] = count
+
+    def _read_cursor(self) -> Tuple[int, int, int]:
+        try:
+            with open(os.path.join(self.directory, "cursor"), "r") as f:
+                seq, offset, index = (int(v) for v in f.read().split())
+                return seq, offset, index
+        except (OSError, ValueError):
+            return (self.segments[0] if self._sizes else 0, 0, 0)
+
+    def _write_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            f.write("%d %d %d" % self._cursor)
+        os.replace(path + ".tmp", path)
+
+    def _activate(self, seq: int):
+        self._active = open(self._segment_path(seq), "ab")
+        self._active_seq = seq
+        self._sizes.setdefault(seq, 0)
+        self._counts.setdefault(seq, 0)
+
+    def _roll(self):
+        if self._active is not None:
+            self.sync()
+            self._active.close()
+        segments = self.segments
+        self._activate(segments[-1] + 1 if segments else 0)
+        if len(self._sizes) == 1:
+            self._cursor = (self._active_seq, 0, 0)
+
+    @property
+    def segments(self) -> List[int]:
+        return sorted(self._sizes)
+
+    @property
+    def size(self) -> int:
+        return sum(self._sizes.values())
+
+    def pending(self) -> int:
+        return sum(self._counts.values()) - self._cursor[2]
+
+    def append(self, path: str, body: bytes):
+        frame = _frame(path, body)
+        if (self._active is None or
+                (self._sizes[self._active_seq] > 0 and
+                 self._sizes[self._active_seq] + len(frame) > self.config.segment_bytes)):
+            self._roll()
+        self._active.write(frame)
+        self._active.flush()
+        self._sizes[self._active_seq] += len(frame)
+        self._counts[self._active_seq] += 1
+        self._dirty = True
+        if time.monotonic() - self._last_sync >= self.config.fsync_interval:
+            self.sync()
+        self._evict()
+
+    def sync(self):
+        if self._dirty and self._active is not None:
+            os.fsync(self._active.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _evict(self):
+        # The active segment is the newest, so it is never evicted.
+        evicted = False
+        while self.size > self.config.max_bytes and len(self._sizes) > 1:
+            seq = self.segments[0]
+            head = self._cursor[0] == seq
+            self.evicted_records += self._counts[seq] - \
+                (self._cursor[2] if head else 0)
+            self.evicted_bytes += self._sizes[seq] - \
+                (self._cursor[1] if head else 0)
+            self._remove(seq)
+            evicted = True
+        if evicted:
+            self._write_cursor()
+
+    def _remove(self, seq: int):
+        os.unlink(self._segment_path(seq))
+        del self._sizes[seq]
+        del self._counts[seq]
+        if self._cursor[0] == seq:
+            segments = self.segments
+            self._cursor = (segments[0] if segments else seq + 1, 0, 0)
+
+    def read_batch(self, limit: int) -> Tuple[List[Tuple[str, bytes]], Tuple[int, int, int]]:
+        records, ends = self.read_records(limit)
+        return records, ends[-1] if ends else self._cursor
+
+    def read_records(self, limit: int) -> Tuple[List[Tuple[str, bytes]], List[Tuple[int, int, int]]]:
+        # Also returns the cursor just past each record, to acknowledge a
+        # prefix of the batch.
+        seq, offset, index = self._cursor
+        records: List[Tuple[str, bytes]] = []
+        ends: List[Tuple[int, int, int]] = []
+        if seq not in self._sizes:
+            return records, ends
+        with open(self._segment_path(seq), "rb") as f:
+            f.seek(offset)
+            while len(records) < limit and offset < self._sizes[seq]:
+                frame = _read_frame(f)
+                if frame is None:
+                    break
+                records.append((frame[0], frame[1]))
+                offset += frame[2]
+                index += 1
+                ends.append((seq, offset, index))
+        return records, ends
+
+    def ack(self, cursor: Tuple[int, int, int]):
+        seq, offset, index = cursor
+        # The segment may have been evicted since it was read, and the
+        # cursor moved on to records that were not sent.
+        if seq not in self._sizes or seq != self._cursor[0]:
+            return
+        self._cursor = cursor
+        if offset >= self._sizes[seq]:
+            if seq == self._active_seq:
+                # Fully replayed, the active segment starts over empty.
+                self._active.truncate(0)
+                self._sizes[seq] = 0
+                self._counts[seq] = 0
+                self._cursor = (seq, 0, 0)
+            else:
+                self._remove(seq)
+        self._write_cursor()
+
+    def compact(self) -> bool:
+        seq, offset, index = self._cursor
+        if (seq not in self._sizes or seq == self._active_seq
+                or offset < self.config.compact_bytes):
+            return False
+        path = self._segment_path(seq)
+        with open(path, "rb") as src, open(path + ".tmp", "wb") as dst:
+            src.seek(offset)
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(path + ".tmp", path)
+        self._sizes[seq] -= offset
+        self._counts[seq] -= index
+        self._cursor = (seq, 0, 0)
+        self._write_cursor()
+        return True
+
+    def close(self):
+        if self._active is not None:
+            self.sync()
+            self._active.close()
+            self._active = None
+
+
+class LogSpool:
+    def __init__(self, requests: Requests, config: Optional[SpoolConfig] = None):
+        self.requests = requests
+        self.config = config or SpoolConfig()
+        self.directory = os.path.expanduser(self.config.directory)
+        self.replayed = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._failures = 0
+        # Each process spools into its own directory, directories left behind
+        # by processes that died are adopted by the replayer.
+        own_directory = os.path.join(self.directory, str(os.getpid()))
+        os.makedirs(own_directory, exist_ok=True)
+        self._lock_file = self._try_lock(own_directory)
+        self._log = SegmentLog(own_directory, self.config)
+        self._worker = threading.Thread(
+            target=self._run, name="rapida-log-spool", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    @property
+    def evicted_records(self) -> int:
+        return self._log.evicted_records
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._log.pending()
+
+    def append(self, path: str, body: bytes) -> bool:
+        with self._cond:
+            if self._closed:
+                return False
+            try:
+                self._log.append(path, body)
+            except OSError as e:
+                logger.error(f"Failed to spool log for {path}: {e}")
+                return False
+            self._cond.notify_all()
+            return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._log.pending() == 0, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        if timeout is None:
+            timeout = self.config.close_timeout
+        with self._cond:
+            if self._closed:
+                return True
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        atexit.unregister(self.close)
+        with self._cond:
+            self._log.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+        return True
+
+    def _try_lock(self, directory: str):
+        if fcntl is None:
+            return None
+        lock_file = open(os.path.join(directory, "lock"), "a")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _backoff(self) -> float:
+        backoff = min(self.config.max_backoff,
+                      self.config.initial_backoff * (2 ** (self._failures - 1)))
+        return backoff * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        next_orphan_scan = 0.0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._log.pending() > 0,
+                                    timeout=self.config.fsync_interval)
+                self._log.sync()
+                if self._closed:
+                    return
+                pending = self._log.pending()
+
+            healthy = True
+            if pending:
+                healthy = self._replay(self._log)
+            elif time.monotonic() >= next_orphan_scan:
+                healthy = self._adopt_orphans()
+                next_orphan_scan = time.monotonic() + self.config.max_backoff
+            if not healthy:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._closed, timeout=self._backoff())
+
+    def _replay(self, log: SegmentLog) -> bool:
+        # Records are read and acknowledged under the lock, but sent outside
+        # of it so appends never wait on the network.
+        while True:
+            with self._cond:
+                records, ends = log.read_records(self.config.replay_batch_size)
+                if not records:
+                    self._failures = 0
+                    self._cond.notify_all()
+                    return True
+
+            sent = 0
+            for path, body in records:
+                status = post_status(self.requests, path, body)
+                if is_retryable(status):
+                    break
+                if status is not None and status >= 300:
+                    logger.error(f"Rapida rejected a spooled log for {path} with {status}")
+                    self.rejected += 1
+                else:
+                    self.replayed += 1
+                sent += 1
+
+            with self._cond:
+                if sent == len(records):
+                    log.ack(ends[-1])
+                else:
+                    # Only the records that were sent are acknowledged, the
+                    # rest stay on disk.
+                    if sent:
+                        log.ack(ends[sent - 1])
+                    log.compact()
+                    self._failures += 1
+                    self._cond.notify_all()
+                    return False
+                self._cond.notify_all()
+                if self._closed:
+                    return True
+
+    def _adopt_orphans(self) -> bool:
+        if fcntl is None:
+            return True
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return True
+        for name in names:
+            directory = os.path.join(self.directory, name)
+            if (self._closed or not name.isdigit() or _pid_alive(int(name))
+                    or not os.path.isdir(directory)):
+                continue
+            lock_file = self._try_lock(directory)
+            if lock_file is None:
+                continue
+            try:
+                orphan = SegmentLog(directory, self.config)
+                healthy = self._replay(orphan)
+                orphan.close()
+                if healthy and orphan.pending() == 0:
+                    shutil.rmtree(directory, ignore_errors=True)
+                if not healthy:
+                    return False
+            finally:
+                lock_file.close()
+        return True
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import random
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from openai.openai_object import OpenAIObject
+
+from rapida.async_logger import encoder
+from rapida.cache.backends import CacheBackend, MemoryCache, SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["CacheBackend", "MemoryCache", "ResponseCache", "SQLiteCache"]
+
+# Arguments that differ between otherwise identical requests.
+_IGNORED_ARGS = ("request_id",)
+
+
+class ResponseCache:
+    def __init__(self, backend: Optional[CacheBackend] = None,
+                 ttl: Optional[float] = 3600.0,
+                 bucket_max_size: int = 1):
+        self.backend = backend or MemoryCache()
+        self.ttl = ttl
+        # Like Rapida-Cache-Bucket-Max-Size, up to this many responses are
+        # kept per request and one of them is picked at random once the
+        # bucket is full.
+        self.bucket_max_size = bucket_max_size
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(resource: str, body: dict) -> str:
+        canonical = {name: value for name, value in body.items()
+                     if name not in _IGNORED_ARGS and value is not None}
+        raw = json.dumps([resource, canonical], sort_keys=True,
+                         separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[dict]:
+        try:
+            bucket = self.backend.get_bucket(key)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to read from the response cache: {e}")
+            return None
+        if len(bucket) < self.bucket_max_size:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(random.choice(bucket))
+
+    def _store(self, key: str, entry: bytes):
+        try:
+            self.backend.add(key, entry, self.ttl, self.bucket_max_size)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to write to the response cache: {e}")
+
+    def record(self, key: str, result: Any) -> Any:
+        if not isinstance(result, dict):
+            return self._record_stream(key, result)
+        self._store(key, b'{"stream":false,"response":' + encoder.dumps(result) + b"}")
+        return result
+
+    async def arecord(self, key: str, result: Any) -> Any:
+        if not isinstance(result, dict):
+            return self._arecord_stream(key, result)
+        self._store(key, b'{"stream":false,"response":' + encoder.dumps(result) + b"}")
+        return result
+
+    def _record_stream(self, key: str, result: Iterator) -> Iterator:
+        # Chunks are encoded before they are handed on, and the stream is
+        # only stored if it was consumed to the end.
+        chunks = []
+        for chunk in result:
+            chunks.append(encoder.dumps(chunk))
+            yield chunk
+        self._store(key, b'{"stream":true,"chunks":' + encoder.join_array(chunks) + b"}")
+
+    async def _arecord_stream(self, key: str, result: AsyncIterator) -> AsyncIterator:
+        chunks = []
+        async for chunk in result:
+            chunks.append(encoder.dumps(chunk))
+            yield chunk
+        self._store(key, b'{"stream":true,"chunks":' + encoder.join_array(chunks) + b"}")
+
+    @staticmethod
+    def replay(entry: dict) -> Any:
+        if entry["stream"]:
+            return (OpenAIObject.construct_from(chunk) for chunk in entry["chunks"])
+        return OpenAIObject.construct_from(entry["response"])
+
+    @staticmethod
+    def areplay(entry: dict) -> Any:
+        if not entry["stream"]:
+            return OpenAIObject.construct_from(entry["response"])
+
+        async def chunks():
+            for chunk in entry["chunks"]:
+                yield OpenAIObject.construct_from(chunk)
+        return chunks()
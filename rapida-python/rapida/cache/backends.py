@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get_bucket(self, key: str) -> List[bytes]:
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: bytes, ttl: Optional[float], bucket_max_size: int):
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+
+class MemoryCache(CacheBackend):
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evicted = 0
+        # key -> [(expires_at, value)], least recently used first.
+        self._buckets: "OrderedDict[str, List[Tuple[Optional[float], bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_bucket(self, key: str) -> List[bytes]:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return []
+            live = [(expires_at, value) for expires_at, value in bucket
+                    if expires_at is None or expires_at > now]
+            if len(live) != len(bucket):
+                self._replace(key, live)
+            if live:
+                self._buckets.move_to_end(key)
+            return [value for _, value in live]
+
+    def add(self, key: str, value: bytes, ttl: Optional[float], bucket_max_size: int):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            bucket = list(self._buckets.get(key, []))
+            bucket.append((expires_at, value))
+            self._replace(key, bucket[-bucket_max_size:])
+            self._buckets.move_to_end(key)
+            while self.size > self.max_bytes:
+                _, evicted = self._buckets.popitem(last=False)
+                self.size -= sum(len(v) for _, v in evicted)
+                self.evicted += 1
+
+    def _replace(self, key: str, bucket: List[Tuple[Optional[float], bytes]]):
+        self.size -= sum(len(v) for _, v in self._buckets.pop(key, []))
+        if bucket:
+            self._buckets[key] = bucket
+            self.size += sum(len(v) for _, v in bucket)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SQLiteCache(CacheBackend):
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path or os.path.expanduser("~/.rapida/response_cache.db")
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL)")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_key ON entries (key)")
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get_bucket(self, key: str) -> List[bytes]:
+        # Wall clock time, entries are shared between processes.
+        rows = self._connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?) "
+            "ORDER BY id", (key, time.time()))
+        return [bytes(value) for (value,) in rows]
+
+    def add(self, key: str, value: bytes, ttl: Optional[float], bucket_max_size: int):
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                         (now,))
+            conn.execute("INSERT INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, value, None if ttl is None else now + ttl))
+            conn.execute(
+                "DELETE FROM entries WHERE key = ? AND id NOT IN "
+                "(SELECT id FROM entries WHERE key = ? ORDER BY id DESC LIMIT ?)",
+                (key, key, bucket_max_size))
+            self._prune(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _prune(self, conn: sqlite3.Connection):
+        # Oldest entries go first once the cache is over its size limit.
+        (size,) = conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries").fetchone()
+        if size <= self.max_bytes:
+            return
+        excess = size - self.max_bytes
+        cutoff = None
+        for entry_id, length in conn.execute("SELECT id, LENGTH(value) FROM entries ORDER BY id"):
+            excess -= length
+            cutoff = entry_id
+            if excess <= 0:
+                break
+        conn.execute("DELETE FROM entries WHERE id <= ?", (cutoff,))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM entries")
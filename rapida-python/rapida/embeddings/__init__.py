@@ -0,0 +1,20 @@
+from rapida.embeddings.batcher import (LOG_BATCHED, LOG_PER_CALL, Batch,
+                                       EmbeddingBatcher)
+from rapida.embeddings.encoding import (EMBEDDINGS_FLOAT16, EMBEDDINGS_FLOAT32,
+                                        EMBEDDINGS_FULL, EMBEDDINGS_OMIT,
+                                        EMBEDDINGS_SUMMARY, EmbeddingLogPolicy,
+                                        encode_response)
+
+__all__ = [
+    "Batch",
+    "EMBEDDINGS_FLOAT16",
+    "EMBEDDINGS_FLOAT32",
+    "EMBEDDINGS_FULL",
+    "EMBEDDINGS_OMIT",
+    "EMBEDDINGS_SUMMARY",
+    "EmbeddingBatcher",
+    "EmbeddingLogPolicy",
+    "LOG_BATCHED",
+    "LOG_PER_CALL",
+    "encode_response",
+]
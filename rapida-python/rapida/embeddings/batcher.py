@@ -0,0 +1,225 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import threading
+import uuid
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from openai.openai_object import OpenAIObject
+
+LOG_PER_CALL = "per_call"
+LOG_BATCHED = "batched"
+
+
+def single_input(body: dict) -> Optional[Tuple[str, Any]]:
+    # Returns the input kind and the single input of a call, or None when
+    # the call embeds several inputs already.
+    value = body.get("input")
+    if isinstance(value, str):
+        return "text", value
+    if isinstance(value, list) and value:
+        if all(isinstance(v, int) for v in value):
+            return "tokens", value
+        if len(value) == 1 and isinstance(value[0], str):
+            return "text", value[0]
+        if len(value) == 1 and isinstance(value[0], list):
+            return "tokens", value[0]
+    return None
+
+
+def estimate_tokens(kind: str, value: Any) -> int:
+    if kind == "tokens":
+        return len(value)
+    # Roughly four characters per token for English text.
+    return len(value) // 4 + 1
+
+
+class Batch:
+    def __init__(self, kwargs: dict):
+        self.id = str(uuid.uuid4())
+        self.kwargs = kwargs
+        self.inputs: List[Any] = []
+        self.tokens: List[int] = []
+        self.token_count = 0
+        self.request_ids: List[Optional[str]] = []
+        self.opened_at = datetime.datetime.now()
+        self.sent_at: Optional[datetime.datetime] = None
+        self.received_at: Optional[datetime.datetime] = None
+        self.response = None
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.full_async: Optional[asyncio.Event] = None
+        self.done_async: Optional[asyncio.Future] = None
+        self._by_index: Optional[Dict[int, dict]] = None
+
+    def mark_full(self):
+        self.full.set()
+        if self.full_async is not None:
+            self.full_async.set()
+
+    def __len__(self) -> int:
+        return len(self.inputs)
+
+    def request(self) -> dict:
+        return dict(self.kwargs, input=self.inputs)
+
+    def result_for(self, index: int) -> OpenAIObject:
+        if self._by_index is None:
+            self._by_index = {item["index"]: item for item in self.response["data"]}
+        data = self._by_index
+        usage = self.response.get("usage") or {}
+        # OpenAI only reports usage for the whole request, it is shared out
+        # by each input's estimated token count.
+        share = self.tokens[index] / (self.token_count or 1)
+        prompt_tokens = round(usage.get("prompt_tokens", 0) * share)
+        return OpenAIObject.construct_from({
+            "object": self.response.get("object", "list"),
+            "model": self.response.get("model"),
+            "data": [dict(data[index], index=0)],
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        })
+
+
+class EmbeddingBatcher:
+    def __init__(self,
+                 max_wait: float = 0.01,
+                 max_inputs: int = 2048,
+                 max_tokens: int = 250_000,
+                 log_mode: str = LOG_PER_CALL):
+        if log_mode not in (LOG_PER_CALL, LOG_BATCHED):
+            raise ValueError(f"Unknown log_mode {log_mode}")
+        self.max_wait = max_wait
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.log_mode = log_mode
+        self.batches_sent = 0
+        self.inputs_sent = 0
+        self._open: Dict[str, Batch] = {}
+        self._lock = threading.Lock()
+        self._async_open: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Batch]]" = \
+            weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def eligible(body: dict) -> bool:
+        return single_input(body) is not None
+
+    @staticmethod
+    def _group(kind: str, kwargs: dict) -> str:
+        # Only calls with the same model, credentials and options share a
+        # request, and text is never mixed with token arrays.
+        options = {key: value for key, value in kwargs.items()
+                   if key != "input" and value is not None}
+        raw = json.dumps([kind, options], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _join(self, open_batches: Dict[str, Batch], kwargs: dict,
+              request_id: Optional[str]) -> Tuple[Batch, int, bool]:
+        kind, value = single_input(kwargs)
+        tokens = estimate_tokens(kind, value)
+        group = self._group(kind, kwargs)
+        batch = open_batches.get(group)
+        if batch is not None and batch.token_count + tokens > self.max_tokens:
+            del open_batches[group]
+            batch.mark_full()
+            batch = None
+        leader = batch is None
+        if leader:
+            batch = open_batches[group] = Batch(
+                {key: value for key, value in kwargs.items() if key != "input"})
+        batch.inputs.append(value)
+        batch.tokens.append(tokens)
+        batch.token_count += tokens
+        batch.request_ids.append(request_id)
+        if len(batch) >= self.max_inputs or batch.token_count >= self.max_tokens:
+            del open_batches[group]
+            batch.mark_full()
+        return batch, len(batch) - 1, leader
+
+    def _close(self, open_batches: Dict[str, Batch], batch: Batch):
+        for group, candidate in list(open_batches.items()):
+            if candidate is batch:
+                del open_batches[group]
+
+    def submit(self, func: Callable[..., Any], kwargs: dict,
+               request_id: Optional[str] = None,
+               on_batch: Optional[Callable[[Batch], None]] = None) -> Tuple[OpenAIObject, Batch]:
+        with self._lock:
+            batch, index, leader = self._join(self._open, kwargs, request_id)
+
+        if leader:
+            # The first caller waits for the window to fill, then sends the
+            # whole batch on behalf of everyone in it.
+            try:
+                batch.full.wait(self.max_wait)
+                with self._lock:
+                    self._close(self._open, batch)
+                batch.response = self._send(func, batch)
+            except BaseException as e:
+                batch.error = e
+            finally:
+                with self._lock:
+                    self._close(self._open, batch)
+                batch.received_at = datetime.datetime.now()
+                batch.done.set()
+            if on_batch is not None and batch.error is None:
+                on_batch(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.result_for(index), batch
+
+    async def asubmit(self, func: Callable[..., Awaitable[Any]], kwargs: dict,
+                      request_id: Optional[str] = None,
+                      on_batch: Optional[Callable[[Batch], Awaitable[None]]] = None) -> Tuple[OpenAIObject, Batch]:
+        loop = asyncio.get_running_loop()
+        open_batches = self._async_open.setdefault(loop, {})
+        batch, index, leader = self._join(open_batches, kwargs, request_id)
+
+        if leader:
+            batch.full_async = asyncio.Event()
+            batch.done_async = loop.create_future()
+            if batch.full.is_set():
+                batch.full_async.set()
+            try:
+                try:
+                    await asyncio.wait_for(batch.full_async.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._close(open_batches, batch)
+                batch.response = await self._asend(func, batch)
+            except BaseException as e:
+                # Followers are released even if the leader is cancelled.
+                batch.error = e
+            finally:
+                self._close(open_batches, batch)
+                batch.received_at = datetime.datetime.now()
+                batch.done_async.set_result(None)
+            if on_batch is not None and batch.error is None:
+                await on_batch(batch)
+        else:
+            await asyncio.shield(batch.done_async)
+            if isinstance(batch.error, asyncio.CancelledError):
+                # The leader was cancelled, not this caller, so the input is
+                # submitted again.
+                return await self.asubmit(func, kwargs, request_id, on_batch)
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.result_for(index), batch
+
+    def _send(self, func: Callable[..., Any], batch: Batch):
+        batch.sent_at = datetime.datetime.now()
+        self.batches_sent += 1
+        self.inputs_sent += len(batch)
+        return func(**batch.request())
+
+    async def _asend(self, func: Callable[..., Awaitable[Any]], batch: Batch):
+        batch.sent_at = datetime.datetime.now()
+        self.batches_sent += 1
+        self.inputs_sent += len(batch)
+        return await func(**batch.request())
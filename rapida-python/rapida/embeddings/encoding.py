@@ -0,0 +1,111 @@
+import array
+import base64
+import hashlib
+import math
+import struct
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EMBEDDINGS_FULL = "full"
+EMBEDDINGS_FLOAT32 = "float32"
+EMBEDDINGS_FLOAT16 = "float16"
+EMBEDDINGS_SUMMARY = "summary"
+EMBEDDINGS_OMIT = "omit"
+
+_MODES = (EMBEDDINGS_FULL, EMBEDDINGS_FLOAT32, EMBEDDINGS_FLOAT16, EMBEDDINGS_SUMMARY, EMBEDDINGS_OMIT)
+
+
+@dataclass(frozen=True)
+class EmbeddingLogPolicy:
+    # How vectors in logged Embedding responses are written, optionally per
+    # model. The caller always gets the full response.
+    mode: str = EMBEDDINGS_FLOAT32
+    models: Optional[Dict[str, str]] = None
+
+    def __post_init__(self):
+        for mode in [self.mode] + list((self.models or {}).values()):
+            if (mode not in _MODES):
+                raise ValueError(f"Unknown embedding log mode {mode}, expected one of {_MODES}")
+
+    def mode_for(self, model: Optional[str]) -> str:
+        return (self.models or {}).get(model, self.mode)
+
+
+def _decode(embedding: Any) -> Any:
+    # Calls made with encoding_format="base64" return packed float32.
+    if (isinstance(embedding, str)):
+        values = array.array("f")
+        values.frombytes(base64.b64decode(embedding))
+        if (sys.byteorder == "big"):
+            values.byteswap()
+        return values
+    return embedding
+
+
+def _float32_bytes(vector: Any) -> bytes:
+    values = array.array("f", vector)
+    if (sys.byteorder == "big"):
+        values.byteswap()
+    return values.tobytes()
+
+
+def _float16_bytes(vector: Any) -> bytes:
+    return struct.pack(f"<{len(vector)}e", *vector)
+
+
+def _summary(dims: int, norm: float, packed: bytes) -> dict:
+    return {
+        "dims": dims,
+        "norm": round(norm, 6),
+        "sha256": hashlib.sha256(packed).hexdigest()[:16],
+    }
+
+
+def _encode_numpy(vectors: List[Any], mode: str) -> List[dict]:
+    # All vectors of a response have the same length, so they are packed
+    # as one matrix.
+    matrix = numpy.asarray(vectors, dtype="<f4")
+    if (mode == EMBEDDINGS_SUMMARY):
+        norms = numpy.linalg.norm(matrix, axis=1)
+        return [_summary(len(row), float(norm), row.tobytes()) for row, norm in zip(matrix, norms)]
+    if (mode == EMBEDDINGS_FLOAT16):
+        matrix = matrix.astype("<f2")
+    return [{"embedding": base64.b64encode(row.tobytes()).decode("ascii"),
+             "encoding_format": "base64", "dtype": mode, "dims": len(row)} for row in matrix]
+
+
+def _encode_python(vectors: List[Any], mode: str) -> List[dict]:
+    items = []
+    for vector in vectors:
+        if (mode == EMBEDDINGS_SUMMARY):
+            items.append(_summary(len(vector), math.hypot(*vector), _float32_bytes(vector)))
+            continue
+        packed = _float16_bytes(vector) if mode == EMBEDDINGS_FLOAT16 else _float32_bytes(vector)
+        items.append({"embedding": base64.b64encode(packed).decode("ascii"),
+                      "encoding_format": "base64", "dtype": mode, "dims": len(vector)})
+    return items
+
+
+def encode_response(response: Any, mode: str) -> Any:
+    # Returns a copy of the response for logging, the original is untouched.
+    if (mode == EMBEDDINGS_FULL or not isinstance(response, dict)):
+        return response
+    data = response.get("data")
+    if (not data):
+        return response
+
+    items = [{key: value for key, value in item.items() if key != "embedding"} for item in data]
+    if (mode != EMBEDDINGS_OMIT):
+        vectors = [_decode(item.get("embedding")) for item in data]
+        encode = _encode_numpy if numpy is not None else _encode_python
+        for item, encoded in zip(items, encode(vectors, mode)):
+            item.update(encoded)
+    logged = dict(response)
+    logged["data"] = items
+    return logged
@@ -1,9 +1,24 @@
 
 
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 import os
 
+if TYPE_CHECKING:
+    from rapida.async_logger.shipper import ShipperConfig
+    from rapida.async_logger.rollup import RollupConfig
+    from rapida.async_logger.spool import SpoolConfig
+    from rapida.cache import ResponseCache
+    from rapida.embeddings import EmbeddingBatcher, EmbeddingLogPolicy
+    from rapida.ratelimit import RateLimiter
+    from rapida.retry import RetryEngine
+    from rapida.sampling import Sampler
+    from rapida.tracing import Tracer
+    from rapida.usage import UsageEstimator
+    from rapida.singleflight import SingleFlight
+    from rapida.requester import PoolConfig
+    from rapida.requester.compression import CompressionConfig
+
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +28,20 @@ class RapidaGlobal:
     _base_url: Optional[str]
     _proxy_url: Optional[str]
     _fail_on_error: bool = False
+    _log_shipper: Optional["ShipperConfig"] = None
+    _log_spool: Optional["SpoolConfig"] = None
+    _log_rollup: Optional["RollupConfig"] = None
+    _pool_config: Optional["PoolConfig"] = None
+    _compression: Optional["CompressionConfig"] = None
+    _response_cache: Optional["ResponseCache"] = None
+    _single_flight: Optional["SingleFlight"] = None
+    _embedding_batcher: Optional["EmbeddingBatcher"] = None
+    _embedding_log_policy: Optional["EmbeddingLogPolicy"] = None
+    _rate_limiter: Optional["RateLimiter"] = None
+    _retry_engine: Optional["RetryEngine"] = None
+    _sampler: Optional["Sampler"] = None
+    _usage_estimator: Optional["UsageEstimator"] = None
+    _tracer: Optional["Tracer"] = None
 
     def __init__(self,
                  api_key: Optional[str] = None,
@@ -34,6 +63,121 @@ class RapidaGlobal:
     def fail_on_error(self, value: bool):
         self._fail_on_error = value
 
+    @property
+    def log_shipper(self) -> Optional["ShipperConfig"]:
+        return self._log_shipper
+
+    @log_shipper.setter
+    def log_shipper(self, value: Optional["ShipperConfig"]):
+        self._log_shipper = value
+
+    @property
+    def log_spool(self) -> Optional["SpoolConfig"]:
+        return self._log_spool
+
+    @log_spool.setter
+    def log_spool(self, value: Optional["SpoolConfig"]):
+        self._log_spool = value
+
+    @property
+    def log_rollup(self) -> Optional["RollupConfig"]:
+        return self._log_rollup
+
+    @log_rollup.setter
+    def log_rollup(self, value: Optional["RollupConfig"]):
+        self._log_rollup = value
+
+    @property
+    def pool_config(self) -> "PoolConfig":
+        if (self._pool_config is None):
+            from rapida.requester import PoolConfig
+            return PoolConfig()
+        return self._pool_config
+
+    @pool_config.setter
+    def pool_config(self, value: Optional["PoolConfig"]):
+        self._pool_config = value
+
+    @property
+    def compression(self) -> Optional["CompressionConfig"]:
+        return self._compression
+
+    @compression.setter
+    def compression(self, value: Optional["CompressionConfig"]):
+        self._compression = value
+
+    @property
+    def response_cache(self) -> Optional["ResponseCache"]:
+        return self._response_cache
+
+    @response_cache.setter
+    def response_cache(self, value: Optional["ResponseCache"]):
+        self._response_cache = value
+
+    @property
+    def single_flight(self) -> Optional["SingleFlight"]:
+        return self._single_flight
+
+    @single_flight.setter
+    def single_flight(self, value: Optional["SingleFlight"]):
+        self._single_flight = value
+
+    @property
+    def embedding_batcher(self) -> Optional["EmbeddingBatcher"]:
+        return self._embedding_batcher
+
+    @embedding_batcher.setter
+    def embedding_batcher(self, value: Optional["EmbeddingBatcher"]):
+        self._embedding_batcher = value
+
+    @property
+    def embedding_log_policy(self) -> Optional["EmbeddingLogPolicy"]:
+        return self._embedding_log_policy
+
+    @embedding_log_policy.setter
+    def embedding_log_policy(self, value: Optional["EmbeddingLogPolicy"]):
+        self._embedding_log_policy = value
+
+    @property
+    def rate_limiter(self) -> Optional["RateLimiter"]:
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, value: Optional["RateLimiter"]):
+        self._rate_limiter = value
+
+    @property
+    def retry_engine(self) -> Optional["RetryEngine"]:
+        return self._retry_engine
+
+    @retry_engine.setter
+    def retry_engine(self, value: Optional["RetryEngine"]):
+        self._retry_engine = value
+
+    @property
+    def sampler(self) -> Optional["Sampler"]:
+        return self._sampler
+
+    @sampler.setter
+    def sampler(self, value: Optional["Sampler"]):
+        self._sampler = value
+
+    @property
+    def usage_estimator(self) -> Optional["UsageEstimator"]:
+        return self._usage_estimator
+
+    @usage_estimator.setter
+    def usage_estimator(self, value: Optional["UsageEstimator"]):
+        self._usage_estimator = value
+
+    @property
+    def tracer(self) -> Optional["Tracer"]:
+        return self._tracer
+
+    @tracer.setter
+    def tracer(self, value: Optional["Tracer"]):
+        self._tracer = value
+
     @property
     def api_key(self) -> Optional[str]:
         if (self._api_key is None):
@@ -1,52 +1,147 @@
 import json
 import os
-import lockfile
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
 
 
-class RapidaLockManager:
-    DIR_PATH = os.path.expanduser("~/.rapida")
-    LOCKFILE_PATH = os.path.join(DIR_PATH, "custom_properties.json.lock")
-    JSON_PATH = os.path.join(DIR_PATH, "custom_properties.json")
+class PropertyStore:
+    def __init__(self, dir_path: Optional[str] = None, mirror_json: bool = False):
+        self.dir_path = dir_path or os.path.expanduser("~/.rapida")
+        self.db_path = os.path.join(self.dir_path, "custom_properties.db")
+        self.json_path = os.path.join(self.dir_path, "custom_properties.json")
+        # Opt-in, for tools that still read the JSON file. Every update then
+        # rewrites the whole file while holding the write lock.
+        self.mirror_json = mirror_json
+        self._local = threading.local()
+        self._cache: Tuple[int, Dict[str, Any]] = (-1, {})
 
-    @staticmethod
-    def check_files():
-        os.makedirs(RapidaLockManager.DIR_PATH, exist_ok=True)
-        with lockfile.LockFile(RapidaLockManager.LOCKFILE_PATH):
-            if not os.path.exists(RapidaLockManager.JSON_PATH):
-                with open(RapidaLockManager.JSON_PATH, 'w') as json_file:
-                    json.dump({}, json_file)
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
 
-    @staticmethod
-    def write_custom_property(property_name, value):
-        RapidaLockManager.check_files()
-        with lockfile.LockFile(RapidaLockManager.LOCKFILE_PATH):
-            with open(RapidaLockManager.JSON_PATH, "r") as json_file:
+        os.makedirs(self.dir_path, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS properties (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)")
+            created = conn.execute(
+                "INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0)").rowcount
+            if created:
+                self._import_json(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _import_json(self, conn: sqlite3.Connection):
+        try:
+            with open(self.json_path, "r") as json_file:
                 properties = json.load(json_file)
+        except (OSError, ValueError):
+            return
+        conn.executemany(
+            "INSERT OR REPLACE INTO properties (name, value) VALUES (?, ?)",
+            [(name, json.dumps(value)) for name, value in properties.items()])
 
-            properties[property_name] = value
+    def _write(self, sql: str, params: tuple = ()):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(sql, params)
+            conn.execute("UPDATE generation SET value = value + 1 WHERE id = 0")
+            if self.mirror_json:
+                self._write_json(self._read_all(conn))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
 
-            with open(RapidaLockManager.JSON_PATH, "w") as json_file:
+    def _write_json(self, properties: Dict[str, Any]):
+        # Written while the write transaction is held, then atomically
+        # renamed, so readers never observe a partial or stale file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.dir_path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as json_file:
                 json.dump(properties, json_file)
+            os.replace(tmp_path, self.json_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
-    @staticmethod
-    def clear_all_properties():
-        RapidaLockManager.check_files()
-        with lockfile.LockFile(RapidaLockManager.LOCKFILE_PATH):
-            with open(RapidaLockManager.JSON_PATH, "w") as json_file:
-                json.dump({}, json_file)
+    def _read_all(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        return {name: json.loads(value) for name, value
+                in conn.execute("SELECT name, value FROM properties")}
+
+    def _generation(self, conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            "SELECT value FROM generation WHERE id = 0").fetchone()[0]
+
+    def get_all(self) -> Dict[str, Any]:
+        conn = self._connection()
+        cached_generation, cached = self._cache
+        if self._generation(conn) != cached_generation:
+            # Generation and properties are read from one WAL snapshot, which
+            # never blocks or waits on writers.
+            conn.execute("BEGIN")
+            try:
+                self._cache = (self._generation(conn), self._read_all(conn))
+            finally:
+                conn.execute("COMMIT")
+            cached = self._cache[1]
+        return dict(cached)
+
+    def get(self, property_name: str, default: Any = None) -> Any:
+        return self.get_all().get(property_name, default)
+
+    def set(self, property_name: str, value: Any):
+        self._write(
+            "INSERT INTO properties (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (property_name, json.dumps(value)))
+
+    def remove(self, property_name: str):
+        self._write("DELETE FROM properties WHERE name = ?", (property_name,))
+
+    def clear(self):
+        self._write("DELETE FROM properties")
+
+
+property_store = PropertyStore()
+
+
+class RapidaLockManager:
+    DIR_PATH = property_store.dir_path
+    JSON_PATH = property_store.json_path
 
     @staticmethod
-    def remove_custom_property(property_name):
-        RapidaLockManager.check_files()
-        with lockfile.LockFile(RapidaLockManager.LOCKFILE_PATH):
-            with open(RapidaLockManager.JSON_PATH, "r") as json_file:
-                properties = json.load(json_file)
+    def check_files():
+        property_store._connection()
 
-            if property_name in properties:
-                del properties[property_name]
+    @staticmethod
+    def get_custom_properties() -> Dict[str, Any]:
+        return property_store.get_all()
 
-                with open(RapidaLockManager.JSON_PATH, "w") as json_file:
-                    json.dump(properties, json_file)
+    @staticmethod
+    def write_custom_property(property_name, value):
+        property_store.set(property_name, value)
 
+    @staticmethod
+    def clear_all_properties():
+        property_store.clear()
 
-RapidaLockManager.check_files()
+    @staticmethod
+    def remove_custom_property(property_name):
+        property_store.remove(property_name)
@@ -0,0 +1,357 @@
+import atexit
+import bisect
+import logging
+import math
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+__all__ = [
+    "BYTE_BUCKETS",
+    "Counter",
+    "DEFAULT_BUCKETS",
+    "Gauge",
+    "Histogram",
+    "LabelledMetric",
+    "MetricsRegistry",
+    "PeriodicExporter",
+    "registry",
+    "serve",
+]
+
+logger = logging.getLogger(__name__)
+
+# Seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class _Shards:
+    # Every thread updates its own list of numbers, without a lock. Readers
+    # add the lists up, and the lists of finished threads are folded into
+    # `retired` so thread churn does not grow the set.
+    __slots__ = ("_size", "_local", "_cells", "_retired", "_lock")
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._cells: List[Tuple[weakref.ref, list]] = []
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+
+    def new_cell(self) -> list:
+        cell = [0] * self._size
+        with self._lock:
+            live = []
+            for thread, other in self._cells:
+                owner = thread()
+                if (owner is None or not owner.is_alive()):
+                    for i, value in enumerate(other):
+                        self._retired[i] += value
+                else:
+                    live.append((thread, other))
+            live.append((weakref.ref(threading.current_thread()), cell))
+            self._cells = live
+        self._local.cell = cell
+        return cell
+
+    def totals(self) -> list:
+        with self._lock:
+            totals = list(self._retired)
+            for _, cell in self._cells:
+                for i, value in enumerate(cell):
+                    totals[i] += value
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._retired = [0] * self._size
+            self._cells = []
+            # Threads pick up a fresh cell on their next update.
+            self._local = threading.local()
+
+
+class Counter:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount: float = 1):
+        try:
+            self._shards._local.cell[0] += amount
+        except AttributeError:
+            self._shards.new_cell()[0] += amount
+
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+    def reset(self):
+        self._shards.reset()
+
+
+class Gauge:
+    # A single value is atomic to assign, so gauges need no sharding.
+    __slots__ = ("_value", "_function")
+
+    def __init__(self):
+        self._value = 0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Optional[Callable[[], float]]):
+        # Read when the metrics are collected, for values that are cheaper
+        # to look up than to keep up to date.
+        self._function = function
+
+    def value(self) -> float:
+        if (self._function is not None):
+            try:
+                return self._function()
+            except Exception as e:
+                logger.error(f"Failed to read gauge: {e}")
+                return math.nan
+        return self._value
+
+    def reset(self):
+        self._value = 0
+
+
+class Histogram:
+    __slots__ = ("bounds", "_shards")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        # One slot per bucket, one for +Inf and one for the sum.
+        self._shards = _Shards(len(self.bounds) + 2)
+
+    def observe(self, value: float):
+        try:
+            cell = self._shards._local.cell
+        except AttributeError:
+            cell = self._shards.new_cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def value(self) -> dict:
+        totals = self._shards.totals()
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), totals):
+            cumulative += count
+            buckets[_format_number(bound)] = cumulative
+        return {"count": cumulative, "sum": totals[-1], "buckets": buckets}
+
+    def reset(self):
+        self._shards.reset()
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class LabelledMetric:
+    def __init__(self, factory: Callable[[], Metric], labelnames: Tuple[str, ...]):
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], Metric] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Metric:
+        # Callers on hot paths can keep the child instead of looking it up.
+        child = self._children.get(values)
+        if (child is None):
+            if (len(values) != len(self.labelnames)):
+                raise ValueError(f"Expected labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.get(values)
+                if (child is None):
+                    child = self._children[values] = self._factory()
+        return child
+
+    def children(self) -> List[Tuple[Tuple[str, ...], Metric]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def reset(self):
+        for _, child in self.children():
+            child.reset()
+
+
+class _Family:
+    __slots__ = ("kind", "name", "documentation", "metric")
+
+    def __init__(self, kind: str, name: str, documentation: str,
+                 metric: Union[Metric, LabelledMetric]):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.metric = metric
+
+    def samples(self) -> List[Tuple[Dict[str, str], Union[float, dict]]]:
+        if (isinstance(self.metric, LabelledMetric)):
+            return [(dict(zip(self.metric.labelnames, values)), child.value())
+                    for values, child in self.metric.children()]
+        return [({}, self.metric.value())]
+
+
+def _format_number(value: float) -> str:
+    if (value == math.inf):
+        return "+Inf"
+    if (isinstance(value, float) and value.is_integer() and abs(value) < 1e15):
+        return str(int(value)) + ".0"
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if (not labels):
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _labels_key(labels: Dict[str, str]) -> str:
+    return ",".join(f"{name}={value}" for name, value in labels.items())
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, kind: str, name: str, documentation: str,
+                  labelnames: Sequence[str], factory: Callable[[], Metric]):
+        with self._lock:
+            family = self._families.get(name)
+            if (family is not None):
+                # Registering again, e.g. on module reload, returns the
+                # metric that is already there.
+                if (family.kind != kind):
+                    raise ValueError(f"Metric {name} is already registered as a {family.kind}")
+                return family.metric
+            metric = LabelledMetric(factory, tuple(labelnames)) if labelnames else factory()
+            self._families[name] = _Family(kind, name, documentation, metric)
+            return metric
+
+    def counter(self, name: str, documentation: str = "",
+                labelnames: Sequence[str] = ()) -> Union[Counter, LabelledMetric]:
+        # Counter names are written without the _total suffix.
+        return self._register("counter", name, documentation, labelnames, Counter)
+
+    def gauge(self, name: str, documentation: str = "",
+              labelnames: Sequence[str] = ()) -> Union[Gauge, LabelledMetric]:
+        return self._register("gauge", name, documentation, labelnames, Gauge)
+
+    def histogram(self, name: str, documentation: str = "",
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Union[Histogram, LabelledMetric]:
+        return self._register("histogram", name, documentation, labelnames,
+                              lambda: Histogram(buckets))
+
+    def _families_list(self) -> List[_Family]:
+        with self._lock:
+            return list(self._families.values())
+
+    def snapshot(self) -> dict:
+        # Unlabelled metrics map to their value, labelled ones to a dict
+        # keyed by "name=value,..." of their labels.
+        snapshot = {}
+        for family in self._families_list():
+            if (isinstance(family.metric, LabelledMetric)):
+                snapshot[family.name] = {_labels_key(labels): value
+                                         for labels, value in family.samples()}
+            else:
+                snapshot[family.name] = family.metric.value()
+        return snapshot
+
+    def to_openmetrics(self) -> str:
+        lines = []
+        for family in self._families_list():
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            if (family.documentation):
+                lines.append(f"# HELP {family.name} {_escape(family.documentation)}")
+            for labels, value in family.samples():
+                if (family.kind == "counter"):
+                    lines.append(f"{family.name}_total{_format_labels(labels)} {_format_number(value)}")
+                elif (family.kind == "gauge"):
+                    lines.append(f"{family.name}{_format_labels(labels)} {_format_number(value)}")
+                else:
+                    for bound, count in value["buckets"].items():
+                        bucket_labels = dict(labels, le=bound)
+                        lines.append(f"{family.name}_bucket{_format_labels(bucket_labels)} {count}")
+                    lines.append(f"{family.name}_count{_format_labels(labels)} {value['count']}")
+                    lines.append(f"{family.name}_sum{_format_labels(labels)} {_format_number(value['sum'])}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for family in self._families_list():
+            family.metric.reset()
+
+
+registry = MetricsRegistry()
+
+
+def serve(port: int = 9464, addr: str = "127.0.0.1",
+          metrics: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    # Serves the OpenMetrics text on every path from a daemon thread. Call
+    # shutdown() on the returned server to stop it.
+    metrics = metrics or registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.to_openmetrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="rapida-metrics-server",
+                     daemon=True).start()
+    return server
+
+
+class PeriodicExporter:
+    def __init__(self, export: Callable[[dict], None], interval: float = 10.0,
+                 metrics: Optional[MetricsRegistry] = None):
+        # export is called with a snapshot every interval seconds, and once
+        # more on close.
+        self.export = export
+        self.interval = interval
+        self.metrics = metrics or registry
+        self._closed = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="rapida-metrics-exporter", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def export_now(self):
+        try:
+            self.export(self.metrics.snapshot())
+        except Exception as e:
+            logger.error(f"Failed to export metrics: {e}")
+
+    def _run(self):
+        while (not self._closed.wait(self.interval)):
+            self.export_now()
+
+    def close(self):
+        if (self._closed.is_set()):
+            return
+        self._closed.set()
+        self._worker.join()
+        atexit.unregister(self.close)
+        self.export_now()
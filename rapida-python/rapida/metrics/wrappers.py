@@ -0,0 +1,15 @@
+from rapida.metrics import registry
+
+# Shared by the async and proxy OpenAIInjectors, so neither imports the other.
+WRAPPED_CALLS = registry.counter(
+    "rapida_wrapped_calls", "OpenAI calls made through the Rapida wrappers",
+    ("mode", "resource", "outcome"))
+WRAPPED_CALL_SECONDS = registry.histogram(
+    "rapida_wrapped_call_seconds", "Duration of wrapped OpenAI calls",
+    ("mode", "resource"))
+
+
+def resource_name(func) -> str:
+    # create and acreate of a resource map to the same name.
+    return getattr(getattr(func, "__self__", None), "__name__", None) \
+        or getattr(func, "__qualname__", repr(func))
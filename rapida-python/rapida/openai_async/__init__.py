@@ -1,2 +1,12 @@
-from .openai_injector import openai  # noqa
-from .openai_injector import RapidaMeta as Meta  # noqa
+# Nothing is imported or patched until `openai` or `Meta` is accessed, e.g.
+# `from rapida.openai_async import openai` instruments OpenAI in async mode.
+def __getattr__(name):
+    if name == "openai":
+        import rapida
+        rapida.instrument("async")
+        import openai
+        return openai
+    if name == "Meta":
+        from .openai_injector import RapidaMeta
+        return RapidaMeta
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,16 +2,35 @@ from dataclasses import dataclass
 import datetime
 import functools
 import inspect
-import json
-from typing import Callable, Optional
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Optional, Tuple, Union
 import openai  # noqa
 from openai.api_resources import (ChatCompletion, Completion, Edit, Embedding,
                                   Image, Moderation)
 
+from rapida import metrics, tracing
 from rapida.async_logger.async_logger import (RapidaAsyncLogger,
                                                 RapidaAyncLogRequest,
                                                 Provider, ProviderRequest,
                                                 ProviderResponse, Timing)
+from rapida.cache import ResponseCache
+from rapida.embeddings import (LOG_BATCHED, Batch, EmbeddingBatcher,
+                               encode_response)
+from rapida.globals import rapida_global
+from rapida.metrics.wrappers import WRAPPED_CALL_SECONDS, WRAPPED_CALLS, resource_name
+from rapida.retry import Attempt, RapidaRetryProps, RetryEngine, error_status
+from rapida.openai_async.stream_accumulator import StreamAccumulator
+from rapida.singleflight import SingleFlight
+from rapida.timing import RequestClock
+from rapida.usage import StreamUsage
+
+logger = logging.getLogger(__name__)
+
+WRAPPER_LOG_SECONDS = metrics.registry.histogram(
+    "rapida_wrapper_log_seconds", "Time the caller spends building and handing off a log record",
+    ("resource",))
 
 
 @dataclass
@@ -19,6 +38,11 @@ class RapidaMeta:
     custom_properties: Optional[dict] = None
     user_id: Optional[str] = None
     node_id: Optional[str] = None
+    # Set to False to bypass rapida_global.response_cache for a call.
+    cache: Optional[bool] = None
+    # False disables rapida_global.retry_engine for a call, True or props
+    # enable retries even without one.
+    retry: Optional[Union[RapidaRetryProps, bool]] = None
 
     def build(self) -> dict:
         meta = {}
@@ -67,55 +91,293 @@ class CreateArgsExtractor:
             return {}
         return self._rapida_meta.build()
 
+    def get_properties(self) -> dict:
+        if (self._rapida_meta is None):
+            return {}
+        return self._rapida_meta.custom_properties or {}
+
+    def get_user_id(self) -> Optional[str]:
+        if (self._rapida_meta is not None and self._rapida_meta.user_id):
+            return self._rapida_meta.user_id
+        return self.kwargs.get("user")
+
+    def get_cache_override(self) -> Optional[bool]:
+        if (self._rapida_meta is None):
+            return None
+        return self._rapida_meta.cache
+
+    def get_retry_override(self) -> Optional[Union[RapidaRetryProps, bool]]:
+        if (self._rapida_meta is None):
+            return None
+        return self._rapida_meta.retry
+
+
+_default_retry_engine = RetryEngine()
+
 
 class OpenAIInjector:
     def __init__(self):
-        pass
+        self._originals = []
 
     def update_response_headers(self, result, rapida_request_id):
         result["rapida_request_id"] = rapida_request_id
 
+    def _response_cache(self, func, arg_extractor: CreateArgsExtractor) -> Tuple[Optional[ResponseCache], Optional[str]]:
+        cache = rapida_global.response_cache
+        if (cache is None or arg_extractor.get_cache_override() is False):
+            return None, None
+        return cache, ResponseCache.key(resource_name(func), arg_extractor.get_body())
+
+    def _retry_engine(self, arg_extractor: CreateArgsExtractor) -> Optional[RetryEngine]:
+        engine = rapida_global.retry_engine
+        override = arg_extractor.get_retry_override()
+        if (override is False):
+            return None
+        if (override is None):
+            return engine
+        engine = engine or _default_retry_engine
+        if (isinstance(override, RapidaRetryProps)):
+            return engine.with_props(override)
+        return engine
+
+    def _attempt_log_request(self, providerRequest: ProviderRequest, attempt: Attempt) -> RapidaAyncLogRequest:
+        # Attempts that were retried or lost a hedge are logged as children
+        # of the logical request.
+        meta = dict(providerRequest.meta)
+        meta["Rapida-Parent-Request-Id"] = meta.get("Rapida-Request-Id")
+        meta["Rapida-Request-Id"] = str(uuid.uuid4())
+        meta["Rapida-Attempt"] = str(attempt.number)
+        if (attempt.hedge):
+            meta["Rapida-Hedge"] = "true"
+        return RapidaAyncLogRequest(
+            providerRequest=ProviderRequest(
+                url=providerRequest.url,
+                json=providerRequest.json,
+                meta=meta
+            ),
+            providerResponse=ProviderResponse(
+                json=attempt.result if attempt.succeeded() else {"error": str(attempt.error)},
+                # 0 when no response was received.
+                status=attempt.status or 0,
+                headers={
+                    "openai-version": "ligmaligma"
+                }
+            ),
+            timing=Timing.from_datetimes(attempt.started, attempt.finished)
+        )
+
+    def _attempt_headers(self, attempts: list, headers: dict) -> dict:
+        if (attempts):
+            headers["Rapida-Retry-Attempts"] = str(len(attempts) + 1)
+        return headers
+
+    @staticmethod
+    def _retried(engine: RetryEngine, func, on_attempt, **kwargs):
+        return engine.call(func, kwargs, on_attempt)
+
+    @staticmethod
+    async def _aretried(engine: RetryEngine, func, on_attempt, **kwargs):
+        return await engine.acall(func, kwargs, on_attempt)
+
+    def _stream_usage(self, arg_extractor: CreateArgsExtractor) -> Optional[StreamUsage]:
+        estimator = rapida_global.usage_estimator
+        if (estimator is None or not arg_extractor.get_body().get("stream")):
+            return None
+        try:
+            return estimator.stream(arg_extractor.get_body())
+        except Exception as e:
+            # The call already succeeded, a failed estimate only loses usage.
+            logger.error(f"Failed to estimate stream usage: {e}")
+            return None
+
+    def _rate_limited(self, func, arg_extractor: CreateArgsExtractor):
+        limiter = rapida_global.rate_limiter
+        if (limiter is None):
+            return func
+        user_id = arg_extractor.get_user_id()
+        return lambda **kwargs: limiter.call(func, kwargs, user_id)
+
+    def _rate_limited_async(self, func, arg_extractor: CreateArgsExtractor):
+        limiter = rapida_global.rate_limiter
+        if (limiter is None):
+            return func
+        user_id = arg_extractor.get_user_id()
+
+        async def limited(**kwargs):
+            return await limiter.acall(func, kwargs, user_id)
+        return limited
+
+    def _timed(self, func, clock: RequestClock, send_response: Callable[[dict], None]):
+        resource = resource_name(func)
+        # Streams are logged after the wrapper returned, under the call's span.
+        root = tracing.current_span()
+
+        def timed(response):
+            WRAPPED_CALLS.labels("async", resource, "ok").inc()
+            WRAPPED_CALL_SECONDS.labels("async", resource).observe(clock.elapsed_ms() / 1000)
+            started = time.perf_counter()
+            with tracing.span("rapida.log", parent=root):
+                send_response(response)
+            WRAPPER_LOG_SECONDS.labels(resource).observe(time.perf_counter() - started)
+        return timed
+
+    def _timed_async(self, func, clock: RequestClock,
+                     send_response: Callable[[dict], Awaitable[None]]):
+        resource = resource_name(func)
+        # Streams are logged after the wrapper returned, under the call's span.
+        root = tracing.current_span()
+
+        async def timed(response):
+            WRAPPED_CALLS.labels("async", resource, "ok").inc()
+            WRAPPED_CALL_SECONDS.labels("async", resource).observe(clock.elapsed_ms() / 1000)
+            started = time.perf_counter()
+            with tracing.span("rapida.log", parent=root):
+                await send_response(response)
+            WRAPPER_LOG_SECONDS.labels(resource).observe(time.perf_counter() - started)
+        return timed
+
+    def _count_error(self, func, clock: RequestClock):
+        WRAPPED_CALLS.labels("async", resource_name(func), "error").inc()
+        WRAPPED_CALL_SECONDS.labels("async", resource_name(func)).observe(clock.elapsed_ms() / 1000)
+
+    def _sample(self, func, arg_extractor: CreateArgsExtractor, clock: RequestClock,
+                logger: RapidaAsyncLogger, response=None, error: bool = False) -> Optional[float]:
+        # Decided before the record is built, so dropped calls cost nothing
+        # to serialize.
+        usage = response.get("usage") if isinstance(response, dict) else None
+        rollup = getattr(logger, "rollup", None)
+        if (rollup is not None and rollup.covers(resource_name(func))):
+            # Counted into the current window instead of logged on its own.
+            body = arg_extractor.get_body()
+            rollup.add(
+                resource_name(func),
+                body.get("model") or body.get("engine") or body.get("deployment_id"),
+                user_id=arg_extractor.get_user_id(),
+                properties=arg_extractor.get_properties(),
+                error=error,
+                latency_ms=clock.elapsed_ms(),
+                prompt_tokens=(usage or {}).get("prompt_tokens") or 0,
+                total_tokens=(usage or {}).get("total_tokens") or 0)
+            return None
+        sampler = rapida_global.sampler
+        if (sampler is None):
+            return 1.0
+        return sampler.sample(
+            resource_name(func), arg_extractor.get_body(),
+            user_id=arg_extractor.get_user_id(),
+            properties=arg_extractor.get_properties(),
+            error=error,
+            latency_ms=clock.elapsed_ms(),
+            tokens=(usage or {}).get("total_tokens") or 0,
+            backlog=logger.backlog)
+
+    def _sample_headers(self, rate: float, headers: dict) -> dict:
+        if (rate < 1.0):
+            headers["Rapida-Sample-Rate"] = str(rate)
+        return headers
+
+    def _loggable_response(self, func, body: dict, response):
+        if (resource_name(func) != "Embedding"):
+            return response
+        return self._loggable_embeddings(body, response)
+
+    def _loggable_embeddings(self, body: dict, response):
+        policy = rapida_global.embedding_log_policy
+        if (policy is None):
+            return response
+        return encode_response(response, policy.mode_for(body.get("model")))
+
+    def _embedding_batcher(self, func, arg_extractor: CreateArgsExtractor) -> Optional[EmbeddingBatcher]:
+        batcher = rapida_global.embedding_batcher
+        if (batcher is None or resource_name(func) != "Embedding"
+                or not batcher.eligible(arg_extractor.get_body())):
+            return None
+        return batcher
+
+    def _batch_headers(self, batch: Batch) -> dict:
+        return {
+            "Rapida-Batch-Id": batch.id,
+            "Rapida-Batch-Size": str(len(batch)),
+        }
+
+    def _batch_log_request(self, batch: Batch) -> RapidaAyncLogRequest:
+        # One record for the upstream request, linking every caller in it.
+        return RapidaAyncLogRequest(
+            providerRequest=ProviderRequest(
+                url="N/A",
+                json=batch.request(),
+                meta={
+                    "Rapida-Batch-Id": batch.id,
+                    "Rapida-Batch-Request-Ids": ",".join(
+                        request_id for request_id in batch.request_ids if request_id),
+                }
+            ),
+            providerResponse=ProviderResponse(
+                json=self._loggable_embeddings(batch.kwargs, batch.response),
+                status=200,
+                headers=dict(self._batch_headers(batch), **{
+                    "openai-version": "ligmaligma"
+                })
+            ),
+            timing=Timing.from_datetimes(batch.opened_at, batch.received_at)
+        )
+
+    def _single_flight(self, func, arg_extractor: CreateArgsExtractor) -> Tuple[Optional[SingleFlight], Optional[str]]:
+        flight = rapida_global.single_flight
+        resource = resource_name(func)
+        if (flight is None or not flight.eligible(resource, arg_extractor.get_body())):
+            return None, None
+        return flight, ResponseCache.key(resource, arg_extractor.get_body())
+
     def _result_interceptor(self,
                             result,
                             rapida_meta: dict,
-                            send_response: Callable[[dict], None] = None):
+                            send_response: Callable[[dict], None] = None,
+                            clock: Optional[RequestClock] = None,
+                            usage: Optional[StreamUsage] = None):
 
         def generator_intercept_packets():
-            response = {}
-            response["streamed_data"] = []
+            accumulator = StreamAccumulator(usage)
             for r in result:
+                if (clock is not None):
+                    clock.mark_chunk()
                 r["rapida_meta"] = rapida_meta
-                response["streamed_data"].append(json.loads(r.__str__()))
+                accumulator.add(r)
                 yield r
-            send_response(response)
+            send_response(accumulator.build())
 
         if inspect.isgenerator(result):
             return generator_intercept_packets()
         else:
-            result["rapida_meta"] = rapida_meta
-            send_response(json.loads(result.__str__()))
+            with tracing.span("rapida.intercept"):
+                result["rapida_meta"] = rapida_meta
+                send_response(result)
 
             return result
 
-    def _result_interceptor_async(self,
-                                  result,
-                                  rapida_meta: dict,
-                                  send_response: Callable[[dict], None] = None):
+    async def _result_interceptor_async(self,
+                                        result,
+                                        rapida_meta: dict,
+                                        send_response: Callable[[dict], Awaitable[None]] = None,
+                                        clock: Optional[RequestClock] = None,
+                                        usage: Optional[StreamUsage] = None):
 
         async def generator_intercept_packets():
-            response = {}
-            response["streamed_data"] = []
-            for r in result:
+            accumulator = StreamAccumulator(usage)
+            async for r in result:
+                if (clock is not None):
+                    clock.mark_chunk()
                 r["rapida_meta"] = rapida_meta
-                response["streamed_data"].append(json.loads(r.__str__()))
+                accumulator.add(r)
                 yield r
-            send_response(response)
+            await send_response(accumulator.build())
 
-        if inspect.isgenerator(result):
+        if inspect.isasyncgen(result):
             return generator_intercept_packets()
         else:
-            result["rapida_meta"] = rapida_meta
-            send_response(json.loads(result.__str__()))
+            with tracing.span("rapida.intercept"):
+                result["rapida_meta"] = rapida_meta
+                await send_response(result)
 
             return result
 
@@ -124,116 +386,276 @@ class OpenAIInjector:
         def wrapper(*args, **kwargs):
             logger = RapidaAsyncLogger.from_rapida_global()
 
-            arg_extractor = CreateArgsExtractor(*args, **kwargs)
-            now = datetime.datetime.now()
+            with tracing.span("rapida.extract_args"):
+                arg_extractor = CreateArgsExtractor(*args, **kwargs)
+            clock = RequestClock()
 
             providerRequest = ProviderRequest(
                 url="N/A",
                 json=arg_extractor.get_body(),
                 meta=arg_extractor.get_rapida_meta()
             )
-            print("providerRequest", providerRequest)
+            response_headers = {
+                "openai-version": "ligmaligma"
+            }
+
+            def send_response(response):
+                rate = self._sample(func, arg_extractor, clock, logger, response)
+                if (rate is None):
+                    return
+                self._sample_headers(rate, response_headers)
+                response = self._loggable_response(func, arg_extractor.get_body(), response)
+                async_log = RapidaAyncLogRequest(
+                    providerRequest=providerRequest,
+                    providerResponse=ProviderResponse(
+                        json=response,
+                        status=200,
+                        headers=response_headers
+
+                    ),
+                    timing=clock.timing()
+                )
+                logger.log(async_log, Provider.OPENAI)
+
+            send_response = self._timed(func, clock, send_response)
+
+            cache, cache_key = self._response_cache(func, arg_extractor)
+            if (cache is not None):
+                cached = cache.lookup(cache_key)
+                if (cached is not None):
+                    # Hits are still logged, marked the way the proxy marks them.
+                    response_headers["Rapida-Cache"] = "HIT"
+                    return self._result_interceptor(ResponseCache.replay(cached),
+                                                    {"cache": "HIT"},
+                                                    send_response,
+                                                    clock,
+                                                    self._stream_usage(arg_extractor))
+                response_headers["Rapida-Cache"] = "MISS"
+
+            flight, flight_key = self._single_flight(func, arg_extractor)
+            batcher = self._embedding_batcher(func, arg_extractor)
+            batches = []
+
+            def log_batch(batch):
+                logger.log(self._batch_log_request(batch), Provider.OPENAI)
+
+            limited = self._rate_limited(func, arg_extractor)
+            engine = self._retry_engine(arg_extractor)
+            attempts = []
+
+            def log_attempt(attempt):
+                attempts.append(attempt)
+                logger.log(self._attempt_log_request(providerRequest, attempt), Provider.OPENAI)
+
+            if (engine is not None):
+                limited = functools.partial(self._retried, engine, limited, log_attempt)
+
+            def upstream():
+                if (batcher is None):
+                    return limited(**arg_extractor.get_args())
+                result, batch = batcher.submit(
+                    limited, arg_extractor.get_args(), request_id,
+                    on_batch=log_batch if batcher.log_mode == LOG_BATCHED else None)
+                batches.append(batch)
+                return result
+
+            leader_id = None
+            request_id = None
+            if (flight is not None or batcher is not None or engine is not None):
+                request_id = str(uuid.uuid4())
+                providerRequest.meta["Rapida-Request-Id"] = request_id
             try:
-                result = func(**arg_extractor.get_args())
+                with tracing.span("rapida.upstream", kind=tracing.SPAN_KIND_CLIENT):
+                    if (flight is not None):
+                        # Identical concurrent calls share one upstream call,
+                        # every caller still logs its own record.
+                        result, leader_id = flight.do(flight_key, upstream, request_id)
+                    else:
+                        result = upstream()
             except Exception as e:
-                later = datetime.datetime.now()
+                self._count_error(func, clock)
+                rate = self._sample(func, arg_extractor, clock, logger, error=True)
+                if (rate is None):
+                    raise e
                 async_log = RapidaAyncLogRequest(
                     providerRequest=providerRequest,
                     providerResponse=ProviderResponse(
                         json={
                             "error": str(e)
                         },
-                        status=500,
-                        headers={
+                        status=error_status(e) or 500,
+                        headers=self._sample_headers(rate, self._attempt_headers(attempts, {
                             "openai-version": "ligmaligma"
-                        }
+                        }))
                     ),
-                    timing=Timing.from_datetimes(now, later)
+                    timing=clock.timing()
                 )
                 logger.log(async_log, Provider.OPENAI)
 
                 raise e
 
-            def send_response(response):
-                later = datetime.datetime.now()
-                async_log = RapidaAyncLogRequest(
-                    providerRequest=providerRequest,
-                    providerResponse=ProviderResponse(
-                        json=response,
-                        status=200,
-                        headers={
-                            "openai-version": "ligmaligma"
-                        }
+            clock.mark_headers()
+            self._attempt_headers(attempts, response_headers)
+            if (leader_id is not None):
+                response_headers["Rapida-Coalesced-With"] = leader_id
+            elif (cache is not None):
+                result = cache.record(cache_key, result)
 
-                    ),
-                    timing=Timing.from_datetimes(now, later)
-                )
-                logger.log(async_log, Provider.OPENAI)
+            if (batches):
+                response_headers.update(self._batch_headers(batches[0]))
+                if (batcher.log_mode == LOG_BATCHED):
+                    # The batch was logged as a whole by the caller that sent it.
+                    return self._result_interceptor(
+                        result, {}, self._timed(func, clock, lambda response: None))
 
             return self._result_interceptor(result,
                                             {},
-                                            send_response)
+                                            send_response,
+                                            clock,
+                                            self._stream_usage(arg_extractor))
 
-        return wrapper
+        return tracing.traced(f"openai.{resource_name(func)}", wrapper,
+                              {"rapida.mode": "async", "rapida.resource": resource_name(func)})
 
     def _with_rapida_auth_async(self, func):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             logger = RapidaAsyncLogger.from_rapida_global()
 
-            arg_extractor = CreateArgsExtractor(*args, **kwargs)
-            now = datetime.datetime.now()
+            with tracing.span("rapida.extract_args"):
+                arg_extractor = CreateArgsExtractor(*args, **kwargs)
+            clock = RequestClock()
 
             providerRequest = ProviderRequest(
                 url="N/A",
                 json=arg_extractor.get_body(),
                 meta=arg_extractor.get_rapida_meta()
             )
-            try:
-                result = await func(**arg_extractor.get_args())
-            except Exception as e:
-                later = datetime.datetime.now()
+            response_headers = {
+                "openai-version": "ligmaligma"
+            }
+
+            async def send_response(response):
+                rate = self._sample(func, arg_extractor, clock, logger, response)
+                if (rate is None):
+                    return
+                self._sample_headers(rate, response_headers)
+                response = self._loggable_response(func, arg_extractor.get_body(), response)
                 async_log = RapidaAyncLogRequest(
                     providerRequest=providerRequest,
                     providerResponse=ProviderResponse(
-                        json={
-                            "error": str(e)
-                        },
-                        status=500,
-                        headers={
-                            "openai-version": "ligmaligma"
-                        }
+                        json=response,
+                        status=200,
+                        headers=response_headers
+
                     ),
-                    timing=Timing.from_datetimes(now, later)
+                    timing=clock.timing()
                 )
-                logger.log(async_log, Provider.OPENAI)
-
-                raise e
 
-            def send_response(response):
-                later = datetime.datetime.now()
+                await logger.alog(async_log, Provider.OPENAI)
+
+            send_response = self._timed_async(func, clock, send_response)
+
+            cache, cache_key = self._response_cache(func, arg_extractor)
+            if (cache is not None):
+                cached = cache.lookup(cache_key)
+                if (cached is not None):
+                    response_headers["Rapida-Cache"] = "HIT"
+                    return await self._result_interceptor_async(ResponseCache.areplay(cached),
+                                                                {"cache": "HIT"},
+                                                                send_response,
+                                                                clock,
+                                                                self._stream_usage(arg_extractor))
+                response_headers["Rapida-Cache"] = "MISS"
+
+            flight, flight_key = self._single_flight(func, arg_extractor)
+            batcher = self._embedding_batcher(func, arg_extractor)
+            batches = []
+
+            async def log_batch(batch):
+                await logger.alog(self._batch_log_request(batch), Provider.OPENAI)
+
+            limited = self._rate_limited_async(func, arg_extractor)
+            engine = self._retry_engine(arg_extractor)
+            attempts = []
+
+            async def log_attempt(attempt):
+                attempts.append(attempt)
+                await logger.alog(self._attempt_log_request(providerRequest, attempt), Provider.OPENAI)
+
+            if (engine is not None):
+                limited = functools.partial(self._aretried, engine, limited, log_attempt)
+
+            async def upstream():
+                if (batcher is None):
+                    return await limited(**arg_extractor.get_args())
+                result, batch = await batcher.asubmit(
+                    limited, arg_extractor.get_args(), request_id,
+                    on_batch=log_batch if batcher.log_mode == LOG_BATCHED else None)
+                batches.append(batch)
+                return result
+
+            leader_id = None
+            request_id = None
+            if (flight is not None or batcher is not None or engine is not None):
+                request_id = str(uuid.uuid4())
+                providerRequest.meta["Rapida-Request-Id"] = request_id
+            try:
+                with tracing.span("rapida.upstream", kind=tracing.SPAN_KIND_CLIENT):
+                    if (flight is not None):
+                        result, leader_id = await flight.ado(flight_key, upstream, request_id)
+                    else:
+                        result = await upstream()
+            except Exception as e:
+                self._count_error(func, clock)
+                rate = self._sample(func, arg_extractor, clock, logger, error=True)
+                if (rate is None):
+                    raise e
                 async_log = RapidaAyncLogRequest(
                     providerRequest=providerRequest,
                     providerResponse=ProviderResponse(
-                        json=response,
-                        status=200,
-                        headers={
+                        json={
+                            "error": str(e)
+                        },
+                        status=error_status(e) or 500,
+                        headers=self._sample_headers(rate, self._attempt_headers(attempts, {
                             "openai-version": "ligmaligma"
-                        }
-
+                        }))
                     ),
-                    timing=Timing.from_datetimes(now, later)
+                    timing=clock.timing()
                 )
+                await logger.alog(async_log, Provider.OPENAI)
 
-                logger.log(async_log, Provider.OPENAI)
-
-            return self._result_interceptor_async(result,
-                                                  {},
-                                                  send_response)
+                raise e
 
-        return wrapper
+            clock.mark_headers()
+            self._attempt_headers(attempts, response_headers)
+            if (leader_id is not None):
+                response_headers["Rapida-Coalesced-With"] = leader_id
+            elif (cache is not None):
+                result = await cache.arecord(cache_key, result)
+
+            if (batches):
+                response_headers.update(self._batch_headers(batches[0]))
+                if (batcher.log_mode == LOG_BATCHED):
+                    async def skip_log(response):
+                        pass
+                    return await self._result_interceptor_async(
+                        result, {}, self._timed_async(func, clock, skip_log))
+
+            return await self._result_interceptor_async(result,
+                                                        {},
+                                                        send_response,
+                                                        clock,
+                                                        self._stream_usage(arg_extractor))
+
+        return tracing.traced_async(f"openai.{resource_name(func)}", wrapper,
+                                    {"rapida.mode": "async", "rapida.resource": resource_name(func)})
 
     def apply_rapida_auth(self_parent):
+        if self_parent._originals:
+            return
+
         api_resources_classes = [
             (ChatCompletion, "create", "acreate"),
             (Completion, "create", "acreate"),
@@ -245,13 +667,30 @@ class OpenAIInjector:
 
         for api_resource_class, method, async_method in api_resources_classes:
             create_method = getattr(api_resource_class, method)
-            setattr(api_resource_class, method,
-                    self_parent._with_rapida_auth(create_method))
+            self_parent._patch(api_resource_class, method,
+                               self_parent._with_rapida_auth(create_method))
 
             async_create_method = getattr(api_resource_class, async_method)
-            setattr(api_resource_class, async_method,
-                    self_parent._with_rapida_auth_async(async_create_method))
+            self_parent._patch(api_resource_class, async_method,
+                               self_parent._with_rapida_auth_async(async_create_method))
+
+    def _patch(self, owner, name, value):
+        # The raw class attribute is kept so classmethods are restored as
+        # descriptors rather than as bound methods.
+        self._originals.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, value)
+
+    def remove_rapida_auth(self):
+        for owner, name, original in reversed(self._originals):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._originals = []
+
+    @property
+    def applied(self) -> bool:
+        return bool(self._originals)
 
 
 injector = OpenAIInjector()
-injector.apply_rapida_auth()
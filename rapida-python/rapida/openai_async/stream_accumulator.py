@@ -0,0 +1,114 @@
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from rapida.usage import StreamUsage
+
+
+class _ChoiceAccumulator:
+    __slots__ = ("index", "role", "content", "text", "function_name",
+                 "function_arguments", "finish_reason")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.role: Optional[str] = None
+        self.content: List[str] = []
+        self.text: List[str] = []
+        self.function_name: Optional[str] = None
+        self.function_arguments: List[str] = []
+        self.finish_reason: Optional[str] = None
+
+    def add(self, choice: dict):
+        delta = choice.get("delta")
+        if delta is not None:
+            role = delta.get("role")
+            if role is not None:
+                self.role = role
+            content = delta.get("content")
+            if content:
+                self.content.append(content)
+            function_call = delta.get("function_call")
+            if function_call is not None:
+                name = function_call.get("name")
+                if name:
+                    self.function_name = name
+                arguments = function_call.get("arguments")
+                if arguments:
+                    self.function_arguments.append(arguments)
+        else:
+            text = choice.get("text")
+            if text:
+                self.text.append(text)
+
+        finish_reason = choice.get("finish_reason")
+        if finish_reason is not None:
+            self.finish_reason = finish_reason
+
+    def build(self, is_chat: bool) -> dict:
+        if not is_chat:
+            return {
+                "index": self.index,
+                "text": "".join(self.text),
+                "logprobs": None,
+                "finish_reason": self.finish_reason,
+            }
+
+        message = {
+            "role": self.role or "assistant",
+            "content": "".join(self.content) if self.content else None,
+        }
+        if self.function_name is not None or self.function_arguments:
+            message["function_call"] = {
+                "name": self.function_name,
+                "arguments": "".join(self.function_arguments),
+            }
+        return {
+            "index": self.index,
+            "message": message,
+            "finish_reason": self.finish_reason,
+        }
+
+
+class StreamAccumulator:
+    def __init__(self, usage: Optional["StreamUsage"] = None):
+        self.usage = usage
+        self.id: Optional[str] = None
+        self.object: Optional[str] = None
+        self.created: Optional[int] = None
+        self.model: Optional[str] = None
+        self.chunk_count = 0
+        self._choices: Dict[int, _ChoiceAccumulator] = {}
+
+    def add(self, chunk: dict):
+        self.chunk_count += 1
+        if self.id is None:
+            self.id = chunk.get("id")
+            self.object = chunk.get("object")
+            self.created = chunk.get("created")
+            self.model = chunk.get("model")
+
+        for choice in chunk.get("choices") or ():
+            index = choice.get("index", 0)
+            accumulator = self._choices.get(index)
+            if accumulator is None:
+                accumulator = self._choices[index] = _ChoiceAccumulator(index)
+            accumulator.add(choice)
+            if self.usage is not None:
+                self.usage.add_choice(choice)
+
+    def build(self) -> dict:
+        is_chat = self.object is None or self.object.startswith(
+            "chat.completion")
+        obj = self.object
+        if obj is not None and obj.endswith(".chunk"):
+            obj = obj[:-len(".chunk")]
+        response = {
+            "id": self.id,
+            "object": obj,
+            "created": self.created,
+            "model": self.model,
+            "choices": [self._choices[index].build(is_chat)
+                        for index in sorted(self._choices)],
+        }
+        if self.usage is not None:
+            response["usage"] = self.usage.build()
+        return response
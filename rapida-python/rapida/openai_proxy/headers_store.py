@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Mapping, Optional, Tuple
+
+
+class HeadersStore:
+    def __init__(self, max_entries: int = 10000, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evicted = 0
+        self._entries: "OrderedDict[str, Tuple[float, Mapping[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def put(self, key: str, headers: Mapping[str, Any]):
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, headers)
+            self._entries.move_to_end(key)
+            self._evict(now)
+
+    def get(self, key: str, default: Optional[Mapping[str, Any]] = None) -> Optional[Mapping[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.evicted += 1
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def pop(self, key: str, default: Optional[Mapping[str, Any]] = None) -> Optional[Mapping[str, Any]]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict(self, now: float):
+        # Entries are kept in least-recently-used order, so both expired and
+        # overflowing entries are found at the front.
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+            self.evicted += 1
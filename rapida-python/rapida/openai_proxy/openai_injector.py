@@ -1,5 +1,9 @@
+from contextvars import ContextVar
+import copy
 from dataclasses import dataclass
+import datetime
 import functools
+import time
 from typing import Optional, TypedDict, Union, Tuple
 import uuid
 import inspect
@@ -15,7 +19,13 @@ from openai.api_resources import (
     Moderation,
 )
 import logging
-import threading
+
+from rapida import metrics, tracing
+from rapida.cache import ResponseCache
+from rapida.metrics.wrappers import WRAPPED_CALL_SECONDS, WRAPPED_CALLS, resource_name
+from rapida.openai_proxy.headers_store import HeadersStore
+from rapida.retry import RapidaRetryProps
+from rapida.singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +35,9 @@ class AttributeDict(dict):
         super(AttributeDict, self).__init__(*args, **kwargs)
         self.__dict__ = self
 
+    def __deepcopy__(self, memo):
+        return AttributeDict(copy.deepcopy(dict(self), memo))
+
 
 def normalize_data_type(data_type):
     if isinstance(data_type, str):
@@ -43,30 +56,28 @@ def normalize_data_type(data_type):
             "Invalid data_type provided. Please use a valid data type or string.")
 
 
+# The proxy base for the call in flight. Being context-local, concurrent
+# threads and tasks each route their own calls without touching openai.api_base.
+proxy_api_base_var: ContextVar[Optional[str]] = ContextVar(
+    "rapida_proxy_api_base", default=None)
+
+
 def prepare_api_base(**kwargs):
-    original_api_base = openai.api_base
+    original_api_base = kwargs.get("api_base") or openai.api_base
     if original_api_base != rapida_global.proxy_url:
         kwargs["headers"].update(
             {"Rapida-OpenAI-Api-Base": original_api_base})
 
-    openai.api_base = rapida_global.proxy_url
+    proxy_api_base = rapida_global.proxy_url
 
-    if openai.api_type == "azure":
+    if (kwargs.get("api_type") or openai.api_type) == "azure":
         if rapida_global.proxy_url.endswith('/v1'):
             if rapida_global.proxy_url != "https://oai.hconeai.com/v1":
                 logging.warning(
                     f"Detected likely invalid Azure API URL when proxying Rapida with proxy url {rapida_global.proxy_url}. Removing '/v1' from the end.")
-            openai.api_base = rapida_global.proxy_url[:-3]
+            proxy_api_base = rapida_global.proxy_url[:-3]
 
-    return original_api_base, kwargs
-
-
-@dataclass
-class RapidaRetryProps:
-    num: Optional[int] = None
-    factor: Optional[float] = None
-    min_timeout: Optional[float] = None
-    max_timeout: Optional[float] = None
+    return proxy_api_base, kwargs
 
 
 @dataclass
@@ -77,10 +88,16 @@ class RapidaProxyMeta:
     rate_limit_policy: Optional[str] = None
 
 
+HEADERS_STORE_SIZE = metrics.registry.gauge(
+    "rapida_headers_store_size", "Proxy response headers waiting to be attached to results")
+
+
 class OpenAIInjector:
     def __init__(self):
         self.openai = openai
-        self.headers_store = {}
+        self.headers_store = HeadersStore()
+        HEADERS_STORE_SIZE.set_function(self.headers_store.__len__)
+        self._originals = []
 
     def log_feedback(self, response, name, value, data_type=None):
         rapida_id = response.get("rapida", {}).get("id")
@@ -158,8 +175,11 @@ class OpenAIInjector:
 
         return rapida_request_id, kwargs
 
-    def update_response_headers(self, result, rapida_request_id):
-        headers = self.headers_store.get(rapida_request_id, {})
+    def update_response_headers(self, result, rapida_request_id, consume=True):
+        if consume:
+            headers = self.headers_store.pop(rapida_request_id, {})
+        else:
+            headers = self.headers_store.get(rapida_request_id, {})
         result["rapida"] = AttributeDict(
             id=headers.get("Rapida-Id"),
             status=headers.get("Rapida-Status"),
@@ -174,9 +194,13 @@ class OpenAIInjector:
 
     def _modify_result(self, result, rapida_request_id):
         def result_with_rapida():
-            for r in result:
-                self.update_response_headers(r, rapida_request_id)
-                yield r
+            try:
+                for r in result:
+                    self.update_response_headers(
+                        r, rapida_request_id, consume=False)
+                    yield r
+            finally:
+                self.headers_store.pop(rapida_request_id)
 
         if inspect.isgenerator(result):
             return result_with_rapida()
@@ -186,9 +210,13 @@ class OpenAIInjector:
 
     async def _modify_result_async(self, result, rapida_request_id):
         async def result_with_rapida_async():
-            async for r in result:
-                self.update_response_headers(r, rapida_request_id)
-                yield r
+            try:
+                async for r in result:
+                    self.update_response_headers(
+                        r, rapida_request_id, consume=False)
+                    yield r
+            finally:
+                self.headers_store.pop(rapida_request_id)
 
         if inspect.isasyncgen(result):
             return result_with_rapida_async()
@@ -196,35 +224,144 @@ class OpenAIInjector:
             self.update_response_headers(result, rapida_request_id)
             return result
 
+    def _count(self, func, outcome: str, timer: float):
+        # Streams are timed until their first chunk, the rest never passes
+        # through the wrapper.
+        WRAPPED_CALLS.labels("proxy", resource_name(func), outcome).inc()
+        WRAPPED_CALL_SECONDS.labels("proxy", resource_name(func)).observe(time.perf_counter() - timer)
+
+    def _user_id(self, kwargs) -> Optional[str]:
+        return kwargs["headers"].get("Rapida-User-Id") or kwargs.get("user")
+
+    def _single_flight(self, func, args, kwargs) -> Tuple[Optional[SingleFlight], Optional[str]]:
+        flight = rapida_global.single_flight
+        resource = resource_name(func)
+        if (flight is None or args or not flight.eligible(resource, kwargs)):
+            return None, None
+        body = dict(kwargs)
+        body["headers"] = {key: value for key, value in kwargs["headers"].items()
+                           if key != "rapida-request-id"}
+        return flight, ResponseCache.key(resource, body)
+
+    def _follower_result(self, result, rapida_request_id, kwargs, started):
+        # The follower never reaches the proxy, so its log record is sent
+        # through the logging API and points at the leader's record.
+        leader = result.get("rapida") or {}
+        leader_id = leader.get("id") or leader.get("request_id")
+        result["rapida"] = AttributeDict(leader, id=None, request_id=rapida_request_id,
+                                         coalesced_with=leader_id)
+
+        from rapida.async_logger.async_logger import (ProviderRequest, ProviderResponse,
+                                                        RapidaAyncLogRequest, Timing)
+        body = {key: value for key, value in kwargs.items() if key != "headers"}
+        return RapidaAyncLogRequest(
+            providerRequest=ProviderRequest(
+                url=kwargs["headers"].get("Rapida-OpenAI-Api-Base") or openai.api_base,
+                json=body,
+                meta={key: value for key, value in kwargs["headers"].items()
+                      if key.lower().startswith("rapida-") and key != "Rapida-Auth"},
+            ),
+            providerResponse=ProviderResponse(
+                json=result,
+                status=200,
+                headers={"Rapida-Coalesced-With": leader_id},
+            ),
+            timing=Timing.from_datetimes(started, datetime.datetime.now()),
+        )
+
     def _with_rapida_auth(self, func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            rapida_request_id, kwargs = self._prepare_headers(**kwargs)
-            original_api_base, kwargs = prepare_api_base(**kwargs)
-
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                openai.api_base = original_api_base
-
-            return self._modify_result(result, rapida_request_id)
+            started = datetime.datetime.now()
+            timer = time.perf_counter()
+            with tracing.span("rapida.prepare_headers"):
+                rapida_request_id, kwargs = self._prepare_headers(**kwargs)
+            proxy_api_base, kwargs = prepare_api_base(**kwargs)
+
+            limiter = rapida_global.rate_limiter
+
+            def call():
+                token = proxy_api_base_var.set(proxy_api_base)
+                try:
+                    with tracing.span("rapida.upstream", kind=tracing.SPAN_KIND_CLIENT):
+                        if (limiter is not None):
+                            result = limiter.call(lambda **kw: func(*args, **kw), kwargs,
+                                                  self._user_id(kwargs))
+                        else:
+                            result = func(*args, **kwargs)
+                except Exception:
+                    self._count(func, "error", timer)
+                    self.headers_store.pop(rapida_request_id)
+                    raise
+                finally:
+                    proxy_api_base_var.reset(token)
+                self._count(func, "ok", timer)
+
+                with tracing.span("rapida.intercept"):
+                    return self._modify_result(result, rapida_request_id)
+
+            flight, flight_key = self._single_flight(func, args, kwargs)
+            if (flight is None):
+                return call()
+
+            result, leader_request_id = flight.do(
+                flight_key, call, rapida_request_id)
+            if (leader_request_id is not None):
+                from rapida.async_logger.async_logger import Provider, RapidaAsyncLogger
+                RapidaAsyncLogger.from_rapida_global().log(
+                    self._follower_result(result, rapida_request_id, kwargs, started),
+                    Provider.OPENAI)
+            return result
 
-        return wrapper
+        return tracing.traced(f"openai.{resource_name(func)}", wrapper,
+                              {"rapida.mode": "proxy", "rapida.resource": resource_name(func)})
 
     def _with_rapida_auth_async(self, func):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            rapida_request_id, kwargs = self._prepare_headers(**kwargs)
-            original_api_base, kwargs = prepare_api_base(**kwargs)
-
-            try:
-                result = await func(*args, **kwargs)
-            finally:
-                openai.api_base = original_api_base
-
-            return await self._modify_result_async(result, rapida_request_id)
+            started = datetime.datetime.now()
+            timer = time.perf_counter()
+            with tracing.span("rapida.prepare_headers"):
+                rapida_request_id, kwargs = self._prepare_headers(**kwargs)
+            proxy_api_base, kwargs = prepare_api_base(**kwargs)
+
+            limiter = rapida_global.rate_limiter
+
+            async def call():
+                token = proxy_api_base_var.set(proxy_api_base)
+                try:
+                    with tracing.span("rapida.upstream", kind=tracing.SPAN_KIND_CLIENT):
+                        if (limiter is not None):
+                            result = await limiter.acall(lambda **kw: func(*args, **kw), kwargs,
+                                                         self._user_id(kwargs))
+                        else:
+                            result = await func(*args, **kwargs)
+                except Exception:
+                    self._count(func, "error", timer)
+                    self.headers_store.pop(rapida_request_id)
+                    raise
+                finally:
+                    proxy_api_base_var.reset(token)
+                self._count(func, "ok", timer)
+
+                with tracing.span("rapida.intercept"):
+                    return await self._modify_result_async(result, rapida_request_id)
+
+            flight, flight_key = self._single_flight(func, args, kwargs)
+            if (flight is None):
+                return await call()
+
+            result, leader_request_id = await flight.ado(
+                flight_key, call, rapida_request_id)
+            if (leader_request_id is not None):
+                from rapida.async_logger.async_logger import Provider, RapidaAsyncLogger
+                await RapidaAsyncLogger.from_rapida_global().alog(
+                    self._follower_result(result, rapida_request_id, kwargs, started),
+                    Provider.OPENAI)
+            return result
 
-        return wrapper
+        return tracing.traced_async(f"openai.{resource_name(func)}", wrapper,
+                                    {"rapida.mode": "proxy", "rapida.resource": resource_name(func)})
 
     def _get_property_headers(self, properties):
         return {f"Rapida-Property-{key}": str(value) for key, value in properties.items()}
@@ -245,27 +382,41 @@ class OpenAIInjector:
         return headers
 
     def apply_rapida_auth(self_parent):
+        def route_to_proxy(requestor):
+            proxy_api_base = proxy_api_base_var.get()
+            # An empty api_base means the requestor is polling an absolute
+            # url (Azure image operations) and must be left alone.
+            if proxy_api_base is not None and requestor.api_base:
+                requestor.api_base = proxy_api_base
+
         def request_raw_patched(self, *args, **kwargs):
-            rapida_id = kwargs["supplied_headers"]["rapida-request-id"]
+            rapida_id = (kwargs.get("supplied_headers")
+                         or {}).get("rapida-request-id")
+            route_to_proxy(self)
             response = original_request_raw(self, *args, **kwargs)
             if rapida_id:
-                with threading.Lock():
-                    self_parent.headers_store[rapida_id] = response.headers
+                self_parent.headers_store.put(rapida_id, response.headers)
             return response
 
         async def arequest_raw_patched(self, *args, **kwargs):
-            rapida_id = kwargs["supplied_headers"]["rapida-request-id"]
+            rapida_id = (kwargs.get("supplied_headers")
+                         or {}).get("rapida-request-id")
+            route_to_proxy(self)
             response = await original_arequest_raw(self, *args, **kwargs)
             if rapida_id:
-                with threading.Lock():
-                    self_parent.headers_store[rapida_id] = response.headers
+                self_parent.headers_store.put(rapida_id, response.headers)
             return response
 
+        if self_parent._originals:
+            return
+
         original_request_raw = openai.api_requestor.APIRequestor.request_raw
-        openai.api_requestor.APIRequestor.request_raw = request_raw_patched
+        self_parent._patch(openai.api_requestor.APIRequestor,
+                           "request_raw", request_raw_patched)
 
         original_arequest_raw = openai.api_requestor.APIRequestor.arequest_raw
-        openai.api_requestor.APIRequestor.arequest_raw = arequest_raw_patched
+        self_parent._patch(openai.api_requestor.APIRequestor,
+                           "arequest_raw", arequest_raw_patched)
 
         api_resources_classes = [
             (ChatCompletion, "create", "acreate"),
@@ -278,13 +429,30 @@ class OpenAIInjector:
 
         for api_resource_class, method, async_method in api_resources_classes:
             create_method = getattr(api_resource_class, method)
-            setattr(api_resource_class, method,
-                    self_parent._with_rapida_auth(create_method))
+            self_parent._patch(api_resource_class, method,
+                               self_parent._with_rapida_auth(create_method))
 
             async_create_method = getattr(api_resource_class, async_method)
-            setattr(api_resource_class, async_method,
-                    self_parent._with_rapida_auth_async(async_create_method))
+            self_parent._patch(api_resource_class, async_method,
+                               self_parent._with_rapida_auth_async(async_create_method))
+
+    def _patch(self, owner, name, value):
+        # The raw class attribute is kept so classmethods are restored as
+        # descriptors rather than as bound methods.
+        self._originals.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, value)
+
+    def remove_rapida_auth(self):
+        for owner, name, original in reversed(self._originals):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._originals = []
+
+    @property
+    def applied(self) -> bool:
+        return bool(self._originals)
 
 
 injector = OpenAIInjector()
-injector.apply_rapida_auth()
@@ -0,0 +1,13 @@
+from rapida.ratelimit.limiter import Permit, RateLimit, RateLimiter, RateLimitStats, estimate_tokens
+from rapida.ratelimit.stores import BucketStore, MemoryBucketStore, SQLiteBucketStore
+
+__all__ = [
+    "BucketStore",
+    "MemoryBucketStore",
+    "Permit",
+    "RateLimit",
+    "RateLimitStats",
+    "RateLimiter",
+    "SQLiteBucketStore",
+    "estimate_tokens",
+]
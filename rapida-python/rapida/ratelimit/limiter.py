@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import inspect
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import openai
+
+from rapida.ratelimit.stores import BucketStore, MemoryBucketStore, Take
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+
+
+def _text_tokens(value: Any) -> int:
+    if (value is None):
+        return 0
+    if (isinstance(value, str)):
+        # Roughly four characters per token for English text.
+        return len(value) // 4 + 1
+    if (isinstance(value, list)):
+        if (value and all(isinstance(v, int) for v in value)):
+            return len(value)
+        return sum(_text_tokens(v) for v in value)
+    return _text_tokens(str(value))
+
+
+def estimate_tokens(body: dict) -> int:
+    # OpenAI counts the prompt plus max_tokens for every choice against the
+    # tokens per minute limit.
+    prompt = 0
+    for message in body.get("messages") or []:
+        prompt += 4 + _text_tokens(message.get("content"))
+    prompt += _text_tokens(body.get("prompt"))
+    prompt += _text_tokens(body.get("input"))
+    completion = (body.get("max_tokens") or 0) * (body.get("n") or 1)
+    return prompt + completion
+
+
+class RateLimitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait: float):
+        with self._lock:
+            self.acquired += 1
+            if (wait > 0.001):
+                self.waited += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "waited": self.waited,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.acquired = 0
+            self.waited = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+
+
+class _Ticket:
+    __slots__ = ("user", "lane", "event", "loop", "future")
+
+    def __init__(self, user: str, lane: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.user = user
+        self.lane = lane
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        self.event.set()
+        if (self.loop is not None):
+            self.loop.call_soon_threadsafe(self._resolve, self.future)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future):
+        if (not future.done()):
+            future.set_result(None)
+
+    def reset(self):
+        self.event.clear()
+        if (self.loop is not None):
+            self.future = self.loop.create_future()
+
+
+class Permit:
+    __slots__ = ("_limiter", "wait", "_released")
+
+    def __init__(self, limiter: "RateLimiter", wait: float):
+        self._limiter = limiter
+        self.wait = wait
+        self._released = False
+
+    def release(self):
+        if (not self._released):
+            self._released = True
+            self._limiter._release_slot()
+
+    def hold(self, stream):
+        # A stream keeps its connection open until it is consumed.
+        if (inspect.isasyncgen(stream)):
+            return self._ahold(stream)
+        return self._hold(stream)
+
+    def _hold(self, stream):
+        try:
+            yield from stream
+        finally:
+            self.release()
+
+    async def _ahold(self, stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            self.release()
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self) -> "Permit":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class RateLimiter:
+    def __init__(self,
+                 default: Optional[RateLimit] = None,
+                 limits: Optional[Dict[str, RateLimit]] = None,
+                 max_in_flight: Optional[int] = None,
+                 store: Optional[BucketStore] = None):
+        # limits are per model, default applies to every other model.
+        self.default = default
+        self.limits = limits or {}
+        self.max_in_flight = max_in_flight
+        self.store = store or MemoryBucketStore()
+        self.stats = RateLimitStats()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        # Every model and API key has its own lane of waiting callers, per
+        # user and served round robin. Only the caller holding the turn of a
+        # lane waits on its buckets, so a throttled lane never holds up the
+        # others. Callers waiting for an in-flight slot are served in order.
+        self._lanes: Dict[str, "OrderedDict[str, Deque[_Ticket]]"] = {}
+        self._turns: Dict[str, _Ticket] = {}
+        self._slot_waiters: Deque[_Ticket] = deque()
+
+    @property
+    def queued(self) -> int:
+        with self._lock:
+            return sum(len(queue) for queues in self._lanes.values() for queue in queues.values())
+
+    def _bucket_key(self, body: dict) -> Tuple[str, Optional[RateLimit]]:
+        model = body.get("model") or body.get("engine") or body.get("deployment_id") or ""
+        limit = self.limits.get(model, self.default)
+        if (limit is None):
+            return "", None
+        api_key = body.get("api_key") or openai.api_key or ""
+        return f"{model}:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}", limit
+
+    def _takes(self, key: str, limit: Optional[RateLimit], body: dict) -> List[Take]:
+        if (limit is None):
+            return []
+        takes = []
+        if (limit.requests_per_minute):
+            rpm = float(limit.requests_per_minute)
+            takes.append((f"{key}:requests", rpm, rpm / 60, 1))
+        if (limit.tokens_per_minute):
+            tpm = float(limit.tokens_per_minute)
+            takes.append((f"{key}:tokens", tpm, tpm / 60, estimate_tokens(body)))
+        return takes
+
+    def _enqueue(self, ticket: _Ticket):
+        with self._lock:
+            queues = self._lanes.setdefault(ticket.lane, OrderedDict())
+            queues.setdefault(ticket.user, deque()).append(ticket)
+            if (ticket.lane not in self._turns):
+                self._grant_next(ticket.lane)
+
+    def _grant_next(self, lane: str):
+        self._turns.pop(lane, None)
+        queues = self._lanes.get(lane)
+        if (not queues):
+            self._lanes.pop(lane, None)
+            return
+        user, queue = next(iter(queues.items()))
+        ticket = queue.popleft()
+        # The user goes to the back of the line.
+        del queues[user]
+        if (queue):
+            queues[user] = queue
+        self._turns[lane] = ticket
+        ticket.wake()
+
+    def _leave(self, ticket: _Ticket):
+        with self._lock:
+            if (ticket in self._slot_waiters):
+                self._slot_waiters.remove(ticket)
+                self._wake_slot_waiter()
+            if (self._turns.get(ticket.lane) is ticket):
+                self._grant_next(ticket.lane)
+                return
+            queues = self._lanes.get(ticket.lane, {})
+            queue = queues.get(ticket.user)
+            if (queue is not None and ticket in queue):
+                queue.remove(ticket)
+                if (not queue):
+                    del queues[ticket.user]
+                if (not queues):
+                    del self._lanes[ticket.lane]
+
+    def _has_slot(self) -> bool:
+        return self.max_in_flight is None or self.in_flight < self.max_in_flight
+
+    def _wake_slot_waiter(self):
+        if (self._slot_waiters and self._has_slot()):
+            self._slot_waiters[0].wake()
+
+    def _try_slot(self, ticket: _Ticket) -> bool:
+        with self._lock:
+            first = not self._slot_waiters or self._slot_waiters[0] is ticket
+            if (first and self._has_slot()):
+                if (self._slot_waiters):
+                    self._slot_waiters.popleft()
+                self.in_flight += 1
+                self._wake_slot_waiter()
+                return True
+            ticket.reset()
+            if (ticket not in self._slot_waiters):
+                self._slot_waiters.append(ticket)
+            return False
+
+    def _release_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_slot_waiter()
+
+    def acquire(self, body: dict, user_id: Optional[str] = None) -> Permit:
+        started = time.monotonic()
+        key, limit = self._bucket_key(body)
+        ticket = _Ticket(user_id or "", key)
+        self._enqueue(ticket)
+        try:
+            ticket.event.wait()
+            takes = self._takes(key, limit, body)
+            while (takes):
+                wait = self.store.take(takes)
+                if (not wait):
+                    break
+                time.sleep(wait)
+            while (not self._try_slot(ticket)):
+                ticket.event.wait()
+        finally:
+            self._leave(ticket)
+        waited = time.monotonic() - started
+        self.stats.record(waited)
+        return Permit(self, waited)
+
+    async def aacquire(self, body: dict, user_id: Optional[str] = None) -> Permit:
+        started = time.monotonic()
+        key, limit = self._bucket_key(body)
+        ticket = _Ticket(user_id or "", key, asyncio.get_running_loop())
+        self._enqueue(ticket)
+        try:
+            await ticket.future
+            takes = self._takes(key, limit, body)
+            while (takes):
+                wait = self.store.take(takes)
+                if (not wait):
+                    break
+                await asyncio.sleep(wait)
+            while (not self._try_slot(ticket)):
+                await ticket.future
+        finally:
+            self._leave(ticket)
+        waited = time.monotonic() - started
+        self.stats.record(waited)
+        return Permit(self, waited)
+
+    def call(self, func: Callable[..., Any], kwargs: dict, user_id: Optional[str] = None) -> Any:
+        permit = self.acquire(kwargs, user_id)
+        try:
+            result = func(**kwargs)
+        except BaseException:
+            permit.release()
+            raise
+        if (inspect.isgenerator(result)):
+            return permit.hold(result)
+        permit.release()
+        return result
+
+    async def acall(self, func: Callable[..., Awaitable[Any]], kwargs: dict,
+                    user_id: Optional[str] = None) -> Any:
+        permit = await self.aacquire(kwargs, user_id)
+        try:
+            result = await func(**kwargs)
+        except BaseException:
+            permit.release()
+            raise
+        if (inspect.isasyncgen(result)):
+            return permit.hold(result)
+        permit.release()
+        return result
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+# (key, capacity, refill per second, amount)
+Take = Tuple[str, float, float, float]
+
+
+class BucketStore(ABC):
+    @abstractmethod
+    def take(self, takes: List[Take]) -> float:
+        # Takes every amount if all buckets hold enough, otherwise takes
+        # nothing and returns the seconds until they would.
+        ...
+
+
+def _take(levels: Dict[str, Tuple[float, float]], takes: List[Take], now: float) -> float:
+    wait = 0.0
+    refilled = {}
+    for key, capacity, per_second, amount in takes:
+        level, updated = levels.get(key, (capacity, now))
+        level = min(capacity, level + max(0.0, now - updated) * per_second)
+        refilled[key] = level
+        # A single request larger than the bucket waits for a full bucket.
+        amount = min(amount, capacity)
+        if (level < amount):
+            wait = max(wait, (amount - level) / per_second)
+    for key, capacity, per_second, amount in takes:
+        level = refilled[key]
+        if (not wait):
+            level -= min(amount, capacity)
+        levels[key] = (level, now)
+    return wait
+
+
+class MemoryBucketStore(BucketStore):
+    def __init__(self):
+        self._levels: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, takes: List[Take]) -> float:
+        with self._lock:
+            return _take(self._levels, takes, time.monotonic())
+
+
+class SQLiteBucketStore(BucketStore):
+    # Buckets shared by every process using the same file.
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.expanduser("~/.rapida/ratelimit.db")
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30,
+                               isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, "
+            "level REAL NOT NULL, updated REAL NOT NULL)")
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def take(self, takes: List[Take]) -> float:
+        conn = self._connection()
+        keys = [key for key, _, _, _ in takes]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT key, level, updated FROM buckets WHERE key IN ({','.join('?' * len(keys))})",
+                keys)
+            levels = {key: (level, updated) for key, level, updated in rows}
+            # Wall clock time, buckets are shared between processes.
+            wait = _take(levels, takes, time.time())
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, level, updated) VALUES (?, ?, ?)",
+                [(key, level, updated) for key, (level, updated) in levels.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
@@ -1,18 +1,154 @@
-from typing import Optional
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from rapida import metrics
 from rapida.globals import rapida_global
+from rapida.requester.compression import CompressionConfig, encode_body
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from urllib.parse import urljoin
 
+try:
+    import httpx
+    import h2  # noqa: F401
+except ImportError:
+    httpx = None
 
-class Requests:
+
+LOG_REQUESTS = metrics.registry.counter(
+    "rapida_log_requests", "Requests sent to the Rapida API", ("method", "status"))
+LOG_REQUEST_FAILURES = metrics.registry.counter(
+    "rapida_log_request_failures", "Requests to the Rapida API that failed or did not return 200",
+    ("method",))
+LOG_REQUEST_SECONDS = metrics.registry.histogram(
+    "rapida_log_request_seconds", "Latency of requests to the Rapida API", ("method",))
+LOG_PAYLOAD_BYTES = metrics.registry.histogram(
+    "rapida_log_payload_bytes", "Size of request bodies sent to the Rapida API, after compression",
+    ("method",), buckets=metrics.BYTE_BUCKETS)
+
+
+def record_request(method: str, status: Optional[int], started: float, data: Optional[bytes]):
+    # status is None when no response was received.
+    LOG_REQUESTS.labels(method, str(status) if status is not None else "error").inc()
+    if (status != 200):
+        LOG_REQUEST_FAILURES.labels(method).inc()
+    LOG_REQUEST_SECONDS.labels(method).observe(time.perf_counter() - started)
+    # Bodies passed as json are encoded by the HTTP client and not measured.
+    if (data is not None):
+        LOG_PAYLOAD_BYTES.labels(method).observe(len(data))
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    pool_connections: int = 4
+    pool_maxsize: int = 16
+    keep_alive: bool = True
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    # Opt-in, and only honoured when httpx and h2 are installed.
+    http2: bool = False
+
+
+class _Http2Session:
+    def __init__(self, config: PoolConfig):
+        self.client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=config.pool_maxsize,
+                max_keepalive_connections=config.pool_maxsize if config.keep_alive else 0,
+            ),
+            timeout=httpx.Timeout(config.read_timeout,
+                                  connect=config.connect_timeout),
+        )
+
+    def request(self, method: str, url: str, json: Optional[dict], data: Optional[bytes],
+                headers: dict, timeout: Tuple[float, float]) -> requests.Response:
+        # Callers get the same responses and errors as from requests.
+        connect_timeout, read_timeout = timeout
+        try:
+            res = self.client.request(method, url, json=json, content=data, headers=headers,
+                                      timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(str(e)) from e
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+        response = requests.Response()
+        response.status_code = res.status_code
+        response.reason = res.reason_phrase
+        response.headers = CaseInsensitiveDict(res.headers)
+        response.url = str(res.url)
+        response._content = res.content
+        response.encoding = res.encoding
+        return response
+
+    def close(self):
+        self.client.close()
+
+
+class _SessionPool:
+    def __init__(self):
+        self._sessions: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str, config: PoolConfig):
+        # Keyed by pid as well so forked workers never share sockets.
+        key = (os.getpid(), base_url, config)
+        session = self._sessions.get(key)
+        if (session is not None):
+            return session
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if (session is None):
+                session = self._create(config)
+                self._sessions[key] = session
+            return session
+
+    def _create(self, config: PoolConfig):
+        if (config.http2 and httpx is not None):
+            return _Http2Session(config)
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=config.pool_connections,
+                              pool_maxsize=config.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if (not config.keep_alive):
+            session.headers["Connection"] = "close"
+        return session
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+session_pool = _SessionPool()
+
+
+class _RequesterConfig:
+    # Settings shared by Requests and AsyncRequests, each falling back to
+    # rapida_global when not given.
     base_url: str
     api_key: str
     fail_on_error: bool
+    pool_config: PoolConfig
+    compression: Optional[CompressionConfig]
 
     def __init__(self, base_url: Optional[str] = None,
                  api_key: Optional[str] = None,
-                 fail_on_error: Optional[bool] = None
+                 fail_on_error: Optional[bool] = None,
+                 pool_config: Optional[PoolConfig] = None,
+                 compression: Optional[CompressionConfig] = None
                  ):
         if (base_url is None):
             self.base_url = rapida_global.base_url
@@ -29,32 +165,71 @@ class Requests:
         else:
             self.fail_on_error = rapida_global.fail_on_error
 
-    def post(self, path: str, json: dict) -> requests.Response:
-        res = requests.post(
-            url=urljoin(self.base_url, path),
-            json=json,
-            headers={
-                "Authorization": f"Bearer {self.api_key}"
-            }
-        )
-        if (res.status_code != 200):
-            print(f"Failed to log to {path}. Status code {res.status_code}")
+        if (pool_config is not None):
+            self.pool_config = pool_config
+        else:
+            self.pool_config = rapida_global.pool_config
 
-        if (self.fail_on_error):
-            res.raise_for_status()
-        return res
+        if (compression is not None):
+            self.compression = compression
+        else:
+            self.compression = rapida_global.compression
 
-    def patch(self, path: str, json: dict) -> requests.Response:
-        res = requests.patch(
-            url=urljoin(self.base_url, path),
-            json=json,
-            headers={
-                "Authorization": f"Bearer {self.api_key}"
-            }
-        )
+
+class Requests(_RequesterConfig):
+    _shared: Dict[tuple, 'Requests'] = {}
+    _shared_lock = threading.Lock()
+
+    @staticmethod
+    def from_rapida_global() -> 'Requests':
+        key = (rapida_global.base_url, rapida_global.api_key,
+               rapida_global.fail_on_error, rapida_global.pool_config,
+               rapida_global.compression)
+        requester = Requests._shared.get(key)
+        if (requester is None):
+            with Requests._shared_lock:
+                requester = Requests._shared.setdefault(key, Requests())
+        return requester
+
+    @property
+    def session(self):
+        return session_pool.get(self.base_url, self.pool_config)
+
+    def _request(self, method: str, path: str, json: Optional[dict], data: Optional[bytes]):
+        json, data, headers = encode_body(self.compression, json, data)
+        headers["Authorization"] = f"Bearer {self.api_key}"
+        started = time.perf_counter()
+        try:
+            res = self.session.request(
+                method,
+                urljoin(self.base_url, path),
+                json=json,
+                data=data,
+                headers=headers,
+                timeout=(self.pool_config.connect_timeout,
+                         self.pool_config.read_timeout),
+            )
+        except Exception:
+            record_request(method, None, started, data)
+            raise
+        record_request(method, res.status_code, started, data)
         if (res.status_code != 200):
             print(f"Failed to log to {path}. Status code {res.status_code}")
 
         if (self.fail_on_error):
             res.raise_for_status()
         return res
+
+    def post(self, path: str, json: Optional[dict] = None, data: Optional[bytes] = None) -> requests.Response:
+        return self._request("POST", path, json, data)
+
+    def patch(self, path: str, json: Optional[dict] = None, data: Optional[bytes] = None) -> requests.Response:
+        return self._request("PATCH", path, json, data)
+
+
+def __getattr__(name):
+    # aiohttp is only imported once the asyncio requester is actually used.
+    if name == "AsyncRequests":
+        from rapida.requester.async_requests import AsyncRequests
+        return AsyncRequests
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,119 @@
+import asyncio
+import atexit
+import time
+import weakref
+from typing import AsyncGenerator, Dict, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+
+from rapida.requester import PoolConfig, _RequesterConfig, record_request
+from rapida.requester.compression import encode_body
+
+
+class _AsyncSessionPool:
+    def __init__(self):
+        # aiohttp sessions are bound to the loop they were created on.
+        self._sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, aiohttp.ClientSession]]" = weakref.WeakKeyDictionary()
+        self._closers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncGenerator]" = weakref.WeakKeyDictionary()
+        atexit.register(self._close_all)
+
+    def get(self, base_url: str, config: PoolConfig) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        sessions = self._sessions.get(loop)
+        if (sessions is None):
+            sessions = self._sessions[loop] = {}
+            self._close_at_shutdown(loop)
+        key = (base_url, config)
+        session = sessions.get(key)
+        if (session is None or session.closed):
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=config.pool_maxsize,
+                    force_close=not config.keep_alive,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=config.connect_timeout,
+                    sock_read=config.read_timeout,
+                ),
+            )
+            sessions[key] = session
+        return session
+
+    def _close_at_shutdown(self, loop: asyncio.AbstractEventLoop):
+        # The loop closes the async generators it has started when it shuts
+        # down, as asyncio.run() does, so this one closes the loop's sessions
+        # then. It is started by hand up to its yield, and kept referenced
+        # so it is not finalized early.
+        closer = self._until_shutdown()
+        try:
+            closer.asend(None).send(None)
+        except StopIteration:
+            pass
+        self._closers[loop] = closer
+
+    async def _until_shutdown(self):
+        try:
+            yield
+        finally:
+            await self.close()
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        sessions = self._sessions.pop(loop, {})
+        for session in sessions.values():
+            await session.close()
+
+    def _close_all(self):
+        # For loops that were never shut down, if they can still run.
+        for loop in list(self._sessions.keys()):
+            if (not loop.is_closed() and not loop.is_running()):
+                loop.run_until_complete(self.close())
+
+
+async_session_pool = _AsyncSessionPool()
+
+
+class AsyncResponse:
+    def __init__(self, status_code: int, body: bytes, response: aiohttp.ClientResponse):
+        self.status_code = status_code
+        self.content = body
+        self._response = response
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+
+class AsyncRequests(_RequesterConfig):
+    async def _request(self, method: str, path: str, json: Optional[dict], data: Optional[bytes]) -> AsyncResponse:
+        session = async_session_pool.get(self.base_url, self.pool_config)
+        json, data, headers = encode_body(self.compression, json, data)
+        headers["Authorization"] = f"Bearer {self.api_key}"
+        started = time.perf_counter()
+        try:
+            async with session.request(
+                method,
+                urljoin(self.base_url, path),
+                json=json,
+                data=data,
+                headers=headers,
+            ) as res:
+                response = AsyncResponse(res.status, await res.read(), res)
+        except Exception:
+            record_request(method, None, started, data)
+            raise
+        record_request(method, response.status_code, started, data)
+
+        if (response.status_code != 200):
+            print(
+                f"Failed to log to {path}. Status code {response.status_code}")
+
+        if (self.fail_on_error):
+            response.raise_for_status()
+        return response
+
+    async def post(self, path: str, json: Optional[dict] = None, data: Optional[bytes] = None) -> AsyncResponse:
+        return await self._request("POST", path, json, data)
+
+    async def patch(self, path: str, json: Optional[dict] = None, data: Optional[bytes] = None) -> AsyncResponse:
+        return await self._request("PATCH", path, json, data)
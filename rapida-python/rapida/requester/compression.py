@@ -0,0 +1,136 @@
+import gzip
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from rapida.async_logger import encoder
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+@dataclass(frozen=True)
+class CompressionConfig:
+    # "gzip" or "zstd". zstd falls back to gzip when zstandard is missing.
+    algorithm: str = "gzip"
+    # Bodies smaller than this many bytes are sent uncompressed.
+    threshold: int = 1024
+    level: Optional[int] = None
+
+    def resolved_algorithm(self) -> str:
+        if (self.algorithm == "zstd" and zstandard is not None):
+            return "zstd"
+        return "gzip"
+
+
+@dataclass
+class AlgorithmStats:
+    payloads: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    cpu_seconds: float = 0.0
+
+    @property
+    def ratio(self) -> float:
+        if (self.bytes_out == 0):
+            return 1.0
+        return self.bytes_in / self.bytes_out
+
+
+class CompressionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.algorithms: Dict[str, AlgorithmStats] = {}
+
+    def record(self, algorithm: str, bytes_in: int, bytes_out: int, cpu_seconds: float):
+        with self._lock:
+            stats = self.algorithms.setdefault(algorithm, AlgorithmStats())
+            stats.payloads += 1
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.cpu_seconds += cpu_seconds
+
+    def record_skipped(self, size: int):
+        with self._lock:
+            self.skipped += 1
+            self.skipped_bytes += size
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "skipped": self.skipped,
+                "skipped_bytes": self.skipped_bytes,
+                "algorithms": {
+                    name: {
+                        "payloads": stats.payloads,
+                        "bytes_in": stats.bytes_in,
+                        "bytes_out": stats.bytes_out,
+                        "ratio": stats.ratio,
+                        "cpu_seconds": stats.cpu_seconds,
+                    } for name, stats in self.algorithms.items()
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self.skipped = 0
+            self.skipped_bytes = 0
+            self.algorithms.clear()
+
+
+compression_stats = CompressionStats()
+
+_zstd_local = threading.local()
+
+
+def _zstd_compress(body: bytes, level: Optional[int]) -> bytes:
+    # ZstdCompressor instances are not thread safe, so one is kept per thread.
+    compressors = getattr(_zstd_local, "compressors", None)
+    if (compressors is None):
+        compressors = _zstd_local.compressors = {}
+    compressor = compressors.get(level)
+    if (compressor is None):
+        compressor = compressors[level] = zstandard.ZstdCompressor(
+            level=3 if level is None else level)
+    return compressor.compress(body)
+
+
+def compress(config: CompressionConfig, body: bytes) -> Tuple[bytes, Optional[str]]:
+    if (len(body) < config.threshold):
+        compression_stats.record_skipped(len(body))
+        return body, None
+
+    algorithm = config.resolved_algorithm()
+    start = time.thread_time()
+    if (algorithm == "zstd"):
+        compressed = _zstd_compress(body, config.level)
+    else:
+        compressed = gzip.compress(
+            body, compresslevel=6 if config.level is None else config.level, mtime=0)
+    compression_stats.record(algorithm, len(body), len(compressed),
+                             time.thread_time() - start)
+    return compressed, algorithm
+
+
+def encode_body(config: Optional[CompressionConfig], json: Optional[dict],
+                data: Optional[bytes]) -> Tuple[Optional[dict], Optional[bytes], dict]:
+    headers = {}
+    if (config is None):
+        if (data is not None):
+            headers["Content-Type"] = "application/json"
+        return json, data, headers
+
+    if (data is None):
+        if (json is None):
+            return None, None, headers
+        data = encoder.dumps(json)
+    headers["Content-Type"] = "application/json"
+    data, encoding = compress(config, data)
+    if (encoding is not None):
+        headers["Content-Encoding"] = encoding
+    return None, data, headers
@@ -0,0 +1,347 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import datetime
+import email.utils
+import random
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Optional
+
+import openai
+
+__all__ = [
+    "Attempt",
+    "RapidaRetryProps",
+    "RetryBudget",
+    "RetryEngine",
+    "RetryStats",
+    "error_status",
+    "is_retryable_error",
+]
+
+
+@dataclass
+class RapidaRetryProps:
+    # Timeouts are in milliseconds, as in the Rapida-Retry-* proxy headers.
+    num: Optional[int] = None
+    factor: Optional[float] = None
+    min_timeout: Optional[float] = None
+    max_timeout: Optional[float] = None
+
+
+# The proxy's defaults.
+DEFAULT_RETRY_PROPS = RapidaRetryProps(num=5, factor=2, min_timeout=1000, max_timeout=10000)
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    return getattr(error, "http_status", None)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    if (not isinstance(error, openai.error.OpenAIError)):
+        return False
+    if (isinstance(error, (openai.error.APIConnectionError, openai.error.Timeout,
+                           openai.error.TryAgain))):
+        return True
+    # Quota errors share the 429 status but do not go away on their own.
+    if (getattr(error, "code", None) == "insufficient_quota"):
+        return False
+    status = error_status(error)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        value = headers.get("retry-after-ms")
+        if (value is not None):
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        if (value is None):
+            return None
+        return float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if (date is None):
+            return None
+        return max(0.0, (date - datetime.datetime.now(date.tzinfo)).total_seconds())
+
+
+@dataclass
+class Attempt:
+    number: int
+    hedge: bool = False
+    started: datetime.datetime = field(default_factory=datetime.datetime.now)
+    finished: Optional[datetime.datetime] = None
+    status: Optional[int] = None
+    result: Any = None
+    error: Optional[BaseException] = None
+
+    def succeeded(self) -> bool:
+        return self.finished is not None and self.error is None
+
+
+# Sync hedged calls share one bounded pool instead of a thread per attempt.
+# A thread cannot be stopped, so an abandoned attempt keeps its worker and its
+# upstream request until it finishes; no hedge is sent while the pool is busy.
+HEDGE_WORKERS = 64
+_hedge_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_hedge_pool_lock = threading.Lock()
+_hedge_busy = 0
+
+
+def _hedge_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _hedge_pool
+    if (_hedge_pool is None):
+        with _hedge_pool_lock:
+            if (_hedge_pool is None):
+                _hedge_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=HEDGE_WORKERS, thread_name_prefix="rapida-hedge")
+    return _hedge_pool
+
+
+def _submit_attempt(fn: Callable[..., Any], *args) -> concurrent.futures.Future:
+    global _hedge_busy
+    with _hedge_pool_lock:
+        _hedge_busy += 1
+    future = _hedge_executor().submit(fn, *args)
+    future.add_done_callback(_attempt_done)
+    return future
+
+
+def _attempt_done(future: concurrent.futures.Future):
+    global _hedge_busy
+    with _hedge_pool_lock:
+        _hedge_busy -= 1
+
+
+def _hedge_pool_busy() -> bool:
+    return _hedge_busy >= HEDGE_WORKERS
+
+
+class RetryBudget:
+    # Retries and hedges may add at most `ratio` calls per call made, plus
+    # `min_per_second` to keep retrying when traffic is low, so a failing
+    # upstream is not hit with a multiple of the normal load.
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_balance: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = max_balance
+        self.exhausted = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float = 0.0):
+        now = time.monotonic()
+        self.balance = min(self.max_balance,
+                           self.balance + amount + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if (self.balance >= 1):
+                self.balance -= 1
+                return True
+            self.exhausted += 1
+            return False
+
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"retries": self.retries, "hedges": self.hedges}
+
+
+class RetryEngine:
+    def __init__(self,
+                 props: Optional[RapidaRetryProps] = None,
+                 budget: Optional[RetryBudget] = None,
+                 hedge_after: Optional[float] = None,
+                 stats: Optional[RetryStats] = None):
+        # Unset props fall back to the proxy's defaults.
+        self.props = replace(DEFAULT_RETRY_PROPS, **{
+            name: value for name, value in (props or RapidaRetryProps()).__dict__.items()
+            if value is not None})
+        self.budget = budget or RetryBudget()
+        # Seconds to wait for a response before sending a second copy of a
+        # non-streaming request. The first response to arrive is used.
+        self.hedge_after = hedge_after
+        self.stats = stats or RetryStats()
+
+    def with_props(self, props: RapidaRetryProps) -> "RetryEngine":
+        # Per call settings share the budget and stats of this engine.
+        return RetryEngine(replace(self.props, **{
+            name: value for name, value in props.__dict__.items() if value is not None}),
+            self.budget, self.hedge_after, self.stats)
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        props = self.props
+        backoff = min(props.max_timeout, props.min_timeout * props.factor ** (attempt - 1)) / 1000
+        # Equal jitter keeps callers that failed together from retrying together.
+        backoff = backoff / 2 + random.uniform(0, backoff / 2)
+        return max(backoff, retry_after(error) or 0.0)
+
+    def _should_retry(self, attempt: Attempt) -> bool:
+        return (attempt.number <= self.props.num and is_retryable_error(attempt.error)
+                and self.budget.withdraw())
+
+    def _hedges(self, kwargs: dict) -> bool:
+        return self.hedge_after is not None and not kwargs.get("stream")
+
+    def call(self, func: Callable[..., Any], kwargs: dict,
+             on_attempt: Optional[Callable[[Attempt], None]] = None) -> Any:
+        # on_attempt sees every attempt except the one whose outcome is
+        # returned or raised.
+        on_attempt = on_attempt or (lambda attempt: None)
+        self.budget.deposit()
+        number = 1
+        while (True):
+            if (self._hedges(kwargs)):
+                attempt = self._hedged(func, kwargs, number, on_attempt)
+            else:
+                attempt = self._run(func, kwargs, Attempt(number))
+            if (attempt.succeeded()):
+                return attempt.result
+            if (not self._should_retry(attempt)):
+                raise attempt.error
+            on_attempt(attempt)
+            self.stats.count("retries")
+            time.sleep(self.delay(number, attempt.error))
+            number += 1
+
+    @staticmethod
+    def _run(func: Callable[..., Any], kwargs: dict, attempt: Attempt) -> Attempt:
+        try:
+            attempt.result = func(**kwargs)
+            attempt.status = 200
+        except Exception as e:
+            attempt.error = e
+            attempt.status = error_status(e)
+        attempt.finished = datetime.datetime.now()
+        return attempt
+
+    def _hedged(self, func: Callable[..., Any], kwargs: dict, number: int,
+                on_attempt: Callable[[Attempt], None]) -> Attempt:
+        futures = {}
+
+        def start(hedge: bool):
+            attempt = Attempt(number, hedge=hedge)
+            # The caller's context goes along to the worker thread.
+            context = contextvars.copy_context()
+            futures[_submit_attempt(context.run, self._run, func, kwargs, attempt)] = attempt
+
+        start(False)
+        done, _ = concurrent.futures.wait(list(futures), timeout=self.hedge_after)
+        if (not done and not _hedge_pool_busy() and self.budget.withdraw()):
+            self.stats.count("hedges")
+            start(True)
+        winner = None
+        pending = set(futures)
+        while (pending and winner is None):
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            winner = next((futures[f] for f in done if futures[f].succeeded()), None)
+        if (winner is None):
+            winner = max(futures.values(), key=lambda a: a.finished)
+        # Every attempt is reported before returning, so the logs of a call
+        # never arrive after it. A copy still in flight is abandoned and
+        # whatever it returns is discarded; unlike the asyncio path, cancel()
+        # only stops a copy that has not started running yet.
+        for future, attempt in futures.items():
+            if (attempt is winner):
+                continue
+            if (future in pending):
+                future.cancel()
+                attempt = replace(attempt, finished=datetime.datetime.now(), result=None,
+                                  error=concurrent.futures.CancelledError(
+                                      "Abandoned after another copy of the request won"))
+            on_attempt(attempt)
+        return winner
+
+    async def acall(self, func: Callable[..., Awaitable[Any]], kwargs: dict,
+                    on_attempt: Optional[Callable[[Attempt], Awaitable[None]]] = None) -> Any:
+        if (on_attempt is None):
+            async def on_attempt(attempt):
+                pass
+        self.budget.deposit()
+        number = 1
+        while (True):
+            if (self._hedges(kwargs)):
+                attempt = await self._ahedged(func, kwargs, number, on_attempt)
+            else:
+                attempt = await self._arun(func, kwargs, Attempt(number))
+            if (attempt.succeeded()):
+                return attempt.result
+            if (not self._should_retry(attempt)):
+                raise attempt.error
+            await on_attempt(attempt)
+            self.stats.count("retries")
+            await asyncio.sleep(self.delay(number, attempt.error))
+            number += 1
+
+    @staticmethod
+    async def _arun(func: Callable[..., Awaitable[Any]], kwargs: dict, attempt: Attempt) -> Attempt:
+        try:
+            attempt.result = await func(**kwargs)
+            attempt.status = 200
+        except asyncio.CancelledError as e:
+            attempt.error = e
+            attempt.finished = datetime.datetime.now()
+            raise
+        except Exception as e:
+            attempt.error = e
+            attempt.status = error_status(e)
+        attempt.finished = datetime.datetime.now()
+        return attempt
+
+    async def _ahedged(self, func: Callable[..., Awaitable[Any]], kwargs: dict, number: int,
+                       on_attempt: Callable[[Attempt], Awaitable[None]]) -> Attempt:
+        attempts = {}
+
+        def start(hedge: bool):
+            attempt = Attempt(number, hedge=hedge)
+            attempts[asyncio.ensure_future(self._arun(func, kwargs, attempt))] = attempt
+
+        start(False)
+        done, pending = await asyncio.wait(list(attempts), timeout=self.hedge_after)
+        if (not done and self.budget.withdraw()):
+            self.stats.count("hedges")
+            start(True)
+        winner = None
+        pending = set(attempts)
+        try:
+            while (pending and winner is None):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((attempts[t] for t in done if attempts[t].succeeded()), None)
+        finally:
+            # Copies still in flight are cancelled once the outcome is known.
+            for task in pending:
+                task.cancel()
+            if (pending):
+                await asyncio.wait(pending)
+        if (winner is None):
+            winner = max(attempts.values(), key=lambda a: a.finished)
+        for attempt in attempts.values():
+            if (attempt is not winner):
+                await on_attempt(attempt)
+        return winner
@@ -1,10 +1,23 @@
+import threading
+import time
 from dataclasses import dataclass, field, asdict
 from enum import Enum, auto
 from uuid import uuid4
-from typing import Optional
+from typing import Dict, List, Optional, Union
 
+from rapida import metrics, tracing
 from rapida.requester import Requests
 
+RUN_EVENTS = metrics.registry.counter(
+    "rapida_run_events", "Jobs and nodes created or given a new status", ("kind", "event"))
+GRAPH_PENDING = metrics.registry.gauge(
+    "rapida_graph_pending", "Jobs, nodes and statuses waiting for the next graph flush")
+GRAPH_FLUSH_SIZE = metrics.registry.histogram(
+    "rapida_graph_flush_size", "Jobs, nodes and statuses sent per graph flush",
+    buckets=(1, 10, 100, 1000, 10000))
+GRAPH_FLUSH_SECONDS = metrics.registry.histogram(
+    "rapida_graph_flush_seconds", "Time spent sending a graph flush")
+
 
 class RapidaStatus(Enum):
     PENDING = auto()
@@ -14,6 +27,14 @@ class RapidaStatus(Enum):
     CANCELLED = auto()
 
 
+def _end_span(id: str, status: "RapidaStatus"):
+    # Job and node spans end with their first final status.
+    if (status == RapidaStatus.SUCCESS):
+        tracing.end_run(id)
+    elif (status in (RapidaStatus.FAILED, RapidaStatus.CANCELLED)):
+        tracing.end_run(id, status.name)
+
+
 @dataclass(kw_only=True)
 class RapidaNodeConfig:
     parent_job_id: Optional[str] = None
@@ -27,7 +48,8 @@ class RapidaNode(RapidaNodeConfig):
     job: "RapidaJob"
     id: str = field(default_factory=lambda: str(uuid4()))
     status: RapidaStatus = RapidaStatus.PENDING
-    requester: Requests = field(default_factory=Requests)
+    requester: Optional[Requests] = None
+    graph: Optional["RapidaGraphBuilder"] = None
 
     def to_dict(self):
         return {
@@ -40,6 +62,21 @@ class RapidaNode(RapidaNodeConfig):
         }
 
     def __post_init__(self):
+        RUN_EVENTS.labels("node", "created").inc()
+        tracing.start_run(self.id, "rapida.node", self.parent_job_id or self.job.id, {
+            "rapida.node.id": self.id,
+            "rapida.node.name": self.name,
+            "rapida.job.id": self.job.id,
+        })
+        if (self.requester is None):
+            self.requester = self.job.requester
+        if (self.graph is None):
+            self.graph = self.job.graph
+
+        if (self.graph is not None):
+            self.graph.add_node(self)
+            return
+
         self.requester.post(
             "/node",
             json=self.to_dict(),
@@ -54,6 +91,13 @@ class RapidaNode(RapidaNodeConfig):
         return self.status == RapidaStatus.SUCCESS or self.status == RapidaStatus.FAILED
 
     def set_status(self, status: RapidaNodeConfig):
+        RUN_EVENTS.labels("node", "status").inc()
+        _end_span(self.id, status)
+        if (self.graph is not None):
+            self.status = status
+            self.graph.set_status(self, status)
+            return
+
         self.requester.patch(
             f"/node/{self.id}/status",
             json={
@@ -79,8 +123,9 @@ class RapidaJob:
     custom_properties: dict[str, str] = field(default_factory=dict)
     timeout_seconds: int = 60
     status: RapidaStatus = RapidaStatus.PENDING
-    requester: Requests = field(default_factory=Requests)
+    requester: Requests = field(default_factory=Requests.from_rapida_global)
     id: str = field(default_factory=lambda: str(uuid4()))
+    graph: Optional["RapidaGraphBuilder"] = None
 
     def to_dict(self):
         return {
@@ -93,6 +138,15 @@ class RapidaJob:
         }
 
     def __post_init__(self):
+        RUN_EVENTS.labels("job", "created").inc()
+        tracing.start_run(self.id, "rapida.job", attributes={
+            "rapida.job.id": self.id,
+            "rapida.job.name": self.name,
+        })
+        if (self.graph is not None):
+            self.graph.add_job(self)
+            return
+
         self.requester.post(
             "/job",
             json=self.to_dict()
@@ -106,6 +160,13 @@ class RapidaJob:
         return RapidaNode(job=self, **task_data)
 
     def set_status(self, status: RapidaStatus):
+        RUN_EVENTS.labels("job", "status").inc()
+        _end_span(self.id, status)
+        if (self.graph is not None):
+            self.status = status
+            self.graph.set_status(self, status)
+            return
+
         self.requester.patch(
             f"/job/{self.id}/status",
             json={
@@ -122,3 +183,168 @@ class RapidaJob:
 
     def cancel(self):
         self.set_status(RapidaStatus.CANCELLED)
+
+
+def _accepted(res) -> bool:
+    # Without fail_on_error, rejected requests return instead of raising.
+    return 200 <= res.status_code < 300
+
+
+def _statuses(statuses: Dict[str, str]) -> List[dict]:
+    return [{"id": id, "status": status} for id, status in statuses.items()]
+
+
+class RapidaGraphBuilder:
+    requester: Requests
+    max_pending: int
+    bulk: bool
+
+    def __init__(self,
+                 requester: Optional[Requests] = None,
+                 max_pending: int = 1000,
+                 bulk: bool = True):
+        self.requester = requester or Requests.from_rapida_global()
+        self.max_pending = max_pending
+        self.bulk = bulk
+        self._jobs: Dict[str, RapidaJob] = {}
+        self._nodes: Dict[str, RapidaNode] = {}
+        self._job_statuses: Dict[str, RapidaStatus] = {}
+        self._node_statuses: Dict[str, RapidaStatus] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def __enter__(self) -> "RapidaGraphBuilder":
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def job(self, name: str, **kwargs) -> RapidaJob:
+        kwargs.setdefault("requester", self.requester)
+        return RapidaJob(name=name, graph=self, **kwargs)
+
+    def pending(self) -> int:
+        return (len(self._jobs) + len(self._nodes)
+                + len(self._job_statuses) + len(self._node_statuses))
+
+    def add_job(self, job: RapidaJob):
+        with self._lock:
+            self._jobs[job.id] = job
+        self._flush_if_full()
+
+    def add_node(self, node: RapidaNode):
+        with self._lock:
+            self._nodes[node.id] = node
+        self._flush_if_full()
+
+    def set_status(self, target: Union[RapidaJob, RapidaNode], status: RapidaStatus):
+        # Only the latest status is kept until the next flush, and jobs or
+        # nodes that have not been sent yet carry it in their create payload.
+        with self._lock:
+            if (isinstance(target, RapidaJob)):
+                if (target.id not in self._jobs):
+                    self._job_statuses[target.id] = status
+            elif (target.id not in self._nodes):
+                self._node_statuses[target.id] = status
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        pending = self.pending()
+        GRAPH_PENDING.set(pending)
+        if (pending >= self.max_pending):
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                job_objects, self._jobs = self._jobs, {}
+                node_objects, self._nodes = self._nodes, {}
+                jobs = {id: job.to_dict() for id, job in job_objects.items()}
+                nodes = {id: dict(node.to_dict(), status=node.status.name)
+                         for id, node in node_objects.items()}
+                job_statuses = {id: status.name for id, status in self._job_statuses.items()}
+                node_statuses = {id: status.name for id, status in self._node_statuses.items()}
+                self._job_statuses.clear()
+                self._node_statuses.clear()
+
+            GRAPH_PENDING.set(self.pending())
+            GRAPH_FLUSH_SIZE.observe(len(jobs) + len(nodes) + len(job_statuses) + len(node_statuses))
+            started = time.perf_counter()
+            # Entries are removed from these maps as they are sent, and
+            # whatever is left when a request fails waits for the next flush.
+            try:
+                # Jobs go first so that every node references an existing job.
+                if (self.bulk):
+                    sent = self._send_bulk(jobs, nodes, job_statuses, node_statuses)
+                else:
+                    sent = self._send_each(jobs, nodes, job_statuses, node_statuses)
+            except BaseException:
+                self._restore(job_objects, node_objects, jobs, nodes, job_statuses, node_statuses)
+                raise
+            if (not sent):
+                self._restore(job_objects, node_objects, jobs, nodes, job_statuses, node_statuses)
+            GRAPH_FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+    def _restore(self, job_objects: Dict[str, RapidaJob], node_objects: Dict[str, RapidaNode],
+                 jobs: Dict[str, dict], nodes: Dict[str, dict],
+                 job_statuses: Dict[str, str], node_statuses: Dict[str, str]):
+        # Anything added or changed while the flush was running is newer.
+        with self._lock:
+            for id in jobs:
+                self._jobs.setdefault(id, job_objects[id])
+            for id in nodes:
+                self._nodes.setdefault(id, node_objects[id])
+            for id, status in job_statuses.items():
+                if (id not in self._jobs):
+                    self._job_statuses.setdefault(id, RapidaStatus[status])
+            for id, status in node_statuses.items():
+                if (id not in self._nodes):
+                    self._node_statuses.setdefault(id, RapidaStatus[status])
+        GRAPH_PENDING.set(self.pending())
+
+    def _send_bulk(self, jobs: Dict[str, dict], nodes: Dict[str, dict],
+                   job_statuses: Dict[str, str], node_statuses: Dict[str, str]) -> bool:
+        # Stops at the first request that is not accepted, and returns
+        # whether everything was sent.
+        if (jobs):
+            if (not _accepted(self.requester.post("/job/bulk", json={"jobs": list(jobs.values())}))):
+                return False
+            jobs.clear()
+        if (nodes):
+            if (not _accepted(self.requester.post("/node/bulk", json={"nodes": list(nodes.values())}))):
+                return False
+            nodes.clear()
+        if (job_statuses):
+            if (not _accepted(self.requester.patch("/job/status/bulk",
+                                                   json={"statuses": _statuses(job_statuses)}))):
+                return False
+            job_statuses.clear()
+        if (node_statuses):
+            if (not _accepted(self.requester.patch("/node/status/bulk",
+                                                   json={"statuses": _statuses(node_statuses)}))):
+                return False
+            node_statuses.clear()
+        return True
+
+    def _send_each(self, jobs: Dict[str, dict], nodes: Dict[str, dict],
+                   job_statuses: Dict[str, str], node_statuses: Dict[str, str]) -> bool:
+        for id, job in list(jobs.items()):
+            if (not _accepted(self.requester.post("/job", json=job))):
+                return False
+            del jobs[id]
+        for id, node in list(nodes.items()):
+            payload = {key: value for key, value in node.items() if key != "status"}
+            if (not _accepted(self.requester.post("/node", json=payload))):
+                return False
+            del nodes[id]
+            if (node["status"] != RapidaStatus.PENDING.name):
+                node_statuses.setdefault(id, node["status"])
+        for id, status in list(job_statuses.items()):
+            if (not _accepted(self.requester.patch(f"/job/{id}/status", json={"status": status}))):
+                return False
+            del job_statuses[id]
+        for id, status in list(node_statuses.items()):
+            if (not _accepted(self.requester.patch(f"/node/{id}/status", json={"status": status}))):
+                return False
+            del node_statuses[id]
+        return True
@@ -0,0 +1,162 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from rapida.cache import ResponseCache
+from rapida.timing import QuantileSketch
+
+__all__ = ["AdaptiveSampling", "Sampler", "SamplingRule", "SamplingStats"]
+
+
+@dataclass(frozen=True)
+class SamplingRule:
+    # Unset fields match every call, the first matching rule wins.
+    rate: float
+    resource: Optional[str] = None
+    model: Optional[str] = None
+    user_id: Optional[str] = None
+    properties: Optional[Dict[str, str]] = None
+
+    def matches(self, resource: str, model: Optional[str], user_id: Optional[str],
+                properties: Dict[str, str]) -> bool:
+        if (self.resource is not None and self.resource != resource):
+            return False
+        if (self.model is not None and self.model != model):
+            return False
+        if (self.user_id is not None and self.user_id != user_id):
+            return False
+        if (self.properties):
+            return all(str(properties.get(key)) == str(value)
+                       for key, value in self.properties.items())
+        return True
+
+
+@dataclass(frozen=True)
+class AdaptiveSampling:
+    # Rates are halved while more than high_water of the shipping queue is
+    # in use, and recover once it drains below low_water.
+    high_water: float = 0.5
+    low_water: float = 0.1
+    min_factor: float = 0.01
+    interval: float = 1.0
+
+
+class _Counts:
+    __slots__ = ("calls", "errors", "kept", "latency_ms", "tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.kept = 0
+        self.latency_ms = 0.0
+        self.tokens = 0
+
+
+class SamplingStats:
+    # Every call is counted here, sampled out or not, so totals stay exact.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[str, Optional[str]], _Counts] = {}
+
+    def record(self, resource: str, model: Optional[str], error: bool, kept: bool,
+               latency_ms: float, tokens: int):
+        with self._lock:
+            counts = self._counts.get((resource, model))
+            if (counts is None):
+                counts = self._counts[(resource, model)] = _Counts()
+            counts.calls += 1
+            counts.errors += error
+            counts.kept += kept
+            counts.latency_ms += latency_ms
+            counts.tokens += tokens
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f"{resource}:{model or ''}": {name: getattr(counts, name) for name in _Counts.__slots__}
+                for (resource, model), counts in self._counts.items()
+            }
+
+
+def _hash_fraction(key: str) -> float:
+    return int(key[:15], 16) / float(16 ** 15)
+
+
+class Sampler:
+    def __init__(self,
+                 default_rate: float = 1.0,
+                 rules: Sequence[SamplingRule] = (),
+                 keep_errors: bool = True,
+                 slow_ms: Optional[float] = None,
+                 outlier_quantile: Optional[float] = 0.99,
+                 adaptive: Optional[AdaptiveSampling] = None):
+        self.default_rate = default_rate
+        self.rules = tuple(rules)
+        self.keep_errors = keep_errors
+        # Calls slower than slow_ms, or than the running outlier_quantile of
+        # their resource and model, are always kept.
+        self.slow_ms = slow_ms
+        self.outlier_quantile = outlier_quantile
+        self.adaptive = adaptive
+        self.factor = 1.0
+        self.stats = SamplingStats()
+        self._latencies: Dict[Tuple[str, Optional[str]], QuantileSketch] = {}
+        self._lock = threading.Lock()
+        self._adapted_at = 0.0
+
+    def rate_for(self, resource: str, model: Optional[str], user_id: Optional[str],
+                 properties: Dict[str, str]) -> float:
+        for rule in self.rules:
+            if (rule.matches(resource, model, user_id, properties)):
+                return rule.rate
+        return self.default_rate
+
+    def _adapt(self, backlog: Callable[[], float]):
+        now = time.monotonic()
+        if (now - self._adapted_at < self.adaptive.interval):
+            return
+        self._adapted_at = now
+        used = backlog()
+        if (used > self.adaptive.high_water):
+            self.factor = max(self.adaptive.min_factor, self.factor / 2)
+        elif (used < self.adaptive.low_water):
+            self.factor = min(1.0, self.factor * 2)
+
+    def _outlier(self, resource: str, model: Optional[str], latency_ms: float) -> bool:
+        if (self.slow_ms is not None and latency_ms >= self.slow_ms):
+            return True
+        if (self.outlier_quantile is None):
+            return False
+        with self._lock:
+            sketch = self._latencies.get((resource, model))
+            if (sketch is None):
+                sketch = self._latencies[(resource, model)] = QuantileSketch(0.02)
+            threshold = sketch.quantile(self.outlier_quantile) if sketch.count >= 100 else None
+            sketch.add(latency_ms)
+        return threshold is not None and latency_ms > threshold
+
+    def sample(self, resource: str, body: dict,
+               user_id: Optional[str] = None,
+               properties: Optional[Dict[str, str]] = None,
+               error: bool = False,
+               latency_ms: float = 0.0,
+               tokens: int = 0,
+               backlog: Optional[Callable[[], float]] = None) -> Optional[float]:
+        # Returns the rate the call was kept at, or None when it is dropped.
+        model = body.get("model") or body.get("engine") or body.get("deployment_id")
+        if (self.adaptive is not None and backlog is not None):
+            self._adapt(backlog)
+
+        rate = None
+        if (error and self.keep_errors):
+            rate = 1.0
+        elif (self._outlier(resource, model, latency_ms)):
+            rate = 1.0
+        else:
+            candidate = min(1.0, self.rate_for(resource, model, user_id, properties or {}) * self.factor)
+            # Identical requests, such as retries, get the same decision.
+            if (candidate >= 1.0 or _hash_fraction(ResponseCache.key(resource, body)) < candidate):
+                rate = candidate
+        self.stats.record(resource, model, error, rate is not None, latency_ms, tokens)
+        return rate
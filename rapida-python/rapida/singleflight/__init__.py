@@ -0,0 +1,128 @@
+import asyncio
+import copy
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Chat and text completions are only coalesced when they are deterministic.
+_SAMPLED_RESOURCES = ("ChatCompletion", "Completion")
+
+
+class _Call:
+    __slots__ = ("leader_id", "event", "result", "error", "followers")
+
+    def __init__(self, leader_id: Optional[str]):
+        self.leader_id = leader_id
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+def _own_error(error: BaseException) -> BaseException:
+    # Each follower raises its own copy of the leader's error, raising one
+    # exception object from several callers would mix up their tracebacks.
+    # __init__ is skipped, as not every exception takes back its own args.
+    own = type(error).__new__(type(error), *error.args)
+    own.__dict__.update(error.__dict__)
+    return own
+
+
+class SingleFlight:
+    def __init__(self,
+                 resources: Tuple[str, ...] = ("ChatCompletion", "Completion", "Embedding"),
+                 require_deterministic: bool = True):
+        self.resources = resources
+        self.require_deterministic = require_deterministic
+        self.coalesced = 0
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        # Futures belong to the loop they were created on.
+        self._async_calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _Call]]" = \
+            weakref.WeakKeyDictionary()
+
+    def eligible(self, resource: str, body: dict) -> bool:
+        # Streams can only be consumed once, so they are never shared.
+        if resource not in self.resources or body.get("stream"):
+            return False
+        if self.require_deterministic and resource in _SAMPLED_RESOURCES:
+            return body.get("temperature") == 0 and (body.get("n") or 1) == 1
+        return True
+
+    def do(self, key: str, func: Callable[[], Any],
+           request_id: Optional[str] = None) -> Tuple[Any, Optional[str]]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call(request_id)
+                leader = True
+            else:
+                call.followers += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise _own_error(call.error) from call.error
+            return copy.deepcopy(call.result), call.leader_id
+
+        try:
+            result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Once the call is unregistered no more followers can join, so
+            # the follower count is final.
+            with self._lock:
+                del self._calls[key]
+            if call.error is not None or not call.followers:
+                call.event.set()
+
+        try:
+            # Followers copy a snapshot, the leader is free to modify its
+            # own result as soon as it is returned.
+            if call.followers:
+                call.result = copy.deepcopy(result)
+        finally:
+            call.event.set()
+        return result, None
+
+    async def ado(self, key: str, func: Callable[[], Awaitable[Any]],
+                  request_id: Optional[str] = None) -> Tuple[Any, Optional[str]]:
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        call = calls.get(key)
+        if call is not None:
+            call.followers += 1
+            self.coalesced += 1
+            # Unlike shield, wait only raises if this caller is cancelled.
+            await asyncio.wait((call.result,))
+            if call.result.cancelled():
+                # The leader was cancelled, not this caller, so the call is
+                # made again, shared by the callers that are still waiting.
+                return await self.ado(key, func, request_id)
+            error = call.result.exception()
+            if error is not None:
+                raise _own_error(error) from error
+            return copy.deepcopy(call.result.result()), call.leader_id
+
+        call = calls[key] = _Call(request_id)
+        future = call.result = loop.create_future()
+        # Marks the exception as retrieved when there are no followers.
+        future.add_done_callback(
+            lambda f: f.cancelled() or f.exception())
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(copy.deepcopy(result) if call.followers else None)
+            return result, None
+        finally:
+            del calls[key]
@@ -0,0 +1,69 @@
+import time
+from typing import Optional
+
+from rapida.async_logger.async_logger import ChunkIntervals, Timing, UnixTimeStamp
+from rapida.timing.sketch import QuantileSketch
+
+__all__ = ["QuantileSketch", "RequestClock"]
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class RequestClock:
+    # Wall clock time is only read once, every other point is measured with
+    # perf_counter so the timing cannot jump with the system clock.
+    __slots__ = ("started_at", "_start", "headers", "first_chunk", "last_chunk",
+                 "_previous", "intervals")
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.headers: Optional[float] = None
+        self.first_chunk: Optional[float] = None
+        self.last_chunk: Optional[float] = None
+        self._previous: Optional[float] = None
+        self.intervals: Optional[QuantileSketch] = None
+
+    def mark_headers(self):
+        if (self.headers is None):
+            self.headers = time.perf_counter() - self._start
+
+    def mark_chunk(self):
+        now = time.perf_counter() - self._start
+        if (self.first_chunk is None):
+            self.first_chunk = now
+            self.intervals = QuantileSketch()
+        else:
+            self.intervals.add((now - self._previous) * 1000)
+        self._previous = self.last_chunk = now
+
+    def elapsed_ms(self) -> float:
+        end = self.last_chunk
+        if (end is None):
+            end = time.perf_counter() - self._start
+        return end * 1000
+
+    def timing(self) -> Timing:
+        # A stream ends with its last chunk, however long the consumer takes
+        # to get back for the end of the iteration.
+        end = self.last_chunk
+        if (end is None):
+            end = time.perf_counter() - self._start
+        intervals = None
+        if (self.intervals is not None and self.intervals.count):
+            intervals = ChunkIntervals(
+                count=self.intervals.count,
+                meanMs=round(self.intervals.mean, 3),
+                p95Ms=round(self.intervals.quantile(0.95), 3),
+                maxMs=round(self.intervals.max, 3),
+            )
+        return Timing(
+            UnixTimeStamp.from_timestamp(self.started_at),
+            UnixTimeStamp.from_timestamp(self.started_at + end),
+            _ms(self.headers),
+            _ms(self.first_chunk),
+            _ms(self.last_chunk),
+            intervals,
+        )
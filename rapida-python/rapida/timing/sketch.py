@@ -0,0 +1,73 @@
+import math
+from typing import Dict, Optional
+
+
+class QuantileSketch:
+    # Log-bucketed histogram, quantiles are within relative_accuracy of the
+    # true value and memory grows with the range of values, not their count.
+    __slots__ = ("relative_accuracy", "_gamma", "_log_gamma", "_buckets",
+                 "zeros", "count", "sum", "min", "max")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float, count: int = 1):
+        self.count += count
+        self.sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if (value <= 0):
+            self.zeros += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[index] = self._buckets.get(index, 0) + count
+
+    def merge(self, other: "QuantileSketch"):
+        if (other.relative_accuracy != self.relative_accuracy):
+            raise ValueError("Sketches with different accuracies cannot be merged")
+        self.count += other.count
+        self.sum += other.sum
+        self.zeros += other.zeros
+        for bound in (other.min, other.max):
+            if (bound is not None):
+                self.min = bound if self.min is None else min(self.min, bound)
+                self.max = bound if self.max is None else max(self.max, bound)
+        for index, count in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        if (not self.count):
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if (rank < seen):
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if (rank < seen):
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zeros": self.zeros,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {str(index): count for index, count in sorted(self._buckets.items())},
+        }
@@ -0,0 +1,392 @@
+import atexit
+import contextvars
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import (Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List,
+                    Optional)
+
+from rapida.async_logger import encoder
+from rapida.globals import rapida_global
+
+__all__ = [
+    "FileSpanExporter",
+    "InMemorySpanExporter",
+    "Span",
+    "SpanExporter",
+    "Tracer",
+    "current_span",
+    "end_run",
+    "span",
+    "start_run",
+    "traced",
+    "traced_async",
+]
+
+logger = logging.getLogger(__name__)
+
+SPAN_KIND_INTERNAL = "SPAN_KIND_INTERNAL"
+SPAN_KIND_CLIENT = "SPAN_KIND_CLIENT"
+STATUS_OK = "STATUS_CODE_OK"
+STATUS_ERROR = "STATUS_CODE_ERROR"
+STATUS_UNSET = "STATUS_CODE_UNSET"
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "rapida_current_span", default=None)
+
+
+class Span:
+    # Field names follow the OTLP JSON encoding, so exported spans can be
+    # loaded by OpenTelemetry tooling.
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_span_id",
+                 "start_ns", "end_ns", "attributes", "status", "status_message")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None,
+                 kind: str = SPAN_KIND_INTERNAL,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes if attributes is not None else {}
+        self.status = STATUS_UNSET
+        self.status_message: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def to_dict(self) -> dict:
+        status = {"code": self.status}
+        if (self.status_message is not None):
+            status["message"] = self.status_message
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": status,
+        }
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, spans: List[dict]):
+        ...
+
+    def shutdown(self):
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: List[dict] = []
+
+    def export(self, spans: List[dict]):
+        with self._lock:
+            self.spans.extend(spans)
+
+    def get_finished_spans(self) -> List[dict]:
+        with self._lock:
+            return list(self.spans)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+class FileSpanExporter(SpanExporter):
+    # One JSON span per line, appended batch by batch.
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[dict]):
+        with self._lock:
+            self._file.write(b"".join(encoder.dumps(span) + b"\n" for span in spans))
+            self._file.flush()
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+class _Scope:
+    __slots__ = ("tracer", "span", "_token", "_streaming")
+
+    def __init__(self, tracer: "Tracer", span: Span):
+        self.tracer = tracer
+        self.span = span
+        self._streaming = False
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if (exc is not None):
+            self.span.set_error(exc)
+        if (exc is not None or not self._streaming):
+            self.tracer.end(self.span)
+
+    def stream(self, stream: Iterator[Any]) -> Iterator[Any]:
+        # The span stays open until the stream is exhausted or closed.
+        self._streaming = True
+        return self._finish_after(stream)
+
+    def _finish_after(self, stream: Iterator[Any]) -> Iterator[Any]:
+        try:
+            yield from stream
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            self.span.set_error(e)
+            raise
+        finally:
+            self.tracer.end(self.span)
+
+    def astream(self, stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        self._streaming = True
+        return self._afinish_after(stream)
+
+    async def _afinish_after(self, stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        try:
+            async for item in stream:
+                yield item
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            self.span.set_error(e)
+            raise
+        finally:
+            try:
+                # Closing early closes the wrapped stream too.
+                await stream.aclose()
+            finally:
+                self.tracer.end(self.span)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_error(self, error: BaseException):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self,
+                 exporter: SpanExporter,
+                 max_batch_size: int = 512,
+                 max_queue_size: int = 2048,
+                 flush_interval: float = 5.0,
+                 max_open_runs: int = 10000):
+        self.exporter = exporter
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        # Jobs and nodes stay open until they finish. The oldest are
+        # forgotten, without being exported, past max_open_runs.
+        self.max_open_runs = max_open_runs
+        self.dropped = 0
+        self._runs: "OrderedDict[str, Span]" = OrderedDict()
+        self._queue: Deque[Span] = deque()
+        self._pending = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(
+            target=self._run, name="rapida-span-exporter", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def start(self, name: str, parent: Optional[Span] = None,
+              kind: str = SPAN_KIND_INTERNAL,
+              attributes: Optional[Dict[str, Any]] = None) -> Span:
+        return Span(name, parent if parent is not None else _current.get(), kind, attributes)
+
+    def end(self, span: Span):
+        span.end_ns = time.time_ns()
+        if (span.status == STATUS_UNSET):
+            span.status = STATUS_OK
+        with self._cond:
+            if (self._closed or len(self._queue) >= self.max_queue_size):
+                self.dropped += 1
+                return
+            self._queue.append(span)
+            self._pending += 1
+            if (len(self._queue) >= self.max_batch_size):
+                self._cond.notify_all()
+
+    def scope(self, name: str, parent: Optional[Span] = None,
+              kind: str = SPAN_KIND_INTERNAL,
+              attributes: Optional[Dict[str, Any]] = None) -> _Scope:
+        return _Scope(self, self.start(name, parent, kind, attributes))
+
+    def start_run(self, run_id: str, name: str, parent_id: Optional[str] = None,
+                  attributes: Optional[Dict[str, Any]] = None) -> Span:
+        # Jobs and nodes outlive any one call, so their spans are kept by id
+        # instead of in the current context.
+        with self._cond:
+            parent = self._runs.get(parent_id) if parent_id is not None else None
+        span = Span(name, parent, attributes=attributes)
+        with self._cond:
+            self._runs[run_id] = span
+            while (len(self._runs) > self.max_open_runs):
+                self._runs.popitem(last=False)
+        return span
+
+    def run(self, run_id: Optional[str]) -> Optional[Span]:
+        if (run_id is None):
+            return None
+        with self._cond:
+            return self._runs.get(run_id)
+
+    def end_run(self, run_id: str, error: Optional[str] = None):
+        with self._cond:
+            span = self._runs.pop(run_id, None)
+        if (span is None):
+            return
+        if (error is not None):
+            span.status = STATUS_ERROR
+            span.status_message = error
+        self.end(span)
+
+    def _next_batch(self) -> List[Span]:
+        with self._cond:
+            self._cond.wait_for(lambda: (self._closed or self._flush_requested
+                                         or len(self._queue) >= self.max_batch_size),
+                                timeout=self.flush_interval)
+            batch = []
+            while (self._queue and len(batch) < self.max_batch_size):
+                batch.append(self._queue.popleft())
+            if (not self._queue):
+                self._flush_requested = False
+            return batch
+
+    def _run(self):
+        while (True):
+            batch = self._next_batch()
+            if (batch):
+                try:
+                    self.exporter.export([span.to_dict() for span in batch])
+                except Exception as e:
+                    logger.error(f"Failed to export {len(batch)} spans: {e}")
+                with self._cond:
+                    self._pending -= len(batch)
+                    self._cond.notify_all()
+            elif (self._closed):
+                return
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            if (not self._worker.is_alive()):
+                return self._pending == 0
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = 5.0) -> bool:
+        with self._cond:
+            if (self._closed):
+                return self._pending == 0
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        atexit.unregister(self.close)
+        self.exporter.shutdown()
+        return self._pending == 0
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def span(name: str, parent: Optional[Span] = None, kind: str = SPAN_KIND_INTERNAL,
+         attributes: Optional[Dict[str, Any]] = None):
+    # Without a tracer this is one attribute lookup and a shared no-op
+    # context manager.
+    tracer = rapida_global.tracer
+    if (tracer is None):
+        return _NOOP
+    return tracer.scope(name, parent, kind, attributes)
+
+
+def start_run(run_id: str, name: str, parent_id: Optional[str] = None,
+              attributes: Optional[Dict[str, Any]] = None):
+    tracer = rapida_global.tracer
+    if (tracer is not None):
+        tracer.start_run(run_id, name, parent_id, attributes)
+
+
+def end_run(run_id: str, error: Optional[str] = None):
+    tracer = rapida_global.tracer
+    if (tracer is not None):
+        tracer.end_run(run_id, error)
+
+
+def _call_parent(tracer: Tracer, kwargs: dict) -> Optional[Span]:
+    # Calls made for a RapidaNode are children of its span. Async mode takes
+    # rapida_meta, proxy mode rapidaMeta or the meta fields as kwargs.
+    meta = kwargs.get("rapida_meta") or kwargs.get("rapidaMeta")
+    return tracer.run(getattr(meta, "node_id", None) or kwargs.get("node_id"))
+
+
+def traced(name: str, wrapper: Callable[..., Any], attributes: Dict[str, Any]) -> Callable[..., Any]:
+    @functools.wraps(wrapper)
+    def call(*args, **kwargs):
+        tracer = rapida_global.tracer
+        if (tracer is None):
+            return wrapper(*args, **kwargs)
+        scope = tracer.scope(name, _call_parent(tracer, kwargs), attributes=dict(attributes))
+        with scope:
+            result = wrapper(*args, **kwargs)
+            if (inspect.isgenerator(result)):
+                return scope.stream(result)
+            return result
+    return call
+
+
+def traced_async(name: str, wrapper: Callable[..., Awaitable[Any]],
+                 attributes: Dict[str, Any]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(wrapper)
+    async def call(*args, **kwargs):
+        tracer = rapida_global.tracer
+        if (tracer is None):
+            return await wrapper(*args, **kwargs)
+        scope = tracer.scope(name, _call_parent(tracer, kwargs), attributes=dict(attributes))
+        with scope:
+            result = await wrapper(*args, **kwargs)
+            if (inspect.isasyncgen(result)):
+                return scope.astream(result)
+            return result
+    return call
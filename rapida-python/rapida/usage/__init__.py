@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional, Tuple
+
+__all__ = [
+    "ApproximateTokenizer",
+    "DEFAULT_PRICES",
+    "StreamUsage",
+    "TiktokenTokenizer",
+    "Tokenizer",
+    "UsageEstimator",
+]
+
+logger = logging.getLogger(__name__)
+
+# USD per 1K prompt and completion tokens, matched on the longest prefix of
+# the model name.
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-3.5-turbo-instruct": (0.0015, 0.002),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "text-davinci": (0.02, 0.02),
+    "text-curie": (0.002, 0.002),
+    "text-babbage": (0.0005, 0.0005),
+    "text-ada": (0.0004, 0.0004),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+
+
+class Tokenizer(ABC):
+    @abstractmethod
+    def count(self, text: str) -> int:
+        ...
+
+
+class ApproximateTokenizer(Tokenizer):
+    # Roughly four characters per token for English text. Streams usually
+    # carry a single token per delta, so short texts count as one.
+    def count(self, text: str) -> int:
+        if (not text):
+            return 0
+        return max(1, round(len(text) / 4))
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, model: str):
+        import tiktoken
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        if (not text):
+            return 0
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+def default_tokenizer(model: str) -> Tokenizer:
+    try:
+        return TiktokenTokenizer(model)
+    except ImportError:
+        return ApproximateTokenizer()
+
+
+class StreamUsage:
+    # Counts completion tokens as deltas arrive, so the text is never
+    # tokenized again at the end of the stream.
+    __slots__ = ("_estimator", "model", "prompt_tokens", "completion_tokens", "_tokenizer")
+
+    def __init__(self, estimator: "UsageEstimator", model: str, prompt_tokens: int):
+        self._estimator = estimator
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self._tokenizer = estimator.tokenizer(model)
+
+    def add_choice(self, choice: dict):
+        try:
+            self._count_choice(choice)
+        except Exception as e:
+            # Counting never breaks the caller's stream.
+            logger.error(f"Failed to count stream tokens with {type(self._tokenizer).__name__}: {e}")
+            self._tokenizer = ApproximateTokenizer()
+            self._count_choice(choice)
+
+    def _count_choice(self, choice: dict):
+        delta = choice.get("delta")
+        if (delta is None):
+            self.completion_tokens += self._tokenizer.count(choice.get("text") or "")
+            return
+        self.completion_tokens += self._tokenizer.count(delta.get("content") or "")
+        function_call = delta.get("function_call")
+        if (function_call is not None):
+            self.completion_tokens += self._tokenizer.count(function_call.get("name") or "")
+            self.completion_tokens += self._tokenizer.count(function_call.get("arguments") or "")
+
+    def build(self) -> dict:
+        usage = {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            # OpenAI does not report usage for streams, this is counted locally.
+            "estimated": True,
+        }
+        cost = self._estimator.cost(self.model, self.prompt_tokens, self.completion_tokens)
+        if (cost is not None):
+            usage["estimated_cost_usd"] = cost
+        return usage
+
+
+class UsageEstimator:
+    def __init__(self,
+                 tokenizer_factory: Optional[Callable[[str], Tokenizer]] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.tokenizer_factory = tokenizer_factory or default_tokenizer
+        self.prices = DEFAULT_PRICES if prices is None else prices
+        self._tokenizers: Dict[str, Tokenizer] = {}
+        self._lock = threading.Lock()
+
+    def tokenizer(self, model: str) -> Tokenizer:
+        # Loading an encoding is slow, there is one per model.
+        tokenizer = self._tokenizers.get(model)
+        if (tokenizer is None):
+            with self._lock:
+                tokenizer = self._tokenizers.get(model)
+                if (tokenizer is None):
+                    try:
+                        tokenizer = self.tokenizer_factory(model)
+                    except Exception as e:
+                        # e.g. tiktoken failing to download its encoding.
+                        # The fallback is cached so the failure is not retried.
+                        logger.error(f"Failed to load a tokenizer for {model}, approximating: {e}")
+                        tokenizer = ApproximateTokenizer()
+                    self._tokenizers[model] = tokenizer
+        return tokenizer
+
+    def prompt_tokens(self, model: str, body: dict) -> int:
+        tokenizer = self.tokenizer(model)
+        messages = body.get("messages")
+        if (messages is not None):
+            # As counted by OpenAI for the current chat models: three tokens
+            # per message, one per name and three to prime the reply.
+            tokens = 3
+            for message in messages:
+                tokens += 3
+                for key, value in message.items():
+                    if (isinstance(value, str)):
+                        tokens += tokenizer.count(value)
+                    elif (value is not None):
+                        tokens += tokenizer.count(json.dumps(value))
+                    if (key == "name"):
+                        tokens += 1
+            if (body.get("functions")):
+                tokens += tokenizer.count(json.dumps(body["functions"]))
+            return tokens
+
+        prompt = body.get("prompt")
+        if (isinstance(prompt, str)):
+            return tokenizer.count(prompt)
+        if (isinstance(prompt, list)):
+            if (prompt and all(isinstance(p, int) for p in prompt)):
+                return len(prompt)
+            return sum(len(p) if isinstance(p, list) else tokenizer.count(p) for p in prompt)
+        return 0
+
+    def stream(self, body: dict) -> Optional[StreamUsage]:
+        model = body.get("model") or body.get("engine") or body.get("deployment_id")
+        if (not model):
+            return None
+        return StreamUsage(self, model, self.prompt_tokens(model, body))
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+        prefix = max((p for p in self.prices if model.startswith(p)), key=len, default=None)
+        if (prefix is None):
+            return None
+        prompt_price, completion_price = self.prices[prefix]
+        return round((prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000, 8)
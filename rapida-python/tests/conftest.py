@@ -0,0 +1,70 @@
+import json
+
+import openai
+import pytest
+from local_server import LocalServer
+
+import rapida
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.globals import rapida_global
+
+
+class RecordingLogger:
+    # Stands in for RapidaAsyncLogger and keeps every logged request.
+    def __init__(self):
+        self.logs = []
+
+    def log(self, request, provider):
+        self.logs.append(request)
+
+    def backlog(self):
+        return 0.0
+
+
+@pytest.fixture
+def use_logger(monkeypatch):
+    # Wrapped calls log to the given logger until the test ends.
+    def use(logger):
+        monkeypatch.setattr(RapidaAsyncLogger, "from_rapida_global", staticmethod(lambda: logger))
+        return logger
+    return use
+
+
+@pytest.fixture
+def logs(use_logger):
+    return use_logger(RecordingLogger()).logs
+
+
+@pytest.fixture
+def configure(monkeypatch):
+    # Sets rapida_global settings until the test ends.
+    def configure(**settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(rapida_global, name, value)
+    return configure
+
+
+def echo_route(request) -> bytes:
+    if not request.path.startswith("/v1/"):
+        return b"{}"
+    body = request.json()
+    return json.dumps({
+        "id": body["messages"][0]["content"],
+        "object": "chat.completion",
+        "choices": [],
+        "routed_from": request.headers.get("Rapida-OpenAI-Api-Base"),
+    }).encode()
+
+
+@pytest.fixture
+def proxy(monkeypatch, configure):
+    # A local proxy that echoes chat completions, with rapida instrumented in proxy mode.
+    with LocalServer(response_body=echo_route, response_headers={"Rapida-Id": "rid"}) as server:
+        configure(proxy_url=server.url + "/v1", base_url=server.url)
+        monkeypatch.setattr(openai, "api_base", openai.api_base)
+        monkeypatch.setattr(openai, "api_key", "sk-test")
+        rapida.instrument("proxy")
+        try:
+            yield server
+        finally:
+            rapida.uninstrument()
@@ -0,0 +1,103 @@
+import gzip
+import json
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Union
+
+
+@dataclass
+class RecordedRequest:
+    method: str
+    path: str
+    headers: dict
+    body: bytes
+    client_port: int
+
+    @property
+    def decoded_body(self) -> bytes:
+        encoding = self.headers.get("Content-Encoding")
+        if encoding == "gzip":
+            return gzip.decompress(self.body)
+        if encoding == "zstd":
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(self.body)
+        assert encoding is None, encoding
+        return self.body
+
+    def json(self):
+        return json.loads(self.decoded_body)
+
+
+class LocalServer:
+    def __init__(self, status: int = 200, delay: float = 0.0,
+                 on_request: Optional[Callable[[RecordedRequest], None]] = None,
+                 response_body: Union[bytes, Callable[[RecordedRequest], bytes]] = b"{}",
+                 response_headers: Optional[dict] = None):
+        self.status = status
+        self.delay = delay
+        self.on_request = on_request
+        self.response_body = response_body
+        self.response_headers = response_headers or {}
+        self.requests: List[RecordedRequest] = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length", 0))
+                recorded = RecordedRequest(
+                    method=self.command,
+                    path=self.path,
+                    headers=dict(self.headers),
+                    body=self.rfile.read(length),
+                    client_port=self.client_address[1],
+                )
+                with server._lock:
+                    server.requests.append(recorded)
+                if server.on_request is not None:
+                    server.on_request(recorded)
+                if server.delay:
+                    threading.Event().wait(server.delay)
+
+                body = server.response_body
+                if callable(body):
+                    body = body(recorded)
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                for key, value in server.response_headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = _handle
+            do_PATCH = _handle
+            do_GET = _handle
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 128
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "LocalServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+from local_server import LocalServer
+from openai.openai_object import OpenAIObject
+
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.openai_async.openai_injector import OpenAIInjector
+
+
+async def fake_acreate(**kwargs):
+    await asyncio.sleep(0.01)
+    return OpenAIObject.construct_from({"id": "cmpl-1", "choices": []})
+
+
+async def fake_acreate_stream(**kwargs):
+    async def stream():
+        for token in ["Hel", "lo"]:
+            yield OpenAIObject.construct_from({"choices": [{"delta": {"content": token}}]})
+    return stream()
+
+
+def test_alog_does_not_block_the_event_loop(use_logger):
+    with LocalServer(delay=0.5) as server:
+        logger = use_logger(RapidaAsyncLogger(base_url=server.url, api_key="test"))
+        wrapped = OpenAIInjector()._with_rapida_auth_async(fake_acreate)
+
+        async def main():
+            start = time.monotonic()
+            results = await asyncio.gather(*[wrapped(model="m") for _ in range(20)])
+            elapsed = time.monotonic() - start
+            await logger.aclose()
+            return results, elapsed
+
+        results, elapsed = asyncio.run(main())
+
+        assert all(r["id"] == "cmpl-1" for r in results)
+        assert elapsed < 0.5
+        assert len(server.requests) == 20
+        assert all(r.path == "/oai/v1/log" for r in server.requests)
+
+
+def test_async_stream_is_logged_once_consumed(use_logger):
+    with LocalServer() as server:
+        logger = use_logger(RapidaAsyncLogger(base_url=server.url, api_key="test"))
+        wrapped = OpenAIInjector()._with_rapida_auth_async(fake_acreate_stream)
+
+        async def main():
+            chunks = [c async for c in await wrapped(model="m", stream=True)]
+            await logger.aclose()
+            return chunks
+
+        chunks = asyncio.run(main())
+
+        assert len(chunks) == 2
+        assert len(server.requests) == 1
+        logged = server.requests[0].json()
+        assert logged["providerResponse"]["status"] == 200
+        assert logged["providerResponse"]["json"]["choices"][0]["message"]["content"] == "Hello"
+
+
+def test_async_requests_reports_errors_without_raising_into_the_caller(configure):
+    with LocalServer(status=500) as server:
+        configure(fail_on_error=True)
+        logger = RapidaAsyncLogger(base_url=server.url, api_key="test")
+
+        async def main():
+            await logger._upload("/oai/v1/log", {"n": 1})
+            await logger.aclose()
+
+        asyncio.run(main())
+
+        assert len(server.requests) == 1
@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+from local_server import LocalServer
+
+from rapida.async_logger import encoder
+from rapida.requester import PoolConfig, Requests
+from rapida.requester.async_requests import AsyncRequests, async_session_pool
+from rapida.requester.compression import (CompressionConfig, compress,
+                                          compression_stats)
+
+HTTP1 = PoolConfig(http2=False)
+
+LARGE = {"messages": [{"role": "user", "content": "hello " * 2000}]}
+
+
+def make_requests(url: str, **config) -> Requests:
+    return Requests(base_url=url, api_key="test", pool_config=HTTP1,
+                    compression=CompressionConfig(**config))
+
+
+def test_large_payloads_are_gzipped():
+    compression_stats.reset()
+    with LocalServer() as server:
+        make_requests(server.url).post("/oai/v1/log", json=LARGE)
+
+        request = server.requests[0]
+        assert request.headers["Content-Encoding"] == "gzip"
+        assert request.headers["Content-Type"] == "application/json"
+        assert len(request.body) < len(request.decoded_body) / 10
+        assert request.json() == LARGE
+
+    stats = compression_stats.snapshot()["algorithms"]["gzip"]
+    assert stats["payloads"] == 1
+    assert stats["bytes_out"] == len(request.body)
+    assert stats["ratio"] > 10
+    assert stats["cpu_seconds"] >= 0
+
+
+def test_pre_encoded_bodies_are_compressed_unchanged():
+    body = encoder.dumps(LARGE)
+    with LocalServer() as server:
+        make_requests(server.url).post("/oai/v1/log", data=body)
+        assert server.requests[0].decoded_body == body
+
+
+def test_small_payloads_are_sent_uncompressed():
+    compression_stats.reset()
+    with LocalServer() as server:
+        make_requests(server.url, threshold=1024).post("/job", json={"n": 1})
+
+        request = server.requests[0]
+        assert "Content-Encoding" not in request.headers
+        assert request.json() == {"n": 1}
+    assert compression_stats.snapshot()["skipped"] == 1
+
+
+def test_compression_is_off_by_default():
+    with LocalServer() as server:
+        Requests(base_url=server.url, api_key="test",
+                 pool_config=HTTP1).post("/oai/v1/log", json=LARGE)
+        assert "Content-Encoding" not in server.requests[0].headers
+
+
+def test_zstd_falls_back_to_gzip_when_unavailable():
+    body, encoding = compress(CompressionConfig(
+        algorithm="zstd", threshold=0), b"x" * 100)
+    try:
+        import zstandard
+    except ImportError:
+        assert encoding == "gzip"
+        assert gzip.decompress(body) == b"x" * 100
+    else:
+        assert encoding == "zstd"
+        assert zstandard.ZstdDecompressor().decompress(body) == b"x" * 100
+
+
+def test_async_requests_compress():
+    with LocalServer() as server:
+        requester = AsyncRequests(base_url=server.url, api_key="test",
+                                  compression=CompressionConfig())
+
+        async def main():
+            await requester.post("/oai/v1/log", json=LARGE)
+            await async_session_pool.close()
+
+        asyncio.run(main())
+        assert server.requests[0].headers["Content-Encoding"] == "gzip"
+        assert server.requests[0].json() == LARGE
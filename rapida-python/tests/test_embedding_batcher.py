@@ -0,0 +1,183 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from local_server import LocalServer
+from openai.openai_object import OpenAIObject
+
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.embeddings import LOG_BATCHED, EmbeddingBatcher
+from rapida.openai_async.openai_injector import OpenAIInjector
+
+
+def fake_response(inputs):
+    return OpenAIObject.construct_from({
+        "object": "list",
+        "model": "text-embedding-ada-002",
+        "data": [{"object": "embedding", "index": i, "embedding": [float(len(text))]}
+                 for i, text in enumerate(inputs)],
+        "usage": {"prompt_tokens": 10 * len(inputs), "total_tokens": 10 * len(inputs)},
+    })
+
+
+# Named after the resource so the injector batches it.
+class Embedding:
+    requests = []
+
+    @classmethod
+    def create(cls, **kwargs):
+        cls.requests.append(kwargs)
+        return fake_response(kwargs["input"])
+
+    @classmethod
+    async def acreate(cls, **kwargs):
+        cls.requests.append(kwargs)
+        await asyncio.sleep(0.01)
+        return fake_response(kwargs["input"])
+
+
+def test_concurrent_inputs_are_sent_together():
+    batcher = EmbeddingBatcher(max_wait=0.2)
+    sent = []
+
+    def upstream(**kwargs):
+        sent.append(kwargs)
+        return fake_response(kwargs["input"])
+
+    texts = ["a" * i for i in range(1, 9)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(
+            lambda text: batcher.submit(upstream, {"model": "m", "input": text}), texts))
+
+    assert len(sent) == 1
+    assert sorted(sent[0]["input"]) == texts
+    assert batcher.batches_sent == 1 and batcher.inputs_sent == 8
+    for text, (result, batch) in zip(texts, results):
+        assert result["data"][0]["index"] == 0
+        assert result["data"][0]["embedding"] == [float(len(text))]
+        assert len(batch) == 8
+    # Usage is shared out by estimated tokens, up to rounding.
+    assert abs(sum(r["usage"]["prompt_tokens"] for r, _ in results) - 80) <= 8
+
+
+def test_batches_are_split_by_input_count_and_options():
+    batcher = EmbeddingBatcher(max_wait=0.2, max_inputs=3)
+    sent = []
+
+    def upstream(**kwargs):
+        sent.append(kwargs)
+        return fake_response(kwargs["input"])
+
+    calls = [{"model": "m", "input": str(i)} for i in range(6)] + [{"model": "other", "input": "x"}]
+    with ThreadPoolExecutor(max_workers=7) as pool:
+        list(pool.map(lambda kwargs: batcher.submit(upstream, kwargs), calls))
+
+    assert sorted(len(kwargs["input"]) for kwargs in sent) == [1, 3, 3]
+    assert all(len({kwargs["model"]}) == 1 for kwargs in sent)
+
+
+def test_only_single_inputs_are_eligible():
+    assert EmbeddingBatcher.eligible({"input": "text"})
+    assert EmbeddingBatcher.eligible({"input": ["text"]})
+    assert EmbeddingBatcher.eligible({"input": [1, 2, 3]})
+    assert not EmbeddingBatcher.eligible({"input": ["a", "b"]})
+    assert not EmbeddingBatcher.eligible({"input": [[1], [2]]})
+
+
+def test_async_inputs_are_sent_together():
+    batcher = EmbeddingBatcher(max_wait=0.05)
+    sent = []
+
+    async def upstream(**kwargs):
+        sent.append(kwargs)
+        return fake_response(kwargs["input"])
+
+    async def main():
+        return await asyncio.gather(*[
+            batcher.asubmit(upstream, {"model": "m", "input": "b" * i}) for i in range(1, 5)])
+
+    results = asyncio.run(main())
+    assert len(sent) == 1
+    assert [r["data"][0]["embedding"] for r, _ in results] == [[1.0], [2.0], [3.0], [4.0]]
+
+
+def test_async_followers_outlive_a_cancelled_leader():
+    batcher = EmbeddingBatcher(max_wait=0.1)
+    sent = []
+
+    async def upstream(**kwargs):
+        sent.append(kwargs)
+        return fake_response(kwargs["input"])
+
+    async def main():
+        leader = asyncio.create_task(batcher.asubmit(upstream, {"model": "m", "input": "a"}))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(batcher.asubmit(upstream, {"model": "m", "input": text}))
+                     for text in ("bb", "ccc")]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        assert leader.cancelled()
+        return results
+
+    results = asyncio.run(main())
+    assert [request["input"] for request in sent] == [["bb", "ccc"]]
+    assert [r["data"][0]["embedding"] for r, _ in results] == [[2.0], [3.0]]
+
+
+def test_upstream_errors_reach_every_caller():
+    batcher = EmbeddingBatcher(max_wait=0.1)
+
+    def upstream(**kwargs):
+        raise ValueError("boom")
+
+    def submit(text):
+        try:
+            batcher.submit(upstream, {"input": text})
+        except ValueError:
+            return True
+        return False
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        assert all(pool.map(submit, ["a", "b", "c"]))
+
+
+@pytest.fixture
+def run_injected(use_logger, configure):
+    def run(batcher, texts):
+        with LocalServer() as server:
+            use_logger(RapidaAsyncLogger(base_url=server.url, api_key="test"))
+            configure(embedding_batcher=batcher)
+            Embedding.requests = []
+            create = OpenAIInjector()._with_rapida_auth(Embedding.create)
+            with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+                results = list(pool.map(
+                    lambda text: create(model="text-embedding-ada-002", input=text), texts))
+            return results, [r.json() for r in server.requests]
+    return run
+
+
+def test_async_mode_logs_every_call(run_injected):
+    results, logs = run_injected(EmbeddingBatcher(max_wait=0.2), ["one", "two", "three"])
+
+    assert len(Embedding.requests) == 1
+    assert [r["data"][0]["embedding"] for r in results] == [[3.0], [3.0], [5.0]]
+    assert len(logs) == 3
+    assert len({log["providerRequest"]["meta"]["Rapida-Request-Id"] for log in logs}) == 3
+    batch_ids = {log["providerResponse"]["headers"]["Rapida-Batch-Id"] for log in logs}
+    assert len(batch_ids) == 1
+    assert all(log["providerResponse"]["headers"]["Rapida-Batch-Size"] == "3" for log in logs)
+    assert all(log["providerRequest"]["json"]["input"] in ("one", "two", "three") for log in logs)
+
+
+def test_async_mode_batched_log_links_every_call(run_injected):
+    results, logs = run_injected(
+        EmbeddingBatcher(max_wait=0.2, log_mode=LOG_BATCHED), ["one", "two", "three"])
+
+    assert len(results) == 3
+    assert len(logs) == 1
+    request = logs[0]["providerRequest"]
+    assert sorted(request["json"]["input"]) == ["one", "three", "two"]
+    assert len(request["meta"]["Rapida-Batch-Request-Ids"].split(",")) == 3
+    assert logs[0]["providerResponse"]["headers"]["Rapida-Batch-Id"] == request["meta"]["Rapida-Batch-Id"]
@@ -0,0 +1,103 @@
+import array
+import base64
+import json
+import math
+import struct
+
+import pytest
+
+from rapida.async_logger import encoder
+from rapida.embeddings import (EMBEDDINGS_FLOAT16, EMBEDDINGS_FLOAT32,
+                               EMBEDDINGS_FULL, EMBEDDINGS_OMIT,
+                               EMBEDDINGS_SUMMARY, EmbeddingLogPolicy,
+                               encode_response)
+from rapida.embeddings import encoding
+from rapida.openai_async.openai_injector import OpenAIInjector
+
+VECTORS = [[0.25, -0.5, 1.0 / 3], [3.0, 4.0, 0.0]]
+
+
+def response(vectors=VECTORS):
+    return {
+        "object": "list",
+        "model": "text-embedding-ada-002",
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "usage": {"prompt_tokens": 2, "total_tokens": 2},
+    }
+
+
+def unpack(item, fmt):
+    raw = base64.b64decode(item["embedding"])
+    return list(struct.unpack(f"<{len(raw) // struct.calcsize(fmt)}{fmt}", raw))
+
+
+@pytest.fixture(params=["python", "numpy"])
+def backend(request, monkeypatch):
+    if (request.param == "numpy"):
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(encoding, "numpy", None)
+
+
+def test_float32_round_trips(backend):
+    original = response()
+    logged = encode_response(original, EMBEDDINGS_FLOAT32)
+    for item, vector in zip(logged["data"], VECTORS):
+        assert item["dtype"] == "float32" and item["dims"] == 3
+        assert unpack(item, "f") == pytest.approx(vector, rel=1e-6)
+    assert logged["usage"] == original["usage"]
+    # The caller's response is left alone.
+    assert original["data"][0]["embedding"] == VECTORS[0]
+
+
+def test_float16_halves_the_size(backend):
+    logged = encode_response(response(), EMBEDDINGS_FLOAT16)
+    item = logged["data"][0]
+    assert len(base64.b64decode(item["embedding"])) == 6
+    assert unpack(item, "e") == pytest.approx(VECTORS[0], rel=1e-3)
+
+
+def test_summary_keeps_dims_norm_and_hash(backend):
+    logged = encode_response(response(), EMBEDDINGS_SUMMARY)
+    item = logged["data"][1]
+    assert "embedding" not in item
+    assert item["dims"] == 3 and item["norm"] == 5.0
+    assert item["sha256"] == encode_response(response(), EMBEDDINGS_SUMMARY)["data"][1]["sha256"]
+    assert logged["data"][0]["norm"] == pytest.approx(math.hypot(*VECTORS[0]), rel=1e-6)
+
+
+def test_omit_and_full():
+    assert "embedding" not in encode_response(response(), EMBEDDINGS_OMIT)["data"][0]
+    original = response()
+    assert encode_response(original, EMBEDDINGS_FULL) is original
+
+
+def test_base64_responses_are_decoded(backend):
+    packed = array.array("f", VECTORS[1]).tobytes()
+    logged = encode_response(response([base64.b64encode(packed).decode()]), EMBEDDINGS_SUMMARY)
+    assert logged["data"][0]["norm"] == 5.0
+
+
+def test_policy_is_per_model():
+    policy = EmbeddingLogPolicy(EMBEDDINGS_SUMMARY, models={"text-embedding-ada-002": EMBEDDINGS_OMIT})
+    assert policy.mode_for("text-embedding-ada-002") == EMBEDDINGS_OMIT
+    assert policy.mode_for("other") == EMBEDDINGS_SUMMARY
+    with pytest.raises(ValueError):
+        EmbeddingLogPolicy("float8")
+
+
+class Embedding:
+    @classmethod
+    def create(cls, **kwargs):
+        return response([[0.1] * 1536])
+
+
+def test_async_mode_logs_packed_vectors(logs, configure):
+    configure(embedding_log_policy=EmbeddingLogPolicy())
+    create = OpenAIInjector()._with_rapida_auth(Embedding.create)
+    result = create(model="text-embedding-ada-002", input="x")
+
+    assert len(result["data"][0]["embedding"]) == 1536
+    body = encoder.dumps(logs[0])
+    assert len(body) < 10_000
+    assert json.loads(body)["providerResponse"]["json"]["data"][0]["dims"] == 1536
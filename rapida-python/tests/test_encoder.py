@@ -0,0 +1,65 @@
+import dataclasses
+import datetime
+import json
+
+from openai.openai_object import OpenAIObject
+
+from rapida.async_logger import encoder
+from rapida.async_logger.async_logger import (Provider, ProviderRequest,
+                                                ProviderResponse,
+                                                RapidaAyncLogRequest, Timing)
+
+
+RESPONSE = {
+    "id": "chatcmpl-1",
+    "choices": [{"message": {"role": "assistant", "content": "héllo"}}],
+}
+
+
+def make_request(response: dict = RESPONSE) -> RapidaAyncLogRequest:
+    start = datetime.datetime(2023, 7, 1, 12, 0, 0, 250000)
+    return RapidaAyncLogRequest(
+        providerRequest=ProviderRequest(
+            url="https://api.openai.com/v1",
+            json={"model": "gpt-3.5-turbo", "stream": False},
+            meta={"user_id": 7}),
+        providerResponse=ProviderResponse(
+            json=response, status=200, headers={}),
+        timing=Timing.from_datetimes(
+            start, start + datetime.timedelta(seconds=1)),
+    )
+
+
+def test_matches_dataclasses_asdict():
+    request = make_request()
+    assert json.loads(encoder.dumps(request)) == json.loads(
+        json.dumps(dataclasses.asdict(request)))
+
+
+def test_encodes_openai_objects_without_a_round_trip():
+    request = make_request(OpenAIObject.construct_from(RESPONSE))
+    body = json.loads(encoder.dumps(request))
+    assert body["providerResponse"]["json"] == RESPONSE
+
+
+def test_records_are_slotted():
+    request = make_request()
+    assert not hasattr(request, "__dict__")
+    assert not hasattr(request.providerRequest, "__dict__")
+    assert not hasattr(request.timing.startTime, "__dict__")
+
+
+def test_encodes_values_the_stdlib_rejects():
+    body = json.loads(encoder.dumps({
+        "provider": Provider.OPENAI,
+        "at": datetime.datetime(2023, 7, 1),
+        "tags": ("a", "b"),
+    }))
+    assert body == {"provider": "openai",
+                    "at": "2023-07-01T00:00:00", "tags": ["a", "b"]}
+
+
+def test_join_array_splices_encoded_records():
+    records = [encoder.dumps({"n": i}) for i in range(3)]
+    assert json.loads(b'{"logs":' + encoder.join_array(records) + b"}") == {
+        "logs": [{"n": 0}, {"n": 1}, {"n": 2}]}
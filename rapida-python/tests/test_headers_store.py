@@ -0,0 +1,74 @@
+import threading
+import time
+
+from rapida.openai_proxy.headers_store import HeadersStore
+from rapida.openai_proxy.openai_injector import OpenAIInjector
+
+HEADERS = {"Rapida-Id": "abc", "Rapida-Status": "success", "Rapida-Cache": "MISS"}
+
+
+def test_entries_expire_after_ttl():
+    store = HeadersStore(ttl=0.05)
+    store.put("a", HEADERS)
+    assert store.get("a") == HEADERS
+    time.sleep(0.1)
+    assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    store = HeadersStore(max_entries=2)
+    store.put("a", HEADERS)
+    store.put("b", HEADERS)
+    store.get("a")
+    store.put("c", HEADERS)
+    assert "a" in store and "c" in store and "b" not in store
+    assert store.evicted == 1
+
+
+def test_size_stays_flat_under_concurrent_load():
+    store = HeadersStore(max_entries=100)
+
+    def worker(n):
+        for i in range(5000):
+            store.put(f"{n}-{i}", HEADERS)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(store) == 100
+
+
+def test_non_streamed_result_consumes_its_headers():
+    injector = OpenAIInjector()
+    injector.headers_store.put("req-1", HEADERS)
+
+    result = injector._modify_result({}, "req-1")
+    assert result["rapida"].id == "abc"
+    assert result["rapida"].cache == "MISS"
+    assert len(injector.headers_store) == 0
+
+
+def test_streamed_result_keeps_headers_until_the_stream_finishes():
+    injector = OpenAIInjector()
+    injector.headers_store.put("req-1", HEADERS)
+
+    stream = injector._modify_result((chunk for chunk in [{}, {}]), "req-1")
+    first = next(stream)
+    assert first["rapida"].id == "abc"
+    assert len(injector.headers_store) == 1
+    rest = list(stream)
+    assert rest[0]["rapida"].id == "abc"
+    assert len(injector.headers_store) == 0
+
+
+def test_abandoned_stream_releases_its_headers():
+    injector = OpenAIInjector()
+    injector.headers_store.put("req-1", HEADERS)
+
+    stream = injector._modify_result((chunk for chunk in [{}, {}]), "req-1")
+    next(stream)
+    stream.close()
+    assert len(injector.headers_store) == 0
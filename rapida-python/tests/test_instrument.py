@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import rapida
+
+
+def run_isolated(code: str, home: str) -> str:
+    return subprocess.run([sys.executable, "-c", code], check=True, text=True,
+                          capture_output=True, cwd=os.getcwd(),
+                          env=dict(os.environ, HOME=home)).stdout.strip()
+
+
+def test_importing_submodules_has_no_side_effects(tmp_path):
+    out = run_isolated(
+        "import sys, rapida, rapida.openai_async, rapida.openai_proxy, rapida.lock\n"
+        "print('openai' in sys.modules)", str(tmp_path))
+    assert out == "False"
+    assert os.listdir(tmp_path) == []
+
+
+def test_accessing_openai_instruments_lazily(tmp_path):
+    out = run_isolated(
+        "import rapida\n"
+        "from rapida.openai_async import openai\n"
+        "print(rapida.instrumented_mode())", str(tmp_path))
+    assert out == "async"
+
+
+def test_init_switches_modes_and_uninstrument_restores_openai():
+    import openai
+    from openai.api_requestor import APIRequestor
+    from openai.api_resources import ChatCompletion, Embedding
+
+    original_create = ChatCompletion.__dict__["create"]
+    original_request_raw = APIRequestor.__dict__["request_raw"]
+    try:
+        assert rapida.init(mode="async") is openai
+        assert rapida.instrumented_mode() == "async"
+        assert ChatCompletion.__dict__["create"] is not original_create
+
+        rapida.init(mode="proxy")
+        assert rapida.instrumented_mode() == "proxy"
+        assert APIRequestor.__dict__["request_raw"] is not original_request_raw
+    finally:
+        rapida.uninstrument()
+
+    assert rapida.instrumented_mode() is None
+    assert ChatCompletion.__dict__["create"] is original_create
+    assert isinstance(Embedding.__dict__["acreate"], classmethod)
+    assert APIRequestor.__dict__["request_raw"] is original_request_raw
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        rapida.instrument("sync")
@@ -0,0 +1,145 @@
+import threading
+import time
+
+from local_server import LocalServer
+
+from rapida.async_logger.shipper import LogShipper, OverflowPolicy, ShipperConfig
+from rapida.requester import Requests
+
+
+def make_shipper(url: str, **config) -> LogShipper:
+    return LogShipper(Requests(base_url=url, api_key="test", fail_on_error=False),
+                      ShipperConfig(**config))
+
+
+def test_submit_returns_without_waiting_for_the_server():
+    with LocalServer(delay=0.5) as server:
+        shipper = make_shipper(server.url, flush_interval=0.05)
+        start = time.monotonic()
+        assert shipper.submit("/oai/v1/log", {"n": 1})
+        assert time.monotonic() - start < 0.1
+        assert shipper.close(timeout=5)
+        assert len(server.requests) == 1
+
+
+def test_batches_by_size_and_flush():
+    with LocalServer() as server:
+        shipper = make_shipper(server.url, flush_interval=60, max_batch_size=10)
+        for i in range(25):
+            shipper.submit("/oai/v1/log", {"n": i})
+        assert shipper.flush(timeout=5)
+
+        batches = [r.json()["logs"] for r in server.requests]
+        assert all(r.path == "/oai/v1/log/bulk" for r in server.requests)
+        assert [len(b) for b in batches] == [10, 10, 5]
+        assert [log["n"] for b in batches for log in b] == list(range(25))
+        shipper.close()
+
+
+def test_flushes_on_interval():
+    with LocalServer() as server:
+        shipper = make_shipper(server.url, flush_interval=0.05)
+        shipper.submit("/oai/v1/log", {"n": 1})
+        time.sleep(0.5)
+        assert len(server.requests) == 1
+        shipper.close()
+
+
+def test_groups_batches_by_path():
+    with LocalServer() as server:
+        shipper = make_shipper(server.url, flush_interval=60)
+        shipper.submit("/oai/v1/log", {"n": 1})
+        shipper.submit("/anthropic/v1/log", {"n": 2})
+        shipper.submit("/oai/v1/log", {"n": 3})
+        shipper.flush(timeout=5)
+
+        by_path = {r.path: r.json()["logs"] for r in server.requests}
+        assert by_path == {
+            "/oai/v1/log/bulk": [{"n": 1}, {"n": 3}],
+            "/anthropic/v1/log/bulk": [{"n": 2}],
+        }
+        shipper.close()
+
+
+def test_without_bulk_endpoint_records_are_sent_one_by_one():
+    with LocalServer() as server:
+        shipper = make_shipper(server.url, flush_interval=60, bulk_suffix=None)
+        shipper.submit("/oai/v1/log", {"n": 1})
+        shipper.submit("/oai/v1/log", {"n": 2})
+        shipper.flush(timeout=5)
+        assert [r.json() for r in server.requests] == [{"n": 1}, {"n": 2}]
+        shipper.close()
+
+
+def hold_worker(server: LocalServer):
+    # The first request blocks the worker so the queue can fill up.
+    release = threading.Event()
+    server.on_request = lambda _: release.wait(5)
+    return release
+
+
+def test_drop_newest_and_drop_oldest():
+    for policy, expected in [(OverflowPolicy.DROP_NEWEST, [1, 2]),
+                             (OverflowPolicy.DROP_OLDEST, [3, 4])]:
+        with LocalServer() as server:
+            release = hold_worker(server)
+            shipper = make_shipper(server.url, flush_interval=60, max_batch_size=1,
+                                   max_queue_size=2, overflow_policy=policy)
+            shipper.submit("/oai/v1/log", {"n": 0})
+            while shipper.queue_depth() > 0:
+                time.sleep(0.01)
+            for i in range(1, 5):
+                shipper.submit("/oai/v1/log", {"n": i})
+            release.set()
+            shipper.flush(timeout=5)
+
+            sent = [r.json()["logs"][0]["n"] for r in server.requests]
+            assert sent == [0] + expected
+            assert shipper.dropped == 2
+            shipper.close()
+
+
+def test_block_policy_times_out():
+    with LocalServer() as server:
+        release = hold_worker(server)
+        shipper = make_shipper(server.url, flush_interval=60, max_batch_size=1,
+                               max_queue_size=1, block_timeout=0.1)
+        shipper.submit("/oai/v1/log", {"n": 0})
+        while shipper.queue_depth() > 0:
+            time.sleep(0.01)
+        assert shipper.submit("/oai/v1/log", {"n": 1})
+        assert not shipper.submit("/oai/v1/log", {"n": 2})
+        release.set()
+        shipper.close()
+        assert shipper.dropped == 1
+
+
+def test_close_drains_queue():
+    with LocalServer() as server:
+        shipper = make_shipper(server.url, flush_interval=60)
+        for i in range(5):
+            shipper.submit("/oai/v1/log", {"n": i})
+        assert shipper.close(timeout=5)
+        assert not shipper.submit("/oai/v1/log", {"n": 5})
+        assert sum(len(r.json()["logs"]) for r in server.requests) == 5
+
+
+def test_failures_do_not_stop_the_worker():
+    with LocalServer() as server:
+        shipper = make_shipper(server.url, flush_interval=60)
+
+        class BrokenSpool:
+            def append(self, path, record):
+                raise OSError("disk full")
+
+        # A failing spool must neither kill the worker nor hang flush().
+        shipper.spool = BrokenSpool()
+        server.status = 503
+        shipper.submit("/oai/v1/log", {"n": 1})
+        assert shipper.flush(timeout=5)
+
+        server.status = 200
+        shipper.submit("/oai/v1/log", {"n": 2})
+        assert shipper.flush(timeout=5)
+        assert [r.json()["logs"] for r in server.requests] == [[{"n": 1}], [{"n": 2}]]
+        assert shipper.close(timeout=5)
@@ -0,0 +1,137 @@
+import json
+import threading
+import urllib.request
+
+import pytest
+from local_server import LocalServer
+
+from rapida.metrics import MetricsRegistry, PeriodicExporter, registry, serve
+from rapida.metrics.wrappers import WRAPPED_CALLS
+from rapida.openai_async.openai_injector import OpenAIInjector
+from rapida.requester import LOG_REQUEST_FAILURES, LOG_REQUESTS, PoolConfig, Requests
+from rapida.runs import RUN_EVENTS, RapidaGraphBuilder, RapidaNodeConfig
+
+
+def test_counters_add_up_across_threads():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("calls")
+
+    def work():
+        for _ in range(10000):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(5)
+    assert counter.value() == 80005
+
+    # Shards of finished threads are folded in once another thread starts.
+    thread = threading.Thread(target=counter.inc)
+    thread.start()
+    thread.join()
+    assert counter.value() == 80006
+    assert len(counter._shards._cells) <= 2
+
+
+def test_histograms_gauges_and_labels():
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    depth = metrics.gauge("depth")
+    depth.set(3)
+    size = metrics.gauge("size")
+    size.set_function(lambda: 7)
+    requests = metrics.counter("requests", labelnames=("method",))
+    requests.labels("POST").inc(2)
+    requests.labels("PATCH").inc()
+
+    assert metrics.snapshot() == {
+        "latency": {"count": 4, "sum": 2.65, "buckets": {"0.1": 2, "1.0": 3, "+Inf": 4}},
+        "depth": 3,
+        "size": 7,
+        "requests": {"method=POST": 2, "method=PATCH": 1},
+    }
+    # Registering again returns the same metric.
+    assert metrics.counter("requests", labelnames=("method",)) is requests
+
+    metrics.reset()
+    assert metrics.snapshot()["latency"]["count"] == 0
+
+
+def test_openmetrics_text():
+    metrics = MetricsRegistry()
+    metrics.counter("rapida_calls", "Calls made", ("resource",)).labels('Chat"Completion').inc()
+    metrics.histogram("rapida_seconds", buckets=(1.0,)).observe(0.5)
+
+    assert metrics.to_openmetrics() == "\n".join([
+        "# TYPE rapida_calls counter",
+        "# HELP rapida_calls Calls made",
+        'rapida_calls_total{resource="Chat\\"Completion"} 1',
+        "# TYPE rapida_seconds histogram",
+        'rapida_seconds_bucket{le="1.0"} 1',
+        'rapida_seconds_bucket{le="+Inf"} 1',
+        "rapida_seconds_count 1",
+        "rapida_seconds_sum 0.5",
+        "# EOF",
+    ]) + "\n"
+
+
+def test_endpoint_and_exporter():
+    metrics = MetricsRegistry()
+    metrics.counter("calls").inc()
+    server = serve(port=0, metrics=metrics)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as res:
+            assert res.headers["Content-Type"].startswith("application/openmetrics-text")
+            assert "calls_total 1" in res.read().decode()
+    finally:
+        server.shutdown()
+
+    exported = []
+    exporter = PeriodicExporter(exported.append, interval=3600, metrics=metrics)
+    exporter.close()
+    assert exported == [{"calls": 1}]
+
+
+def test_requests_and_runs_are_counted():
+    before = registry.snapshot()
+    with LocalServer() as server:
+        requester = Requests(base_url=server.url, pool_config=PoolConfig(http2=False))
+        requester.post("/log", data=b"{}")
+        with RapidaGraphBuilder(requester) as graph:
+            graph.job(name="job").create_node(RapidaNodeConfig(name="node"))
+
+    assert LOG_REQUESTS.labels("POST", "200").value() - before["rapida_log_requests"].get(
+        "method=POST,status=200", 0) == 3
+    assert LOG_REQUEST_FAILURES.labels("POST").value() == before["rapida_log_request_failures"].get(
+        "method=POST", 0)
+    assert RUN_EVENTS.labels("node", "created").value() - before["rapida_run_events"].get(
+        "kind=node,event=created", 0) == 1
+    payloads = registry.snapshot()["rapida_log_payload_bytes"]["method=POST"]
+    assert payloads["count"] >= 1
+
+
+def test_wrapped_calls_are_counted(logs):
+    ok = WRAPPED_CALLS.labels("async", "ChatCompletion", "ok")
+    error = WRAPPED_CALLS.labels("async", "ChatCompletion", "error")
+    before = (ok.value(), error.value())
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    create(model="m", messages=[])
+    with pytest.raises(ValueError):
+        create(model="m", messages=[], fail=True)
+
+    assert (ok.value() - before[0], error.value() - before[1]) == (1, 1)
+    assert "rapida_wrapper_log_seconds_bucket" in registry.to_openmetrics()
+    json.dumps(registry.snapshot())
+
+
+class ChatCompletion:
+    @classmethod
+    def create(cls, fail=False, **kwargs):
+        if (fail):
+            raise ValueError("upstream failed")
+        return {"id": "chatcmpl-1", "choices": []}
@@ -0,0 +1,79 @@
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+
+from rapida.lock import PropertyStore
+
+
+def write_many(dir_path: str, worker: int):
+    store = PropertyStore(dir_path)
+    for i in range(50):
+        store.set(f"w{worker}-{i}", i)
+
+
+def test_set_get_remove_and_clear(tmp_path):
+    store = PropertyStore(str(tmp_path))
+    store.set("job_id", "1")
+    store.set("attempt", 2)
+    store.set("job_id", "3")
+    assert store.get_all() == {"job_id": "3", "attempt": 2}
+
+    store.remove("attempt")
+    assert store.get("attempt") is None
+    store.clear()
+    assert store.get_all() == {}
+
+
+def test_json_mirror_is_opt_in(tmp_path):
+    store = PropertyStore(str(tmp_path))
+    store.set("session", "24")
+    assert not (tmp_path / "custom_properties.json").exists()
+
+
+def test_json_mirror_is_kept_in_sync(tmp_path):
+    store = PropertyStore(str(tmp_path), mirror_json=True)
+    store.set("session", "24")
+    with open(tmp_path / "custom_properties.json") as json_file:
+        assert json.load(json_file) == {"session": "24"}
+
+    store.remove("session")
+    with open(tmp_path / "custom_properties.json") as json_file:
+        assert json.load(json_file) == {}
+
+
+def test_existing_json_file_is_imported(tmp_path):
+    with open(tmp_path / "custom_properties.json", "w") as json_file:
+        json.dump({"app": "mobile"}, json_file)
+    assert PropertyStore(str(tmp_path)).get_all() == {"app": "mobile"}
+
+
+def test_cache_sees_writes_from_other_stores(tmp_path):
+    reader = PropertyStore(str(tmp_path))
+    writer = PropertyStore(str(tmp_path))
+    assert reader.get_all() == {}
+    writer.set("a", 1)
+    assert reader.get_all() == {"a": 1}
+
+
+def test_concurrent_threads_and_processes_do_not_lose_updates(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=write_many, args=(str(tmp_path), n))
+                 for n in range(4)]
+    threads = [threading.Thread(target=write_many, args=(str(tmp_path), n))
+               for n in range(4, 8)]
+    for worker in processes + threads:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+
+    assert len(PropertyStore(str(tmp_path)).get_all()) == 8 * 50
+
+
+def test_import_does_no_filesystem_work(tmp_path):
+    env = dict(os.environ, HOME=str(tmp_path))
+    subprocess.run([sys.executable, "-c", "import rapida.lock"],
+                   check=True, env=env, cwd=os.getcwd())
+    assert not (tmp_path / ".rapida").exists()
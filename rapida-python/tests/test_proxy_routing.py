@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+N = 64
+
+
+def create(i: int):
+    return openai.ChatCompletion.create(
+        model="gpt-3.5-turbo",
+        messages=[{"role": "user", "content": f"call-{i}"}],
+        api_base=f"https://upstream-{i}.example.com/v1",
+    )
+
+
+def assert_routed(responses, proxy):
+    for i, response in enumerate(responses):
+        assert response["id"] == f"call-{i}"
+        assert response["routed_from"] == f"https://upstream-{i}.example.com/v1"
+        assert response.rapida.id == "rid"
+
+    completions = [r for r in proxy.requests
+                   if r.path == "/v1/chat/completions"]
+    assert len(completions) == N
+
+
+def test_concurrent_threads_route_to_their_own_api_base(proxy):
+    original_api_base = openai.api_base
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        responses = list(pool.map(create, range(N)))
+
+    assert_routed(responses, proxy)
+    assert openai.api_base == original_api_base
+
+
+def test_concurrent_tasks_route_to_their_own_api_base(proxy):
+    async def acreate(i: int):
+        return await openai.ChatCompletion.acreate(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user", "content": f"call-{i}"}],
+            api_base=f"https://upstream-{i}.example.com/v1",
+        )
+
+    async def main():
+        try:
+            return await asyncio.gather(*[acreate(i) for i in range(N)])
+        finally:
+            from rapida.async_logger.async_logger import RapidaAsyncLogger
+            from rapida.requester.async_requests import async_session_pool
+            await RapidaAsyncLogger.aflush_all()
+            await async_session_pool.close()
+
+    original_api_base = openai.api_base
+    responses = asyncio.run(main())
+
+    assert_routed(responses, proxy)
+    assert openai.api_base == original_api_base
+
+
+def test_global_api_base_is_forwarded_when_not_passed_per_call(proxy):
+    openai.api_base = "https://global.example.com/v1"
+    response = openai.ChatCompletion.create(
+        model="gpt-3.5-turbo",
+        messages=[{"role": "user", "content": "call-0"}],
+    )
+    assert response["routed_from"] == "https://global.example.com/v1"
+    assert openai.api_base == "https://global.example.com/v1"
+    assert [r.path for r in proxy.requests
+            if r.path.startswith("/v1/")] == ["/v1/chat/completions"]
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rapida.openai_async.openai_injector import OpenAIInjector
+from rapida.ratelimit import (MemoryBucketStore, RateLimit, RateLimiter,
+                              SQLiteBucketStore, estimate_tokens)
+
+
+def test_bucket_takes_all_or_nothing():
+    store = MemoryBucketStore()
+    takes = [("requests", 2, 1.0, 1), ("tokens", 100, 10.0, 60)]
+    assert store.take(takes) == 0
+    # The request bucket still has room, the token bucket does not.
+    wait = store.take(takes)
+    assert 1.5 < wait <= 2.0
+    assert store.take([("requests", 2, 1.0, 1)]) == 0
+
+
+def test_sqlite_buckets_are_shared(tmp_path):
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take([("k", 1, 0.1, 1)]) == 0
+    assert second.take([("k", 1, 0.1, 1)]) > 5
+
+
+def test_estimate_tokens_counts_prompt_and_completion():
+    body = {"messages": [{"role": "user", "content": "x" * 40}], "max_tokens": 100, "n": 2}
+    assert estimate_tokens(body) == 4 + 11 + 200
+    assert estimate_tokens({"input": [[1, 2, 3], [4]]}) == 4
+
+
+def test_tokens_per_minute_delays_calls():
+    limiter = RateLimiter(limits={"m": RateLimit(tokens_per_minute=600)})
+    limiter.acquire({"model": "m", "input": [0] * 600}).release()
+    started = time.monotonic()
+    permit = limiter.acquire({"model": "m", "input": [0] * 5})
+    permit.release()
+    assert 0.4 < time.monotonic() - started < 1.0
+    assert 0.4 < permit.wait
+    # Other models are not limited.
+    assert limiter.acquire({"model": "other", "input": [0] * 600}).wait < 0.1
+    stats = limiter.stats.snapshot()
+    assert stats["acquired"] == 3 and stats["waited"] == 1
+
+
+def test_throttled_models_do_not_hold_up_others():
+    limiter = RateLimiter(default=RateLimit(tokens_per_minute=600))
+    limiter.acquire({"model": "slow", "input": [0] * 600}).release()
+    # Holds the turn of "slow" for about half a second.
+    waiter = threading.Thread(
+        target=lambda: limiter.acquire({"model": "slow", "input": [0] * 5}).release())
+    waiter.start()
+    time.sleep(0.05)
+    assert limiter.acquire({"model": "fast"}).wait < 0.1
+    waiter.join()
+
+
+def test_max_in_flight_bounds_concurrency():
+    limiter = RateLimiter(max_in_flight=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def upstream(**kwargs):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+        return kwargs["i"]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda i: limiter.call(upstream, {"i": i}), range(8)))
+
+    assert results == list(range(8))
+    assert max(peak) == 2
+    assert limiter.in_flight == 0
+
+
+def test_streams_hold_their_slot_until_consumed():
+    limiter = RateLimiter(max_in_flight=1)
+    stream = limiter.call(lambda **kwargs: (i for i in range(3)), {})
+    assert limiter.in_flight == 1
+    assert list(stream) == [0, 1, 2]
+    assert limiter.in_flight == 0
+
+
+def test_users_are_served_round_robin():
+    limiter = RateLimiter(max_in_flight=1)
+    first = limiter.acquire({}, user_id="a")
+    order = []
+
+    def acquire(user, name):
+        with limiter.acquire({}, user_id=user):
+            order.append(name)
+
+    threads = []
+    # "a1" takes the turn and waits for the slot, the rest queue up.
+    for user, name, queued in [("a", "a1", 0), ("a", "a2", 1), ("a", "a3", 2),
+                               ("a", "a4", 3), ("b", "b1", 4)]:
+        thread = threading.Thread(target=acquire, args=(user, name))
+        thread.start()
+        threads.append(thread)
+        while limiter.queued != queued:
+            time.sleep(0.001)
+        time.sleep(0.01)
+    first.release()
+    for thread in threads:
+        thread.join()
+
+    # Without fair queuing "b1" would go last.
+    assert order == ["a1", "a2", "b1", "a3", "a4"]
+
+
+def test_async_callers_share_the_limit():
+    limiter = RateLimiter(max_in_flight=2)
+    running = []
+    peak = []
+
+    async def upstream(**kwargs):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.pop()
+        return kwargs["i"]
+
+    async def main():
+        return await asyncio.gather(*[limiter.acall(upstream, {"i": i}) for i in range(6)])
+
+    assert asyncio.run(main()) == list(range(6))
+    assert max(peak) == 2
+
+
+def test_cancelled_waiters_leave_the_queue():
+    limiter = RateLimiter(max_in_flight=1)
+
+    async def main():
+        held = await limiter.aacquire({})
+        waiter = asyncio.ensure_future(limiter.aacquire({}))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        held.release()
+        permit = await asyncio.wait_for(limiter.aacquire({}), 1)
+        permit.release()
+
+    asyncio.run(main())
+    assert limiter.in_flight == 0
+
+
+class Embedding:
+    calls = 0
+
+    @classmethod
+    def create(cls, **kwargs):
+        cls.calls += 1
+        return {"data": []}
+
+
+def test_async_mode_calls_go_through_the_limiter(logs, configure):
+    limiter = RateLimiter(default=RateLimit(requests_per_minute=60))
+    configure(rate_limiter=limiter)
+    create = OpenAIInjector()._with_rapida_auth(Embedding.create)
+    create(model="m", input="a")
+    create(model="m", input="b")
+
+    assert Embedding.calls == 2 and len(logs) == 2
+    assert limiter.stats.snapshot()["acquired"] == 2
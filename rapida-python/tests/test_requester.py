@@ -0,0 +1,104 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from local_server import LocalServer
+
+from rapida.requester import PoolConfig, Requests, session_pool
+from rapida.requester.async_requests import AsyncRequests, async_session_pool
+
+HTTP1 = PoolConfig(http2=False)
+
+
+def test_connections_are_reused_across_requests_and_instances():
+    with LocalServer() as server:
+        Requests(base_url=server.url, pool_config=HTTP1).post("/job", json={})
+        Requests(base_url=server.url, pool_config=HTTP1).patch(
+            "/job/1/status", json={})
+        Requests(base_url=server.url, pool_config=HTTP1).post("/node", json={})
+
+        assert len({r.client_port for r in server.requests}) == 1
+        assert [r.method for r in server.requests] == ["POST", "PATCH", "POST"]
+
+
+def test_keep_alive_disabled_opens_new_connections():
+    with LocalServer() as server:
+        requester = Requests(base_url=server.url,
+                             pool_config=PoolConfig(http2=False, keep_alive=False))
+        requester.post("/job", json={})
+        requester.post("/job", json={})
+
+        assert len({r.client_port for r in server.requests}) == 2
+
+
+def test_pool_is_shared_between_threads():
+    config = PoolConfig(http2=False, pool_maxsize=4)
+    with LocalServer(delay=0.05) as server:
+        requester = Requests(base_url=server.url, pool_config=config)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda i: requester.post("/log", json={"n": i}),
+                          range(32)))
+
+        assert len(server.requests) == 32
+        assert len({r.client_port for r in server.requests}) <= 4
+
+
+def test_read_timeout():
+    config = PoolConfig(http2=False, read_timeout=0.1)
+    with LocalServer(delay=1) as server:
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            Requests(base_url=server.url, pool_config=config).post(
+                "/log", json={})
+
+
+def test_from_rapida_global_is_shared(configure):
+    configure(base_url="http://127.0.0.1:1")
+    try:
+        assert Requests.from_rapida_global() is Requests.from_rapida_global()
+        configure(base_url="http://127.0.0.1:2")
+        assert Requests.from_rapida_global().base_url == "http://127.0.0.1:2"
+    finally:
+        session_pool.close()
+
+
+def test_http2_session_behaves_like_requests():
+    pytest.importorskip("httpx")
+    pytest.importorskip("h2")
+    config = PoolConfig(http2=True, read_timeout=30)
+    with LocalServer(status=500) as server:
+        requester = Requests(base_url=server.url, fail_on_error=True, pool_config=config)
+        with pytest.raises(requests.HTTPError):
+            requester.post("/log", json={"n": 1})
+        assert server.requests[0].json() == {"n": 1}
+
+
+def test_http2_session_honours_the_timeout():
+    pytest.importorskip("httpx")
+    pytest.importorskip("h2")
+    config = PoolConfig(http2=True, read_timeout=0.1)
+    with LocalServer(delay=1) as server:
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            Requests(base_url=server.url, pool_config=config).post("/log", json={})
+
+
+def test_http2_is_opt_in():
+    assert PoolConfig().http2 is False
+
+
+def test_async_sessions_are_closed_with_their_loop():
+    with LocalServer() as server:
+        requester = AsyncRequests(base_url=server.url, api_key="test")
+
+        async def main():
+            await requester.post("/log", json={})
+            return async_session_pool.get(server.url, requester.pool_config)
+
+        session = asyncio.run(main())
+        assert session.closed
+        assert len(server.requests) == 1
+
+
+def test_async_requests_fall_back_to_rapida_global(configure):
+    configure(base_url="http://127.0.0.1:3")
+    assert AsyncRequests(api_key="test").base_url == "http://127.0.0.1:3"
@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import pytest
+from local_server import LocalServer
+from openai.openai_object import OpenAIObject
+
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.cache import MemoryCache, ResponseCache, SQLiteCache
+from rapida.openai_async.openai_injector import OpenAIInjector, RapidaMeta
+
+
+class FakeCompletion:
+    calls = 0
+
+    @classmethod
+    def create(cls, **kwargs):
+        cls.calls += 1
+        if kwargs.get("stream"):
+            return (OpenAIObject.construct_from({"choices": [{"index": 0, "delta": {"content": token}}]})
+                    for token in ["Hel", "lo"])
+        return OpenAIObject.construct_from({"id": f"cmpl-{cls.calls}", "choices": []})
+
+    @classmethod
+    async def acreate(cls, **kwargs):
+        cls.calls += 1
+
+        async def stream():
+            for token in ["Hel", "lo"]:
+                yield OpenAIObject.construct_from({"choices": [{"index": 0, "delta": {"content": token}}]})
+        return stream()
+
+
+@pytest.fixture
+def logged(use_logger):
+    with LocalServer() as server:
+        use_logger(RapidaAsyncLogger(base_url=server.url, api_key="test"))
+        FakeCompletion.calls = 0
+        yield server.requests
+
+
+def test_hits_skip_openai_and_are_logged_as_hits(logged, configure):
+    configure(response_cache=ResponseCache())
+    create = OpenAIInjector()._with_rapida_auth(FakeCompletion.create)
+
+    first = create(model="m", prompt="hi", request_id="a")
+    second = create(model="m", prompt="hi", request_id="b")
+    other = create(model="m", prompt="bye")
+
+    assert FakeCompletion.calls == 2
+    assert second["id"] == first["id"] == "cmpl-1"
+    assert other["id"] == "cmpl-2"
+    assert second["rapida_meta"] == {"cache": "HIT"}
+    assert [r.json()["providerResponse"]["headers"]["Rapida-Cache"] for r in logged] == [
+        "MISS", "HIT", "MISS"]
+    assert logged[1].json()["providerResponse"]["json"]["id"] == "cmpl-1"
+
+
+def test_streams_are_replayed_as_generators(logged, configure):
+    configure(response_cache=ResponseCache())
+    create = OpenAIInjector()._with_rapida_auth(FakeCompletion.create)
+
+    first = [c["choices"][0]["delta"]["content"] for c in create(model="m", stream=True)]
+    replay = create(model="m", stream=True)
+    assert not isinstance(replay, dict)
+    second = [c["choices"][0]["delta"]["content"] for c in replay]
+
+    assert first == second == ["Hel", "lo"]
+    assert FakeCompletion.calls == 1
+    assert logged[1].json()["providerResponse"]["json"]["choices"][0]["message"]["content"] == "Hello"
+
+
+def test_partially_consumed_streams_are_not_cached(logged, configure):
+    configure(response_cache=ResponseCache())
+    create = OpenAIInjector()._with_rapida_auth(FakeCompletion.create)
+
+    stream = create(model="m", stream=True)
+    next(stream)
+    stream.close()
+    list(create(model="m", stream=True))
+    assert FakeCompletion.calls == 2
+
+
+def test_async_streams_share_entries_with_sync_calls(logged, configure):
+    configure(response_cache=ResponseCache())
+    acreate = OpenAIInjector()._with_rapida_auth_async(FakeCompletion.acreate)
+    create = OpenAIInjector()._with_rapida_auth(FakeCompletion.create)
+
+    async def main():
+        first = [c async for c in await acreate(model="m", stream=True)]
+        second = [c async for c in await acreate(model="m", stream=True)]
+        await RapidaAsyncLogger.from_rapida_global().aclose()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert [c["choices"] for c in first] == [c["choices"] for c in second]
+    assert len(list(create(model="m", stream=True))) == 2
+    assert FakeCompletion.calls == 1
+
+
+def test_cache_can_be_bypassed_per_call(logged, configure):
+    configure(response_cache=ResponseCache())
+    create = OpenAIInjector()._with_rapida_auth(FakeCompletion.create)
+
+    create(model="m", rapida_meta=RapidaMeta(cache=False))
+    create(model="m", rapida_meta=RapidaMeta(cache=False))
+    assert FakeCompletion.calls == 2
+
+
+def test_buckets_fill_before_serving(logged, configure):
+    configure(response_cache=ResponseCache(bucket_max_size=2))
+    create = OpenAIInjector()._with_rapida_auth(FakeCompletion.create)
+
+    ids = {create(model="m")["id"] for _ in range(10)}
+    assert FakeCompletion.calls == 2
+    assert ids == {"cmpl-1", "cmpl-2"}
+
+
+def test_entries_expire():
+    cache = ResponseCache(MemoryCache(), ttl=0.05)
+    cache.record("k", OpenAIObject.construct_from({"id": "x"}))
+    assert cache.lookup("k")["response"] == {"id": "x"}
+    time.sleep(0.1)
+    assert cache.lookup("k") is None
+
+
+def test_memory_cache_evicts_least_recently_used_by_size():
+    backend = MemoryCache(max_bytes=250)
+    for key in ["a", "b", "c"]:
+        backend.add(key, b"x" * 100, None, 1)
+    assert backend.get_bucket("a") == []
+    backend.get_bucket("b")
+    backend.add("d", b"x" * 100, None, 1)
+    assert backend.get_bucket("c") == []
+    assert backend.get_bucket("b") and backend.get_bucket("d")
+    assert backend.size == 200
+
+
+def test_sqlite_cache_persists_and_caps_buckets(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteCache(path).add("k", b"1", None, 2)
+    SQLiteCache(path).add("k", b"2", None, 2)
+    SQLiteCache(path).add("k", b"3", None, 2)
+    SQLiteCache(path).add("old", b"4", -1, 1)
+
+    backend = SQLiteCache(path, max_bytes=1)
+    assert backend.get_bucket("k") == [b"2", b"3"]
+    assert backend.get_bucket("old") == []
+    backend.add("new", b"5", None, 1)
+    assert backend.get_bucket("k") == []
+    assert backend.get_bucket("new") == [b"5"]
+
+
+def test_keys_are_canonical():
+    assert ResponseCache.key("Completion", {"a": 1, "b": {"y": 1, "x": 2}, "request_id": "1"}) == \
+        ResponseCache.key("Completion", {"b": {"x": 2, "y": 1}, "a": 1, "api_key": None})
+    assert ResponseCache.key("Completion", {"a": 1}) != ResponseCache.key("Embedding", {"a": 1})
@@ -0,0 +1,200 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import openai
+import pytest
+
+from rapida.globals import rapida_global
+from rapida import retry
+from rapida.openai_async.openai_injector import OpenAIInjector, RapidaMeta
+from rapida.retry import HEDGE_WORKERS, RapidaRetryProps, RetryBudget, RetryEngine
+
+FAST = RapidaRetryProps(num=3, factor=2, min_timeout=1, max_timeout=5)
+
+
+def rate_limited(headers=None):
+    return openai.error.RateLimitError("slow down", http_status=429, headers=headers)
+
+
+def flaky(failures):
+    calls = []
+
+    def upstream(**kwargs):
+        calls.append(kwargs)
+        if (len(calls) <= len(failures)):
+            raise failures[len(calls) - 1]
+        return {"ok": len(calls)}
+    return upstream, calls
+
+
+def test_transient_errors_are_retried():
+    upstream, calls = flaky([rate_limited(), openai.error.APIError("bad gateway", http_status=502)])
+    attempts = []
+    engine = RetryEngine(FAST)
+
+    assert engine.call(upstream, {"x": 1}, attempts.append) == {"ok": 3}
+    assert [a.status for a in attempts] == [429, 502]
+    assert [a.number for a in attempts] == [1, 2]
+    assert engine.stats.snapshot()["retries"] == 2
+
+
+def test_permanent_errors_are_raised_at_once():
+    upstream, calls = flaky([openai.error.InvalidRequestError("bad", None, http_status=400)])
+    with pytest.raises(openai.error.InvalidRequestError):
+        RetryEngine(FAST).call(upstream, {})
+    assert len(calls) == 1
+
+    quota = openai.error.RateLimitError("quota", http_status=429, json_body={})
+    quota.code = "insufficient_quota"
+    upstream, calls = flaky([quota])
+    with pytest.raises(openai.error.RateLimitError):
+        RetryEngine(FAST).call(upstream, {})
+    assert len(calls) == 1
+
+
+def test_gives_up_after_num_retries():
+    upstream, calls = flaky([rate_limited()] * 10)
+    with pytest.raises(openai.error.RateLimitError):
+        RetryEngine(RapidaRetryProps(num=2, min_timeout=1)).call(upstream, {})
+    assert len(calls) == 3
+
+
+def test_budget_caps_retries():
+    budget = RetryBudget(ratio=0, min_per_second=0, max_balance=1)
+    engine = RetryEngine(FAST, budget=budget)
+    upstream, calls = flaky([rate_limited()] * 10)
+    with pytest.raises(openai.error.RateLimitError):
+        engine.call(upstream, {})
+    assert len(calls) == 2
+    assert budget.exhausted == 1
+
+
+def test_delay_backs_off_and_honors_retry_after():
+    engine = RetryEngine(RapidaRetryProps(factor=2, min_timeout=100, max_timeout=1000))
+    error = rate_limited()
+    assert 0.05 <= engine.delay(1, error) <= 0.1
+    assert 0.2 <= engine.delay(3, error) <= 0.4
+    assert 0.5 <= engine.delay(10, error) <= 1.0
+    assert engine.delay(1, rate_limited({"retry-after": "3"})) == 3.0
+    assert engine.delay(1, rate_limited({"retry-after-ms": "250"})) == 0.25
+    # Unparseable values fall back to the backoff.
+    assert 0.05 <= engine.delay(1, rate_limited({"retry-after": "soon"})) <= 0.1
+
+
+def test_slow_calls_are_hedged():
+    engine = RetryEngine(FAST, hedge_after=0.05)
+    losers = []
+    calls = []
+
+    def upstream(**kwargs):
+        calls.append(1)
+        if (len(calls) == 1):
+            time.sleep(0.3)
+            return {"copy": "first"}
+        return {"copy": "hedge"}
+
+    def on_attempt(attempt):
+        losers.append((attempt, threading.current_thread()))
+
+    started = time.monotonic()
+    assert engine.call(upstream, {}, on_attempt) == {"copy": "hedge"}
+    assert time.monotonic() - started < 0.25
+    # The slow copy is reported before the call returns, from the caller's thread.
+    [(loser, thread)] = losers
+    assert thread is threading.current_thread()
+    assert loser.hedge is False and loser.result is None
+    assert isinstance(loser.error, concurrent.futures.CancelledError)
+    assert engine.stats.snapshot()["hedges"] == 1
+
+
+def test_hedges_share_a_bounded_pool():
+    engine = RetryEngine(FAST, hedge_after=0.01)
+    threads = set()
+
+    def upstream(**kwargs):
+        threads.add(threading.current_thread())
+        time.sleep(0.02)
+        return {}
+
+    before = threading.active_count()
+    for _ in range(20):
+        engine.call(upstream, {})
+    assert len(threads) <= HEDGE_WORKERS
+    assert threading.active_count() - before <= HEDGE_WORKERS
+
+
+def test_no_hedges_while_the_pool_is_busy(monkeypatch):
+    monkeypatch.setattr(retry, "HEDGE_WORKERS", 1)
+    engine = RetryEngine(FAST, hedge_after=0.01)
+    calls = []
+
+    def upstream(**kwargs):
+        calls.append(1)
+        time.sleep(0.05)
+        return {}
+
+    assert engine.call(upstream, {}) == {}
+    assert len(calls) == 1
+    assert engine.stats.snapshot().get("hedges", 0) == 0
+
+
+def test_async_retries_and_hedges():
+    upstream_calls = []
+
+    async def upstream(**kwargs):
+        upstream_calls.append(1)
+        if (len(upstream_calls) == 1):
+            raise rate_limited()
+        if (len(upstream_calls) == 2):
+            await asyncio.sleep(1)
+        return {"n": len(upstream_calls)}
+
+    attempts = []
+
+    async def on_attempt(attempt):
+        attempts.append(attempt)
+
+    engine = RetryEngine(FAST, hedge_after=0.05)
+    assert asyncio.run(engine.acall(upstream, {}, on_attempt)) == {"n": 3}
+    assert [a.status for a in attempts] == [429, None]
+    assert isinstance(attempts[1].error, asyncio.CancelledError)
+
+
+class ChatCompletion:
+    calls = 0
+
+    @classmethod
+    def create(cls, **kwargs):
+        cls.calls += 1
+        if (cls.calls == 1):
+            raise openai.error.ServiceUnavailableError("busy", http_status=503)
+        return {"choices": []}
+
+
+def test_async_mode_logs_each_attempt_under_one_request(logs):
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    create(model="m", messages=[], rapida_meta=RapidaMeta(retry=FAST))
+
+    assert len(logs) == 2
+    attempt, final = logs
+    assert attempt.providerResponse.status == 503
+    assert attempt.providerRequest.meta["Rapida-Attempt"] == "1"
+    assert attempt.providerRequest.meta["Rapida-Parent-Request-Id"] == \
+        final.providerRequest.meta["Rapida-Request-Id"]
+    assert final.providerResponse.status == 200
+    assert final.providerResponse.headers["Rapida-Retry-Attempts"] == "2"
+
+
+def test_async_mode_does_not_retry_by_default(logs):
+    assert rapida_global.retry_engine is None
+    ChatCompletion.calls = 0
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    with pytest.raises(openai.error.ServiceUnavailableError):
+        create(model="m", messages=[])
+
+
+def test_proxy_meta_still_exports_retry_props():
+    from rapida.openai_proxy.openai_injector import RapidaRetryProps as ProxyRetryProps
+    assert ProxyRetryProps is RapidaRetryProps
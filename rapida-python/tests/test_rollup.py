@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from rapida.async_logger.async_logger import ROLLUP_PATH, RapidaAsyncLogger
+from rapida.async_logger.rollup import Rollup, RollupConfig
+from rapida.openai_async.openai_injector import OpenAIInjector, RapidaMeta
+
+
+def test_calls_are_aggregated_per_group():
+    shipped = []
+    rollup = Rollup(RollupConfig(window=3600), shipped.append)
+    try:
+        for i in range(100):
+            rollup.add("Moderation", "text-moderation-latest", "alice", {"env": "prod"},
+                       error=i % 10 == 0, latency_ms=10 + i, prompt_tokens=2, total_tokens=2)
+        rollup.add("Embedding", "ada", None, None, error=False, latency_ms=5)
+        rollup.flush()
+    finally:
+        rollup.close()
+
+    assert len(shipped) == 1 and rollup.windows_shipped == 1
+    summary = json.loads(shipped[0])
+    groups = {group["resource"]: group for group in summary["groups"]}
+    moderation = groups["Moderation"]
+    assert moderation["properties"] == {"env": "prod"} and moderation["userId"] == "alice"
+    assert moderation["count"] == 100 and moderation["errors"] == 10
+    assert moderation["totalTokens"] == 200
+    assert moderation["latencyMs"]["min"] == 10 and moderation["latencyMs"]["max"] == 109
+    assert abs(moderation["latencyMs"]["p50"] - 59.5) < 2
+    assert groups["Embedding"]["count"] == 1
+    assert summary["windowStart"] <= summary["windowEnd"]
+
+
+def test_distinct_groups_are_capped():
+    shipped = []
+    rollup = Rollup(RollupConfig(window=3600, max_groups=3), shipped.append)
+    try:
+        for i in range(10):
+            rollup.add("Moderation", None, f"user-{i}", None, error=False, latency_ms=1)
+        summary = rollup.summary()
+    finally:
+        rollup.close()
+
+    assert len(summary["groups"]) == 4
+    overflow = [group for group in summary["groups"] if group["overflow"]]
+    assert len(overflow) == 1 and overflow[0]["count"] == 7
+    # The window is reset once its summary is taken.
+    assert rollup.summary() is None and shipped == []
+
+
+def test_logger_ships_rollups_instead_of_records(monkeypatch, use_logger):
+    posts = []
+    logger = use_logger(RapidaAsyncLogger(
+        rollup_config=RollupConfig(resources=("Moderation",), window=3600)))
+    monkeypatch.setattr(logger, "_ship", lambda path, body: posts.append((path, body)))
+
+    create = OpenAIInjector()._with_rapida_auth(Moderation.create)
+    meta = RapidaMeta(custom_properties={"env": "prod"})
+    for _ in range(3):
+        create(model="text-moderation-latest", input="hi", rapida_meta=meta)
+    with pytest.raises(ValueError):
+        create(model="text-moderation-latest", input="hi", fail=True, rapida_meta=meta)
+    logger.close()
+
+    assert [path for path, _ in posts] == [ROLLUP_PATH]
+    [group] = json.loads(posts[0][1])["groups"]
+    assert group["resource"] == "Moderation" and group["model"] == "text-moderation-latest"
+    assert group["properties"] == {"env": "prod"}
+    assert group["count"] == 4 and group["errors"] == 1 and group["promptTokens"] == 3
+
+
+class Moderation:
+    @classmethod
+    def create(cls, fail=False, **kwargs):
+        if (fail):
+            raise ValueError("upstream failed")
+        return {"id": "modr-1", "results": [{"flagged": False}],
+                "usage": {"prompt_tokens": 1, "total_tokens": 1}}
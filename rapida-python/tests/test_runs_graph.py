@@ -0,0 +1,137 @@
+import pytest
+import requests
+from local_server import LocalServer
+
+from rapida.requester import PoolConfig, Requests
+from rapida.runs import RapidaGraphBuilder, RapidaJob, RapidaNodeConfig, RapidaStatus
+
+
+def requester(server: LocalServer) -> Requests:
+    return Requests(base_url=server.url, api_key="test",
+                    pool_config=PoolConfig(http2=False))
+
+
+def test_fan_out_job_is_sent_in_a_few_bulk_requests():
+    with LocalServer() as server:
+        with RapidaGraphBuilder(requester(server), max_pending=5000) as graph:
+            job = graph.job(name="fan-out")
+            nodes = [job.create_node(RapidaNodeConfig(name=f"node-{i}"))
+                     for i in range(1000)]
+            children = [node.create_child_node(RapidaNodeConfig(name="child"))
+                        for node in nodes[:10]]
+            for node in nodes + children:
+                node.set_status(RapidaStatus.RUNNING)
+                node.success()
+            assert server.requests == []
+
+        assert [(r.method, r.path) for r in server.requests] == [
+            ("POST", "/job/bulk"),
+            ("POST", "/node/bulk"),
+        ]
+        sent_nodes = server.requests[1].json()["nodes"]
+        assert len(sent_nodes) == 1010
+        assert all(n["job"] == job.id for n in sent_nodes)
+        assert all(n["status"] == "SUCCESS" for n in sent_nodes)
+        assert sent_nodes[1000]["parentJobId"] == nodes[0].id
+
+
+def test_status_changes_after_a_flush_are_coalesced():
+    with LocalServer() as server:
+        graph = RapidaGraphBuilder(requester(server))
+        job = graph.job(name="job")
+        node = job.create_node(RapidaNodeConfig(name="node"))
+        graph.flush()
+
+        node.set_status(RapidaStatus.RUNNING)
+        node.fail()
+        job.set_status(RapidaStatus.RUNNING)
+        graph.flush()
+        graph.flush()
+
+        assert [(r.method, r.path) for r in server.requests] == [
+            ("POST", "/job/bulk"),
+            ("POST", "/node/bulk"),
+            ("PATCH", "/job/status/bulk"),
+            ("PATCH", "/node/status/bulk"),
+        ]
+        assert server.requests[2].json() == {
+            "statuses": [{"id": job.id, "status": "RUNNING"}]}
+        assert server.requests[3].json() == {
+            "statuses": [{"id": node.id, "status": "FAILED"}]}
+
+
+def test_flushes_when_max_pending_is_reached():
+    with LocalServer() as server:
+        graph = RapidaGraphBuilder(requester(server), max_pending=5)
+        job = graph.job(name="job")
+        for i in range(4):
+            job.create_node(RapidaNodeConfig(name=f"node-{i}"))
+        assert len(server.requests) == 2
+        assert graph.pending() == 0
+
+
+def test_failed_flushes_keep_what_was_not_sent():
+    with LocalServer(status=500) as server:
+        graph = RapidaGraphBuilder(Requests(base_url=server.url, api_key="test",
+                                            fail_on_error=True,
+                                            pool_config=PoolConfig(http2=False)))
+        job = graph.job(name="job")
+        node = job.create_node(RapidaNodeConfig(name="node"))
+        node.success()
+        with pytest.raises(requests.HTTPError):
+            graph.flush()
+        assert graph.pending() == 2
+
+        server.status = 200
+        graph.flush()
+        assert graph.pending() == 0
+        assert [(r.method, r.path) for r in server.requests] == [
+            ("POST", "/job/bulk"),
+            ("POST", "/job/bulk"),
+            ("POST", "/node/bulk"),
+        ]
+        assert server.requests[2].json()["nodes"][0]["status"] == "SUCCESS"
+
+
+def test_rejected_flushes_keep_what_was_not_sent():
+    with LocalServer(status=503) as server:
+        graph = RapidaGraphBuilder(requester(server), bulk=False)
+        job = graph.job(name="job")
+        job.create_node(RapidaNodeConfig(name="node")).success()
+        graph.flush()
+        assert graph.pending() == 2
+
+        server.status = 200
+        graph.flush()
+        assert graph.pending() == 0
+        assert [(r.method, r.path) for r in server.requests][1:] == [
+            ("POST", "/job"),
+            ("POST", "/node"),
+            ("PATCH", f"/node/{server.requests[2].json()['id']}/status"),
+        ]
+
+
+def test_without_bulk_endpoints_requests_are_sent_individually():
+    with LocalServer() as server:
+        with RapidaGraphBuilder(requester(server), bulk=False) as graph:
+            job = graph.job(name="job")
+            node = job.create_node(RapidaNodeConfig(name="node"))
+            job.create_node(RapidaNodeConfig(name="pending"))
+            node.set_status(RapidaStatus.RUNNING)
+            node.success()
+
+        assert [(r.method, r.path) for r in server.requests] == [
+            ("POST", "/job"),
+            ("POST", "/node"),
+            ("POST", "/node"),
+            ("PATCH", f"/node/{node.id}/status"),
+        ]
+        assert server.requests[3].json() == {"status": "SUCCESS"}
+
+
+def test_jobs_without_a_graph_are_sent_immediately():
+    with LocalServer() as server:
+        job = RapidaJob(name="job", requester=requester(server))
+        job.create_node(RapidaNodeConfig(name="node")).success()
+        assert [r.path for r in server.requests] == [
+            "/job", "/node", f"/node/{server.requests[1].json()['id']}/status"]
@@ -0,0 +1,94 @@
+import pytest
+
+from rapida.openai_async.openai_injector import OpenAIInjector, RapidaMeta
+from rapida.sampling import AdaptiveSampling, Sampler, SamplingRule
+
+
+def bodies(n):
+    return [{"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": str(i)}]}
+            for i in range(n)]
+
+
+def test_routine_calls_are_sampled_and_counted():
+    sampler = Sampler(default_rate=0.1, outlier_quantile=None)
+    kept = [sampler.sample("ChatCompletion", body, latency_ms=10, tokens=5) for body in bodies(2000)]
+
+    assert 100 < sum(rate is not None for rate in kept) < 300
+    assert {rate for rate in kept if rate is not None} == {0.1}
+    counts = sampler.stats.snapshot()["ChatCompletion:gpt-3.5-turbo"]
+    assert counts["calls"] == 2000 and counts["tokens"] == 10000
+    assert counts["kept"] == sum(rate is not None for rate in kept)
+
+
+def test_decisions_are_deterministic():
+    sampler = Sampler(default_rate=0.5, outlier_quantile=None)
+    first = [sampler.sample("ChatCompletion", body) for body in bodies(100)]
+    # Request ids differ between retries and are ignored.
+    again = [sampler.sample("ChatCompletion", dict(body, request_id="retry")) for body in bodies(100)]
+    assert first == again
+
+
+def test_errors_and_slow_calls_are_always_kept():
+    sampler = Sampler(default_rate=0.0, slow_ms=1000, outlier_quantile=None)
+    assert sampler.sample("ChatCompletion", {}, latency_ms=10) is None
+    assert sampler.sample("ChatCompletion", {}, error=True) == 1.0
+    assert sampler.sample("ChatCompletion", {}, latency_ms=1500) == 1.0
+
+
+def test_latency_outliers_are_kept():
+    sampler = Sampler(default_rate=0.0, outlier_quantile=0.99)
+    for i in range(200):
+        sampler.sample("Embedding", {"model": "m"}, latency_ms=10 + i % 5)
+    assert sampler.sample("Embedding", {"model": "m"}, latency_ms=11) is None
+    assert sampler.sample("Embedding", {"model": "m"}, latency_ms=100) == 1.0
+
+
+def test_rules_match_resource_model_user_and_properties():
+    sampler = Sampler(default_rate=1.0, outlier_quantile=None, rules=[
+        SamplingRule(0.0, resource="Embedding"),
+        SamplingRule(0.0, model="gpt-4", user_id="bot"),
+        SamplingRule(0.0, properties={"tier": "free"}),
+    ])
+    assert sampler.sample("Embedding", {"input": "x"}) is None
+    assert sampler.sample("ChatCompletion", {"model": "gpt-4"}, user_id="bot") is None
+    assert sampler.sample("ChatCompletion", {"model": "gpt-4"}, user_id="alice") == 1.0
+    assert sampler.sample("ChatCompletion", {}, properties={"tier": "free"}) is None
+    assert sampler.sample("ChatCompletion", {}, properties={"tier": "paid"}) == 1.0
+
+
+def test_adaptive_mode_follows_the_backlog():
+    sampler = Sampler(default_rate=1.0, outlier_quantile=None,
+                      adaptive=AdaptiveSampling(interval=0, min_factor=0.25))
+    backlog = [0.9]
+    for _ in range(5):
+        sampler.sample("ChatCompletion", {}, backlog=lambda: backlog[0])
+    assert sampler.factor == 0.25
+    assert sampler.sample("ChatCompletion", {"n": 1}, backlog=lambda: 0.3) in (None, 0.25)
+    for _ in range(2):
+        sampler.sample("ChatCompletion", {}, backlog=lambda: 0.0)
+    assert sampler.factor == 1.0
+
+
+class ChatCompletion:
+    @classmethod
+    def create(cls, **kwargs):
+        if (kwargs.get("fail")):
+            raise ValueError("boom")
+        return {"choices": [], "usage": {"total_tokens": 3}}
+
+
+def test_async_mode_skips_sampled_out_records(logs, configure):
+    sampler = Sampler(
+        outlier_quantile=None,
+        rules=[SamplingRule(0.0, properties={"env": "load-test"})])
+    configure(sampler=sampler)
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    meta = RapidaMeta(custom_properties={"env": "load-test"})
+    create(model="m", messages=[], rapida_meta=meta)
+    with pytest.raises(ValueError):
+        create(model="m", messages=[], fail=True, rapida_meta=meta)
+    create(model="m", messages=[])
+
+    assert [log.providerResponse.status for log in logs] == [500, 200]
+    counts = sampler.stats.snapshot()["ChatCompletion:m"]
+    assert counts["calls"] == 3 and counts["errors"] == 1 and counts["tokens"] == 6
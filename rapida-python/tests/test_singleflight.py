@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import pytest
+from local_server import LocalServer
+from openai.openai_object import OpenAIObject
+
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.openai_async.openai_injector import OpenAIInjector
+from rapida.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"data": [1, 2]}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(
+            lambda i: flight.do("k", upstream, f"req-{i}"), range(8)))
+
+    assert len(calls) == 1
+    leaders = [r for r, leader_id in results if leader_id is None]
+    followers = [leader_id for _, leader_id in results if leader_id is not None]
+    assert len(leaders) == 1 and len(followers) == 7
+    assert len(set(followers)) == 1
+    assert flight.coalesced == 7
+    # Every caller gets its own copy.
+    assert len({id(r) for r, _ in results}) == 8
+    assert all(r == {"data": [1, 2]} for r, _ in results)
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def upstream():
+        started.set()
+        time.sleep(0.1)
+        raise openai.error.RateLimitError("slow down", http_status=429)
+
+    def follower():
+        started.wait()
+        return flight.do("k", lambda: None)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader_future = pool.submit(flight.do, "k", upstream)
+        follower_futures = [pool.submit(follower) for _ in range(3)]
+        errors = [future.exception() for future in [leader_future] + follower_futures]
+
+    # Every caller raises its own exception, with the leader's as the cause.
+    leader_error = errors[0]
+    assert len({id(error) for error in errors}) == 4
+    for error in errors[1:]:
+        assert isinstance(error, openai.error.RateLimitError)
+        assert error.http_status == 429 and str(error) == "slow down"
+        assert error.__cause__ is leader_error
+
+
+def test_async_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"n": 1}
+
+    async def main():
+        return await asyncio.gather(*[flight.ado("k", upstream, str(i)) for i in range(5)])
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [leader_id for _, leader_id in results] == [None] + ["0"] * 4
+    assert all(r == {"n": 1} for r, _ in results)
+
+
+def test_followers_outlive_a_cancelled_leader():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"n": len(calls)}
+
+    async def main():
+        leader = asyncio.create_task(flight.ado("k", upstream, "0"))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.ado("k", upstream, str(i))) for i in (1, 2)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(main())
+    # The first follower makes the call again, and shares it with the second.
+    assert len(calls) == 2
+    assert results == [({"n": 2}, None), ({"n": 2}, "1")]
+
+
+def test_only_deterministic_non_streaming_calls_are_eligible():
+    flight = SingleFlight()
+    assert flight.eligible("Embedding", {"input": "x"})
+    assert flight.eligible("ChatCompletion", {"temperature": 0})
+    assert not flight.eligible("ChatCompletion", {"temperature": 0.7})
+    assert not flight.eligible("ChatCompletion", {})
+    assert not flight.eligible("ChatCompletion", {"temperature": 0, "stream": True})
+    assert not flight.eligible("Image", {"prompt": "x"})
+
+
+# Named after the resource so it is eligible for coalescing.
+class Embedding:
+    calls = 0
+
+    @classmethod
+    def create(cls, **kwargs):
+        cls.calls += 1
+        time.sleep(0.2)
+        return OpenAIObject.construct_from({"data": [{"embedding": [0.5]}]})
+
+
+def test_async_mode_followers_log_records_pointing_at_the_leader(use_logger, configure):
+    with LocalServer() as server:
+        use_logger(RapidaAsyncLogger(base_url=server.url, api_key="test"))
+        configure(single_flight=SingleFlight())
+        create = OpenAIInjector()._with_rapida_auth(Embedding.create)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: create(input="same"), range(4)))
+
+        assert Embedding.calls == 1
+        assert all(r["data"][0]["embedding"] == [0.5] for r in results)
+        logs = [r.json() for r in server.requests]
+        request_ids = {log["providerRequest"]["meta"]["Rapida-Request-Id"] for log in logs}
+        assert len(request_ids) == 4
+        pointers = [log["providerResponse"]["headers"].get("Rapida-Coalesced-With")
+                    for log in logs]
+        leader_ids = {p for p in pointers if p is not None}
+        assert pointers.count(None) == 1 and len(leader_ids) == 1
+        assert leader_ids <= request_ids
+
+
+def test_proxy_mode_followers_get_their_own_request_id(configure, proxy):
+    configure(single_flight=SingleFlight())
+    proxy.delay = 0.2
+
+    def create(_):
+        return openai.ChatCompletion.create(
+            model="gpt-3.5-turbo", temperature=0,
+            messages=[{"role": "user", "content": "same"}])
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        responses = list(pool.map(create, range(4)))
+    RapidaAsyncLogger.flush_all(timeout=5)
+
+    completions = [r for r in proxy.requests if r.path == "/v1/chat/completions"]
+    follower_logs = [r.json() for r in proxy.requests if r.path == "/oai/v1/log"]
+
+    assert len(completions) == 1
+    assert [r.rapida.id for r in responses].count("rid") == 1
+    followers = [r.rapida for r in responses if r.rapida.id is None]
+    assert len(followers) == 3
+    assert all(f.coalesced_with == "rid" for f in followers)
+    assert len({f.request_id for f in followers}) == 3
+    assert len(follower_logs) == 3
+    assert all(log["providerResponse"]["headers"] == {"Rapida-Coalesced-With": "rid"}
+               for log in follower_logs)
@@ -0,0 +1,196 @@
+import os
+import time
+from types import SimpleNamespace
+
+from local_server import LocalServer
+
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.async_logger.shipper import LogShipper, OverflowPolicy, ShipperConfig
+from rapida.async_logger.spool import LogSpool, SegmentLog, SpoolConfig
+from rapida.requester import PoolConfig, Requests
+
+
+def body(n: int) -> bytes:
+    return b'{"n":%d}' % n
+
+
+def drain(log: SegmentLog, limit: int = 1000) -> list:
+    records, cursor = log.read_batch(limit)
+    log.ack(cursor)
+    return records
+
+
+def test_segments_survive_reopen_and_torn_writes(tmp_path):
+    config = SpoolConfig(segment_bytes=64)
+    log = SegmentLog(str(tmp_path), config)
+    for i in range(10):
+        log.append("/oai/v1/log", body(i))
+    assert len(log.segments) > 1
+    # Batches never span segments.
+    records, cursor = log.read_batch(3)
+    assert len(records) == 2
+    log.ack(cursor)
+    log.close()
+
+    # Simulate a crash in the middle of appending a record.
+    last = os.path.join(str(tmp_path), sorted(os.listdir(str(tmp_path)))[-2])
+    assert last.endswith(".seg")
+    with open(last, "ab") as f:
+        f.write(b"\x40\x00\x00\x00torn")
+
+    log = SegmentLog(str(tmp_path), config)
+    assert log.pending() == 8
+    replayed = []
+    while log.pending():
+        replayed += drain(log)
+    assert replayed == [("/oai/v1/log", body(i)) for i in range(2, 10)]
+    log.append("/oai/v1/log", body(10))
+    assert drain(log) == [("/oai/v1/log", body(10))]
+
+
+def test_size_cap_evicts_oldest_segments(tmp_path):
+    log = SegmentLog(str(tmp_path), SpoolConfig(segment_bytes=100, max_bytes=300))
+    for i in range(50):
+        log.append("/oai/v1/log", body(i))
+
+    assert log.size <= 300
+    assert log.evicted_records + log.pending() == 50
+    replayed = []
+    while log.pending():
+        replayed += drain(log)
+    assert [b for _, b in replayed] == [body(i) for i in range(50 - len(replayed), 50)]
+
+
+def test_compaction_drops_replayed_prefix(tmp_path):
+    log = SegmentLog(str(tmp_path), SpoolConfig(segment_bytes=1000, compact_bytes=100))
+    for i in range(40):
+        log.append("/oai/v1/log", body(i))
+    head = log.segments[0]
+    size = log.size
+    records, cursor = log.read_batch(10)
+    log.ack(cursor)
+
+    assert log.compact()
+    assert log.segments[0] == head
+    assert log.size < size
+    assert log.pending() == 30
+    assert drain(log, 1) == [("/oai/v1/log", body(10))]
+
+
+def spool_config(tmp_path, **config) -> SpoolConfig:
+    config = dict(dict(fsync_interval=0.05, initial_backoff=0.05,
+                       max_backoff=0.2), **config)
+    return SpoolConfig(directory=str(tmp_path), **config)
+
+
+def test_replays_once_the_endpoint_recovers(tmp_path):
+    with LocalServer(status=503) as server:
+        logger = RapidaAsyncLogger(base_url=server.url, api_key="test",
+                                   spool_config=spool_config(tmp_path))
+        for i in range(3):
+            logger.spool.append("/oai/v1/log", body(i))
+        time.sleep(0.3)
+        assert logger.spool.pending() == 3
+        failed_attempts = len(server.requests)
+        assert failed_attempts >= 2
+
+        server.status = 200
+        assert logger.spool.flush(timeout=5)
+        delivered = [r.body for r in server.requests[failed_attempts:]]
+        assert delivered == [body(0), body(1), body(2)]
+        assert logger.spool.replayed == 3
+        logger.close()
+
+
+class EvictingRequests:
+    # Appends enough while the first record is replayed to evict its
+    # segment, then fails the second.
+    def __init__(self):
+        self.spool = None
+        self.bodies = []
+
+    def post(self, path, data=None):
+        self.bodies.append(data)
+        if len(self.bodies) == 1:
+            for i in range(100, 110):
+                self.spool.append(path, body(i))
+        return SimpleNamespace(status_code=503 if len(self.bodies) == 2 else 200)
+
+
+def test_eviction_during_a_partial_replay_loses_nothing_unsent(tmp_path):
+    config = spool_config(tmp_path, segment_bytes=64, max_bytes=200)
+    log = SegmentLog(os.path.join(str(tmp_path), str(os.getpid())), config)
+    log.append("/oai/v1/log", body(0))
+    log.append("/oai/v1/log", body(1))
+    log.close()
+
+    requests = EvictingRequests()
+    spool = LogSpool(requests, config)
+    requests.spool = spool
+    assert spool.flush(timeout=5)
+    spool.close()
+
+    # The evicted segment held both records, and every later record was
+    # either delivered or counted as evicted.
+    delivered = requests.bodies[2:]
+    assert len(delivered) + spool.evicted_records == 12
+    assert delivered == [body(i) for i in range(110 - len(delivered), 110)]
+
+
+def test_failed_and_overflowing_shipper_records_are_spooled(tmp_path):
+    with LocalServer(status=500) as server:
+        requests = Requests(base_url=server.url, api_key="test",
+                            pool_config=PoolConfig(http2=False))
+        spool = LogSpool(requests, spool_config(tmp_path, initial_backoff=60))
+        shipper = LogShipper(requests, ShipperConfig(
+            flush_interval=60, max_queue_size=2,
+            overflow_policy=OverflowPolicy.DROP_NEWEST), spool=spool)
+        for i in range(4):
+            assert shipper.submit("/oai/v1/log", body(i))
+        assert shipper.dropped == 0
+        assert spool.pending() == 2
+        shipper.flush(timeout=5)
+        assert spool.pending() == 4
+
+        shipper.close()
+        spool.close()
+        server.status = 200
+        failed_attempts = len(server.requests)
+
+        # Whatever was left spooled is replayed by the next spool.
+        spool = LogSpool(requests, spool_config(tmp_path))
+        assert spool.flush(timeout=5)
+        replayed = sorted(r.body for r in server.requests[failed_attempts:])
+        assert replayed == [body(i) for i in range(4)]
+        spool.close()
+
+
+def test_rejected_records_are_not_retried(tmp_path):
+    with LocalServer(status=400) as server:
+        requests = Requests(base_url=server.url, api_key="test",
+                            pool_config=PoolConfig(http2=False))
+        spool = LogSpool(requests, spool_config(tmp_path))
+        spool.append("/oai/v1/log", body(1))
+        assert spool.flush(timeout=5)
+        assert spool.rejected == 1
+        assert len(server.requests) == 1
+        spool.close()
+
+
+def test_orphaned_spools_are_adopted(tmp_path):
+    # Pids above pid_max never belong to a live process.
+    orphan = SegmentLog(os.path.join(str(tmp_path), "999999999"), SpoolConfig())
+    orphan.append("/oai/v1/log", body(7))
+    orphan.close()
+
+    with LocalServer() as server:
+        requests = Requests(base_url=server.url, api_key="test",
+                            pool_config=PoolConfig(http2=False))
+        spool = LogSpool(requests, spool_config(tmp_path))
+        deadline = time.monotonic() + 5
+        while not server.requests and time.monotonic() < deadline:
+            time.sleep(0.01)
+        spool.close()
+
+        assert [r.body for r in server.requests] == [body(7)]
+        assert not os.path.exists(os.path.join(str(tmp_path), "999999999"))
@@ -0,0 +1,86 @@
+from openai.openai_object import OpenAIObject
+
+from rapida.openai_async.openai_injector import OpenAIInjector
+from rapida.openai_async.stream_accumulator import StreamAccumulator
+
+
+def chat_chunk(delta: dict, finish_reason=None, index=0) -> OpenAIObject:
+    return OpenAIObject.construct_from({
+        "id": "chatcmpl-1",
+        "object": "chat.completion.chunk",
+        "created": 1690000000,
+        "model": "gpt-3.5-turbo-0613",
+        "choices": [{"index": index, "delta": delta, "finish_reason": finish_reason}],
+    })
+
+
+def test_chat_stream_is_assembled_into_one_message():
+    accumulator = StreamAccumulator()
+    for chunk in [
+        chat_chunk({"role": "assistant", "content": ""}),
+        chat_chunk({"content": "Hello"}),
+        chat_chunk({"content": " world"}),
+        chat_chunk({}, finish_reason="stop"),
+    ]:
+        accumulator.add(chunk)
+
+    assert accumulator.build() == {
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 1690000000,
+        "model": "gpt-3.5-turbo-0613",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "Hello world"},
+            "finish_reason": "stop",
+        }],
+    }
+    assert accumulator.chunk_count == 4
+
+
+def test_function_call_arguments_are_concatenated():
+    accumulator = StreamAccumulator()
+    for chunk in [
+        chat_chunk({"role": "assistant", "content": None,
+                    "function_call": {"name": "outline", "arguments": ""}}),
+        chat_chunk({"function_call": {"arguments": "{\"na"}}),
+        chat_chunk({"function_call": {"arguments": "me\": 1}"}}),
+        chat_chunk({}, finish_reason="function_call"),
+    ]:
+        accumulator.add(chunk)
+
+    choice = accumulator.build()["choices"][0]
+    assert choice["message"] == {
+        "role": "assistant",
+        "content": None,
+        "function_call": {"name": "outline", "arguments": "{\"name\": 1}"},
+    }
+    assert choice["finish_reason"] == "function_call"
+
+
+def test_multiple_choices_and_text_completions():
+    accumulator = StreamAccumulator()
+    for index, text in [(0, "a"), (1, "x"), (0, "b"), (1, "y")]:
+        accumulator.add({
+            "id": "cmpl-1",
+            "object": "text_completion",
+            "model": "text-davinci-003",
+            "choices": [{"index": index, "text": text, "finish_reason": None}],
+        })
+
+    choices = accumulator.build()["choices"]
+    assert [c["text"] for c in choices] == ["ab", "xy"]
+    assert accumulator.build()["object"] == "text_completion"
+
+
+def test_sync_interceptor_logs_the_assembled_response_once():
+    sent = []
+    chunks = [chat_chunk({"role": "assistant"}), chat_chunk({"content": "Hi"}),
+              chat_chunk({}, finish_reason="stop")]
+
+    stream = OpenAIInjector()._result_interceptor(
+        (c for c in chunks), {}, sent.append)
+    assert sent == []
+    assert list(stream) == chunks
+    assert len(sent) == 1
+    assert sent[0]["choices"][0]["message"]["content"] == "Hi"
@@ -0,0 +1,71 @@
+import json
+import random
+import time
+
+from rapida.async_logger import encoder
+from rapida.openai_async.openai_injector import OpenAIInjector
+from rapida.timing import QuantileSketch, RequestClock
+
+
+def test_sketch_quantiles_are_within_the_relative_accuracy():
+    values = [random.uniform(1, 1000) for _ in range(10000)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+    values.sort()
+    for q in (0.5, 0.95, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact + 1e-9
+    assert sketch.max == values[-1]
+    assert len(sketch.to_dict()["buckets"]) < 400
+
+
+def test_sketches_merge():
+    first, second = QuantileSketch(), QuantileSketch()
+    for value in range(1, 51):
+        first.add(value)
+    for value in range(51, 101):
+        second.add(value)
+    second.add(0)
+    first.merge(second)
+    assert first.count == 101 and first.min == 0 and first.max == 100
+    assert abs(first.quantile(0.5) - 50) <= 1
+
+
+def test_clock_records_chunk_intervals():
+    clock = RequestClock()
+    clock.mark_headers()
+    for _ in range(5):
+        time.sleep(0.01)
+        clock.mark_chunk()
+    # Time spent after the last chunk is not part of the request.
+    time.sleep(0.1)
+    timing = clock.timing()
+
+    assert timing.timeToHeadersMs < timing.timeToFirstChunkMs < timing.timeToLastChunkMs
+    assert timing.chunkIntervals.count == 4
+    assert 9 <= timing.chunkIntervals.meanMs <= timing.chunkIntervals.maxMs
+    duration = (timing.endTime.seconds - timing.startTime.seconds) * 1000 + \
+        timing.endTime.milliseconds - timing.startTime.milliseconds
+    assert duration < 100
+
+
+class ChatCompletion:
+    @classmethod
+    def create(cls, **kwargs):
+        def chunks():
+            for i in range(3):
+                time.sleep(0.01)
+                yield {"object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {"content": str(i)}}]}
+        return chunks()
+
+
+def test_async_mode_logs_stream_timing(logs):
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    assert len(list(create(model="m", messages=[], stream=True))) == 3
+
+    timing = json.loads(encoder.dumps(logs[0]))["timing"]
+    assert timing["timeToHeadersMs"] <= timing["timeToFirstChunkMs"]
+    assert timing["chunkIntervals"]["count"] == 2
+    assert timing["chunkIntervals"]["p95Ms"] >= 9
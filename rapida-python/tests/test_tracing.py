@@ -0,0 +1,146 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from rapida import tracing
+from rapida.async_logger.async_logger import RapidaAsyncLogger
+from rapida.globals import rapida_global
+from rapida.openai_async.openai_injector import OpenAIInjector, RapidaMeta
+from rapida.runs import RapidaGraphBuilder, RapidaNodeConfig
+from rapida.tracing import FileSpanExporter, InMemorySpanExporter, Tracer
+
+
+@pytest.fixture
+def exporter(configure):
+    exporter = InMemorySpanExporter()
+    configure(tracer=Tracer(exporter, flush_interval=3600))
+    yield exporter
+    rapida_global.tracer.close()
+
+
+def by_name(spans):
+    return {span["name"]: span for span in spans}
+
+
+def test_disabled_spans_are_shared_no_ops():
+    assert rapida_global.tracer is None
+    with tracing.span("a") as first, tracing.span("b") as second:
+        assert first is second
+        assert tracing.current_span() is None
+
+
+def test_spans_nest_and_export_in_batches(exporter):
+    with tracing.span("outer") as outer:
+        with tracing.span("inner", attributes={"n": 1}):
+            pass
+        with pytest.raises(ValueError):
+            with tracing.span("failing"):
+                raise ValueError("boom")
+    assert exporter.get_finished_spans() == []
+
+    assert rapida_global.tracer.flush(timeout=5)
+    spans = by_name(exporter.get_finished_spans())
+    assert spans["inner"]["parentSpanId"] == outer.span_id
+    assert spans["inner"]["traceId"] == outer.trace_id
+    assert spans["inner"]["attributes"] == {"n": 1}
+    assert spans["outer"]["parentSpanId"] is None
+    assert spans["outer"]["status"] == {"code": "STATUS_CODE_OK"}
+    assert spans["failing"]["status"] == {"code": "STATUS_CODE_ERROR", "message": "ValueError: boom"}
+    assert spans["inner"]["startTimeUnixNano"] <= spans["inner"]["endTimeUnixNano"]
+
+
+def test_file_exporter_writes_json_lines(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(FileSpanExporter(str(path)), max_batch_size=2)
+    for name in ("a", "b", "c"):
+        with tracer.scope(name):
+            pass
+    tracer.close()
+
+    assert [json.loads(line)["name"] for line in path.read_text().splitlines()] == ["a", "b", "c"]
+
+
+def test_wrapped_calls_are_children_of_their_node(exporter, monkeypatch, use_logger):
+    shipped = []
+    logger = use_logger(RapidaAsyncLogger())
+    monkeypatch.setattr(logger, "_ship_record", lambda path, body: shipped.append(path))
+    graph = RapidaGraphBuilder(requester=object())
+    job = graph.job(name="job")
+    node = job.create_node(RapidaNodeConfig(name="node"))
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    create(model="m", messages=[], rapida_meta=RapidaMeta(node_id=node.id))
+    node.success()
+    job.fail()
+
+    assert shipped == ["/oai/v1/log"]
+    assert rapida_global.tracer.flush(timeout=5)
+    spans = by_name(exporter.get_finished_spans())
+    call = spans["openai.ChatCompletion"]
+    assert call["attributes"] == {"rapida.mode": "async", "rapida.resource": "ChatCompletion"}
+    assert call["parentSpanId"] == spans["rapida.node"]["spanId"]
+    assert spans["rapida.node"]["parentSpanId"] == spans["rapida.job"]["spanId"]
+    assert spans["rapida.job"]["status"] == {"code": "STATUS_CODE_ERROR", "message": "FAILED"}
+    assert len({span["traceId"] for span in spans.values()}) == 1
+
+    for phase in ("rapida.extract_args", "rapida.upstream", "rapida.intercept"):
+        assert spans[phase]["parentSpanId"] == call["spanId"]
+    assert spans["rapida.upstream"]["kind"] == "SPAN_KIND_CLIENT"
+    assert spans["rapida.log"]["parentSpanId"] == call["spanId"]
+    assert spans["rapida.serialize"]["parentSpanId"] == spans["rapida.log"]["spanId"]
+    assert spans["rapida.ship"]["parentSpanId"] == spans["rapida.log"]["spanId"]
+
+
+def test_stream_spans_end_with_the_stream(exporter, monkeypatch, use_logger):
+    logger = use_logger(RapidaAsyncLogger())
+    monkeypatch.setattr(logger, "_ship_record", lambda path, body: None)
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    stream = create(model="m", messages=[], stream=True)
+    assert rapida_global.tracer.flush(timeout=5)
+    assert "openai.ChatCompletion" not in by_name(exporter.get_finished_spans())
+    assert len(list(stream)) == 2
+
+    assert rapida_global.tracer.flush(timeout=5)
+    spans = by_name(exporter.get_finished_spans())
+    call = spans["openai.ChatCompletion"]
+    assert call["endTimeUnixNano"] - call["startTimeUnixNano"] >= 50_000_000
+    assert call["endTimeUnixNano"] >= spans["rapida.log"]["endTimeUnixNano"]
+    assert spans["rapida.log"]["parentSpanId"] == call["spanId"]
+
+
+def test_async_stream_spans_end_when_closed(exporter):
+    async def chunks():
+        for i in range(3):
+            await asyncio.sleep(0.02)
+            yield i
+
+    async def wrapper(**kwargs):
+        return chunks()
+
+    async def consume():
+        stream = await tracing.traced_async("openai.ChatCompletion", wrapper, {})(stream=True)
+        async for chunk in stream:
+            break
+        await stream.aclose()
+
+    asyncio.run(consume())
+    assert rapida_global.tracer.flush(timeout=5)
+    [call] = exporter.get_finished_spans()
+    assert call["status"] == {"code": "STATUS_CODE_OK"}
+    assert call["endTimeUnixNano"] - call["startTimeUnixNano"] >= 20_000_000
+
+
+class ChatCompletion:
+    @classmethod
+    def create(cls, stream=False, **kwargs):
+        if (stream):
+            return cls._chunks()
+        return {"id": "chatcmpl-1", "choices": []}
+
+    @staticmethod
+    def _chunks():
+        for content in ("one", " two"):
+            time.sleep(0.03)
+            yield {"id": "chatcmpl-1", "object": "chat.completion.chunk", "model": "m",
+                   "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
@@ -0,0 +1,130 @@
+import pytest
+from test_stream_accumulator import chat_chunk
+
+from rapida.globals import rapida_global
+from rapida.openai_async.openai_injector import OpenAIInjector
+from rapida.openai_async.stream_accumulator import StreamAccumulator
+from rapida.usage import ApproximateTokenizer, Tokenizer, UsageEstimator
+
+
+class WordTokenizer(Tokenizer):
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+
+def word_estimator(created=None):
+    def factory(model):
+        if (created is not None):
+            created.append(model)
+        return WordTokenizer()
+    return UsageEstimator(tokenizer_factory=factory)
+
+
+def test_approximate_tokenizer():
+    tokenizer = ApproximateTokenizer()
+    assert tokenizer.count("") == 0
+    assert tokenizer.count("a") == 1
+    assert tokenizer.count("x" * 40) == 10
+
+
+def test_tokenizers_are_cached_per_model():
+    created = []
+    estimator = word_estimator(created)
+    for model in ["gpt-4", "gpt-4", "gpt-3.5-turbo"]:
+        estimator.tokenizer(model)
+    assert created == ["gpt-4", "gpt-3.5-turbo"]
+
+
+def test_prompt_tokens_follow_the_chat_format():
+    estimator = word_estimator()
+    body = {"messages": [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "name": "bob", "content": "hello there you"},
+    ]}
+    # 3 priming + 2 * 3 per message + roles, contents and the name + 1 per name.
+    assert estimator.prompt_tokens("gpt-4", body) == 3 + 6 + (1 + 2) + (1 + 1 + 3) + 1
+    assert estimator.prompt_tokens("text-davinci-003", {"prompt": "one two"}) == 2
+    assert estimator.prompt_tokens("text-davinci-003", {"prompt": [[1, 2, 3]]}) == 3
+
+
+def test_stream_usage_is_counted_per_delta():
+    estimator = word_estimator()
+    usage = estimator.stream({"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "hi"}]})
+    accumulator = StreamAccumulator(usage)
+    for chunk in [
+        chat_chunk({"role": "assistant", "content": ""}),
+        chat_chunk({"content": "Hello"}),
+        chat_chunk({"content": " big world"}),
+        chat_chunk({"function_call": {"name": "f", "arguments": "{}"}}, index=1),
+        chat_chunk({}, finish_reason="stop"),
+    ]:
+        accumulator.add(chunk)
+
+    assert accumulator.build()["usage"] == {
+        "prompt_tokens": 3 + 3 + 2,
+        "completion_tokens": 5,
+        "total_tokens": 13,
+        "estimated": True,
+        "estimated_cost_usd": round((8 * 0.0015 + 5 * 0.002) / 1000, 8),
+    }
+
+
+def test_unknown_models_have_no_cost():
+    assert word_estimator().cost("my-finetune", 10, 10) is None
+    assert word_estimator().cost("gpt-4-0613", 1000, 1000) == 0.09
+
+
+def test_tiktoken_counts_tokens():
+    pytest.importorskip("tiktoken")
+    assert UsageEstimator().tokenizer("gpt-3.5-turbo").count("Hello world") == 2
+
+
+class ChatCompletion:
+    @classmethod
+    def create(cls, **kwargs):
+        return (chunk for chunk in [chat_chunk({"content": "one two"}),
+                                    chat_chunk({"content": " three"})])
+
+
+def run_stream(logs):
+    create = OpenAIInjector()._with_rapida_auth(ChatCompletion.create)
+    list(create(model="gpt-4", messages=[], stream=True))
+    return logs[-1].providerResponse.json
+
+
+def test_async_mode_logs_estimated_stream_usage(logs, configure):
+    configure(usage_estimator=word_estimator())
+    assert run_stream(logs)["usage"]["completion_tokens"] == 3
+    configure(usage_estimator=None)
+    assert "usage" not in run_stream(logs)
+
+
+def test_estimation_is_opt_in(logs):
+    assert rapida_global.usage_estimator is None
+    assert "usage" not in run_stream(logs)
+
+
+class BrokenTokenizer(Tokenizer):
+    def count(self, text: str) -> int:
+        raise RuntimeError("tokenizer broke")
+
+
+class BrokenEstimator(UsageEstimator):
+    def stream(self, body):
+        raise RuntimeError("estimator broke")
+
+
+def test_failing_tokenizers_never_fail_the_call(logs, configure):
+    def failing_factory(model):
+        raise OSError("could not download the encoding")
+
+    estimator = UsageEstimator(tokenizer_factory=failing_factory)
+    assert isinstance(estimator.tokenizer("gpt-4"), ApproximateTokenizer)
+
+    configure(usage_estimator=BrokenEstimator())
+    # The estimate failed, the stream is logged without usage.
+    assert "usage" not in run_stream(logs)
+
+    # Deltas the tokenizer cannot count are approximated.
+    configure(usage_estimator=UsageEstimator(tokenizer_factory=lambda model: BrokenTokenizer()))
+    assert run_stream(logs)["usage"]["completion_tokens"] == 4